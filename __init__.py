@@ -1,9 +1,10 @@
 import os
-from .init_db import init_db
 
 
-def create_app():
+def create_app(test_config=None):
+    import click
     from flask import Flask
+    from .engine import SQLITE_PRAGMAS, SQLITE_ENGINE_OPTIONS
 
     app = Flask(__name__)
     basedir = os.path.abspath(os.path.dirname(__file__))
@@ -11,10 +12,57 @@ def create_app():
     app.config.from_mapping(
             SECRET_KEY=os.getenv('SECRET_KEY'),
             UPLOAD_FOLDER=os.path.join(basedir, 'pictures/'),
+            UPLOAD_URL='/pictures/',
+            DERIVATIVE_SIZES=[160, 640, 1280],
+            DERIVATIVE_FORMAT='webp',
+            DERIVATIVE_WORKERS=None,
+            X_ACCEL_REDIRECT=None,
             SQLALCHEMY_DATABASE_URI=\
                     'sqlite:///' + os.path.join(basedir, 'master.db'),
-            SQLALCHEMY_TRACK_MODIFICATIONS=False
+            SQLALCHEMY_TRACK_MODIFICATIONS=False,
+            DATABASE_MODE=os.getenv('DATABASE_MODE', 'persistent'),
+            SQLALCHEMY_ENGINE_OPTIONS=dict(SQLITE_ENGINE_OPTIONS),
+            SQLITE_PRAGMAS=dict(SQLITE_PRAGMAS),
+            SQLITE_BUSY_RETRIES=3,
+            PAGINATION_TOTAL_TTL=30,
+            ACL_CACHE_SIZE=1024,
+            ACL_CACHE_TTL=60,
+            ACL_CACHE_SHARED=False,
+            METRICS_ENABLED=True,
+            METRICS_DIR=os.getenv('PROMETHEUS_MULTIPROC_DIR'),
+            METRICS_FLUSH_INTERVAL=1,
+            PROFILE_DIR=os.getenv('PROFILE_DIR'),
+            PROFILE_TOKEN=os.getenv('PROFILE_TOKEN'),
+            PROFILE_ALL=False,
+            PROFILE_INTERVAL=0.001,
+            RESPONSE_CACHE_BYTES=32 * 1024 * 1024,
+            RESPONSE_CACHE_VERSION_TTL=1,
+            UPLOAD_ASYNC=False,
+            INGEST_WORKERS=4,
+            UPLOAD_BATCH_WORKERS=4,
+            UPLOAD_BATCH_LIMIT=500,
+            GALLERY_PHOTOS_LIMIT=100,
+            CURSOR_PER_PAGE_LIMIT=100,
+            STREAM_YIELD_PER=1000,
+            STREAM_CHUNK_BYTES=64 * 1024,
+            COMPRESS_ENCODINGS=['zstd', 'br', 'gzip'],
+            COMPRESS_MIMETYPES=['application/json', 'text/plain'],
+            COMPRESS_MIN_SIZE=1024,
+            COMPRESS_GZIP_LEVEL=6,
+            COMPRESS_BROTLI_QUALITY=5,
+            COMPRESS_ZSTD_LEVEL=3,
+            BATCH_LIMIT=100,
+            SUBJECT_PREFIX_LIMIT=100,
+            UPLOAD_SESSION_MAX_BYTES=100 * 1024 * 1024,
+            UPLOAD_SESSION_TTL=24 * 3600,
+            UPLOAD_SESSION_GC_INTERVAL=600,
+            UPLOAD_JOB_TIMEOUT=30 * 60
         )
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
+    # Flask-Migrate pulls in alembic, which only the CLI needs
+    from_cli = click.get_current_context(silent=True) is not None
 
     from .views import bp as views_bp
     app.register_blueprint(views_bp)
@@ -22,14 +70,41 @@ def create_app():
     from .errors import bp as errors_bp
     app.register_blueprint(errors_bp)
 
-    from .exts import db, migrate
+    from .files import bp as files_bp
+    app.register_blueprint(files_bp, url_prefix=app.config["UPLOAD_URL"].rstrip('/'))
+
+    from . import serializer
+    serializer.init_app(app)
+
+    from .exts import db, init_migrate
     db.init_app(app)
-    migrate.init_app(app, db)
+    if from_cli:
+        init_migrate(app)
+
+    from . import acl, batch, cache, commands, compression, engine, metrics, profiler, uploads
+    engine.init_app(app)
+    acl.init_app(app)
+    batch.init_app(app)
+    cache.init_app(app)
+    metrics.init_app(app)
+    profiler.init_app(app)
+    compression.init_app(app)
+    commands.init_app(app)
+
+    from .init_db import init_db, check_schema
+
+    # Loaded from the root "flask" context the app only resolves one of its
+    # own commands, the schema commands (db, seed) have to run against any
+    # revision and the others check it themselves
+    context = click.get_current_context(silent=True)
+    resolving_command = context is not None and context.parent is None
 
-    from .models import User, Gallery, Photo
-    
     with app.app_context():
-        init_db()
+        if app.config["DATABASE_MODE"] == "reset":
+            init_db()
+        elif not resolving_command:
+            check_schema()
+            uploads.collect()
     return app
 
 
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+from .exts import db
+from .models import User, user_sites, acl_generation
+
+
+class ACLCache:
+    """
+    Bounded LRU cache of user_id -> frozenset of site ids with TTL expiry
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.generation = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires, sites = entry
+            if expires < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return sites
+
+    def put(self, user_id, sites):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, sites)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def sync(self, generation):
+        if generation != self.generation:
+            self.invalidate()
+            self.generation = generation
+
+
+def init_app(app):
+    app.extensions["acl_cache"] = ACLCache(
+            app.config["ACL_CACHE_SIZE"],
+            app.config["ACL_CACHE_TTL"]
+            )
+
+
+def allowed_sites(user_id):
+    """
+    Returns the ids of sites the user has access to or None if the user doesn't exist
+    """
+    cache = current_app.extensions["acl_cache"]
+    if current_app.config["ACL_CACHE_SHARED"]:
+        cache.sync(db.session.execute(select(acl_generation.c.generation)).scalar())
+
+    sites = cache.get(user_id)
+    if sites is None:
+        rows = db.session.execute(
+                select(User.id, user_sites.c.site_id)
+                .outerjoin(user_sites, user_sites.c.user_id == User.id)
+                .where(User.id == user_id)
+                ).all()
+        if not rows:
+            return None
+        sites = frozenset(x.site_id for x in rows if x.site_id is not None)
+        cache.put(user_id, sites)
+    return sites
+
+
+@event.listens_for(User.sites, "append")
+@event.listens_for(User.sites, "remove")
+def _user_sites_changed(target, value, initiator):
+    session = object_session(target)
+    if session is not None and target.id is not None:
+        session.info.setdefault("acl_changed", set()).add(target.id)
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_changed(session):
+    changed = session.info.pop("acl_changed", None)
+    if changed and has_app_context():
+        cache = current_app.extensions["acl_cache"]
+        for user_id in changed:
+            cache.invalidate(user_id)
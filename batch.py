@@ -0,0 +1,162 @@
+from flask import Blueprint, current_app, g, request, abort
+from sqlalchemy.exc import OperationalError
+from werkzeug.exceptions import BadRequest, Forbidden, HTTPException, InternalServerError
+from .acl import allowed_sites
+from .engine import begin_immediate, is_busy, retry_on_busy
+from .exts import db
+
+bp = Blueprint("batch", __name__)
+
+
+class Batch:
+    """
+    State of a running batch, shared by its operations through g
+    """
+
+    def __init__(self, sites):
+        self.sites = sites
+        self.deferred = []
+
+
+def active():
+    return "batch" in g
+
+
+def commit():
+    """
+    Commits the view's changes, inside a batch only flushes them so that the
+    whole batch is committed once
+    """
+    if active():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def defer(f, *args):
+    """
+    Runs side effects that have to wait for the commit, like releasing
+    blobs, after the batch is committed
+    """
+    if active():
+        g.batch.deferred.append((f, args))
+    else:
+        f(*args)
+
+
+def begin():
+    """
+    pysqlite opens its transaction only before a write, a SAVEPOINT outside
+    of one would start it and RELEASE would commit it, so the batch opens
+    the transaction itself and takes the write lock up front
+    """
+    begin_immediate()
+
+
+def error_response(e):
+    return current_app.make_response(current_app.handle_http_exception(e))
+
+
+def dispatch(operation, source):
+    """
+    Runs one operation through the regular view, hooks and error handlers
+    """
+    with current_app.test_request_context(
+            operation["path"],
+            method=operation["method"],
+            json={**operation.get("json", {}), "source": source}
+            ):
+        try:
+            response = current_app.full_dispatch_request()
+        except Exception as e:
+            # a busy database retries the whole batch
+            if isinstance(e, OperationalError) and is_busy(e):
+                raise
+            current_app.logger.exception("The batch operation (%s %s) failed", operation["method"], operation["path"])
+            response = error_response(InternalServerError())
+        return response.status_code, response.get_json(silent=True)
+
+
+def authorize(operations, sites):
+    """
+    Returns the error of each operation touching a site the user can't
+    access, every site is checked once for the whole batch
+    """
+    adapter = current_app.url_map.bind("localhost")
+    errors = []
+    for operation in operations:
+        error = None
+        try:
+            endpoint, args = adapter.match(operation["path"].split("?")[0], operation["method"])
+        except HTTPException as e:
+            error = e
+        else:
+            if endpoint == "batch.batch_post":
+                error = BadRequest("A batch can't contain another batch")
+            elif "site_id" in args and args["site_id"] not in sites:
+                error = Forbidden(f"The user is not allowed to access the site ({args['site_id']})")
+        errors.append(error)
+    return errors
+
+
+@bp.route("/batch", methods=["POST"])
+@retry_on_busy
+def batch_post():
+    """
+    [User] Wykonuje listę operacji w jednej transakcji
+    """
+    if "source" not in request.json:
+        abort(400, "The source object is required in request json")
+    operations = request.json.get("operations")
+    if not isinstance(operations, list) or not operations:
+        abort(400, "The operations should be a non-empty list")
+    if len(operations) > current_app.config["BATCH_LIMIT"]:
+        abort(400, f"At most {current_app.config['BATCH_LIMIT']} operations can be run at once")
+    for operation in operations:
+        if not isinstance(operation, dict) or not isinstance(operation.get("path"), str):
+            abort(400, "Each operation needs a path")
+        operation["method"] = operation.get("method", "GET").upper()
+    atomic = request.json.get("atomic", False) is True
+
+    source = request.json["source"]
+    sites = allowed_sites(source["user_id"])
+    if sites is None:
+        abort(404, f"The user with the given id ({source['user_id']}) doesn't exist")
+    errors = authorize(operations, sites)
+
+    g.batch = Batch(sites)
+    begin()
+    results = []
+    failed = False
+    try:
+        for operation, error in zip(operations, errors):
+            if failed:
+                results.append({"status": 424, "body": None})
+                continue
+            if error is not None:
+                response = error_response(error)
+                status, body = response.status_code, response.get_json(silent=True)
+            else:
+                savepoint = None if atomic else db.session.begin_nested()
+                status, body = dispatch(operation, source)
+                if savepoint is not None:
+                    if status >= 400:
+                        savepoint.rollback()
+                    else:
+                        savepoint.commit()
+            failed = atomic and status >= 400
+            results.append({"status": status, "body": body})
+    finally:
+        batch = g.pop("batch")
+
+    if failed:
+        db.session.rollback()
+    else:
+        db.session.commit()
+        for f, args in batch.deferred:
+            f(*args)
+    return {"committed": not failed, "data": results}, 200
+
+
+def init_app(app):
+    app.register_blueprint(bp)
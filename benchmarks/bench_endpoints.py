@@ -0,0 +1,410 @@
+"""
+Drives every route of the API through the Flask test client or a real
+threaded WSGI server with concurrent clients and reports throughput,
+latency percentiles and SQL query counts per endpoint.
+
+    python -m <package>.benchmarks.bench_endpoints --mode server --concurrency 8 \
+        --output after.json --baseline before.json --threshold 0.2
+
+Recorded traffic can be replayed with --replay, a JSONL file with one
+request per line:
+
+    {"method": "GET", "path": "/site/1/module/gallery", "json": {...}}
+    {"method": "POST", "path": "/site/1/module/gallery/1",
+     "form": {"description": "..."}, "files": {"file": "path/to/image.png"}}
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from io import BytesIO
+from flask import has_request_context, request
+from sqlalchemy import event
+from werkzeug.serving import WSGIRequestHandler, make_server
+from .. import create_app
+from ..dataset import generate, placeholder_png
+from ..exts import db
+from ..storage import blob_name
+
+
+SOURCE = {"source": {"app_name": "pl.api.cms.bench", "user_id": 1}}
+
+IMAGE = placeholder_png(424242, size=64)
+
+IMAGE_NAME = blob_name(hashlib.sha256(IMAGE).hexdigest(), "png")
+
+
+def paginate(**kwargs):
+    return {**SOURCE, "paginate": {"page": 1, "per_page": 20, "order": "sort", "order_desc": False, **kwargs}}
+
+
+def upload(description):
+    return {"form": {"description": description}, "files": {"file": ("bench.png", IMAGE)}}
+
+
+# Each step is (method, path, request, saved values). Paths and request
+# bodies may use values saved from earlier responses of the same pass.
+SCENARIO = [
+        ("GET", "/ping", None, None),
+        ("GET", "/metrics", None, None),
+        ("OPTIONS", "/site/1/module/gallery", {"json": SOURCE}, None),
+        ("GET", "/site/1/module/gallery", {"json": paginate()}, None),
+        ("GET", "/site/1/module/gallery", {"json": paginate(cursor=None)}, None),
+        ("POST", "/site/1/module/gallery",
+            {"json": {**SOURCE, "payload": {"name": "bench", "description": "bench gallery"}}},
+            lambda r, c: c.update(gallery=r["gallery_id"])),
+        ("GET", "/site/1/module/gallery/{gallery}", {"json": SOURCE}, None),
+        ("PUT", "/site/1/module/gallery/{gallery}",
+            {"json": {**SOURCE, "payload": {"name": "bench 2", "description": "bench gallery"}}}, None),
+        ("POST", "/site/1/module/gallery/{gallery}", upload("bench photo"),
+            lambda r, c: c.update(photo=r["photo_id"])),
+        ("POST", "/site/1/module/gallery/{gallery}", {**upload("bench async photo"), "headers": {"Prefer": "respond-async"}},
+            lambda r, c: c.update(job=r["job_id"])),
+        ("GET", "/site/1/module/upload/{job}", {"json": SOURCE},
+            lambda r, c: c.update(async_photo=r["data"]["photo_id"])),
+        ("DELETE", "/site/1/module/gallery/{gallery}/photo/{async_photo}", {"json": SOURCE}, None),
+        ("POST", "/site/1/module/gallery/{gallery}/photos",
+            {"form": {"description": ["bench batch 1", "bench batch 2"]},
+             "files": {"file": [("bench1.png", IMAGE), ("bench2.png", IMAGE)]}},
+            lambda r, c: c.update(batch1=r["data"][0]["photo_id"], batch2=r["data"][1]["photo_id"])),
+        ("DELETE", "/site/1/module/gallery/{gallery}/photo/{batch1}", {"json": SOURCE}, None),
+        ("DELETE", "/site/1/module/gallery/{gallery}/photo/{batch2}", {"json": SOURCE}, None),
+        ("POST", "/site/1/module/gallery/{gallery}/upload",
+            {"json": {**SOURCE, "payload": {"filename": "bench.png", "length": len(IMAGE), "description": "bench"}}},
+            lambda r, c: c.update(session=r["upload_id"])),
+        ("HEAD", "/site/1/module/upload/session/{session}", None, None),
+        ("PATCH", "/site/1/module/upload/session/{session}",
+            {"body": IMAGE[:len(IMAGE) // 2], "headers": {"Upload-Offset": "0"}}, None),
+        ("PATCH", "/site/1/module/upload/session/{session}",
+            {"body": IMAGE[len(IMAGE) // 2:], "headers": {"Upload-Offset": str(len(IMAGE) // 2)}},
+            lambda r, c: c.update(resumed=r["photo_id"])),
+        ("DELETE", "/site/1/module/gallery/{gallery}/photo/{resumed}", {"json": SOURCE}, None),
+        ("GET", "/site/1/module/photo/blob/" + IMAGE_NAME[6:70], {"json": SOURCE}, None),
+        ("GET", "/pictures/" + IMAGE_NAME, None, None),
+        ("PUT", "/site/1/module/gallery/{gallery}/photo/{photo}", upload("bench photo"), None),
+        ("PUT", "/site/1/module/gallery/{gallery}/photo/{photo}/update",
+            {"json": {**SOURCE, "payload": {"description": "bench photo 2"}}}, None),
+        ("GET", "/site/1/module/gallery", {"json": {**paginate(), "include": ["photos"], "fields": ["name"]}}, None),
+        ("GET", "/site/1/module/gallery/{gallery}/photos", {"json": {**SOURCE, "paginate": {"per_page": 20}}}, None),
+        ("GET", "/site/1/module/gallery/{gallery}/photos",
+            {"json": {**SOURCE, "stream": True}, "headers": {"Accept-Encoding": "gzip"}}, None),
+        ("POST", "/batch", {"json": lambda c: {**SOURCE, "operations": [
+            {"method": "PUT", "path": f"/site/1/module/gallery/{c['gallery']}/photo/{c['photo']}/update",
+                "json": {"payload": {"description": f"bench photo {x}"}}}
+            for x in range(10)
+            ]}}, None),
+        ("PUT", "/site/1/module/gallery/{gallery}/photos/update",
+            {"json": lambda c: {**SOURCE, "photos": [{"id": c["photo"], "description": "bench"}]}}, None),
+        ("PUT", "/site/1/module/gallery/{gallery}/photos/sort",
+            {"json": lambda c: {**SOURCE, "photos": [{"id": c["photo"], "sort": 1024}]}}, None),
+        ("PUT", "/site/1/module/gallery/{gallery}/photos/reorder",
+            {"json": lambda c: {**SOURCE, "order": [c["photo"]]}}, None),
+        ("PUT", "/site/1/module/gallery/{gallery}/photo/{photo}/move_up", {"json": SOURCE}, None),
+        ("PUT", "/site/1/module/gallery/{gallery}/photo/{photo}/move_down", {"json": SOURCE}, None),
+        ("PUT", "/site/1/module/gallery/{gallery}/move_up", {"json": SOURCE}, None),
+        ("PUT", "/site/1/module/gallery/{gallery}/move_down", {"json": SOURCE}, None),
+        ("GET", "/site/1/module/gallery", {"json": paginate(per_page=1000)},
+            lambda r, c: c.update(galleries=[x["id"] for x in r["data"]])),
+        ("PUT", "/site/1/module/gallery/reorder",
+            {"json": lambda c: {**SOURCE, "order": c["galleries"]}}, None),
+        ("GET", "/site/1/module/search", {"json": {**SOURCE, "query": "gallery"}}, None),
+        ("GET", "/site/1/module/subject", {"json": SOURCE}, None),
+        ("POST", "/site/1/module/subject", {"json": lambda c: {**SOURCE, "payload": {"subject": c["subject_name"]}}}, None),
+        ("GET", "/site/1/module/subject/{subject_name}", {"json": SOURCE},
+            lambda r, c: c.update(subject=r[0]["id"])),
+        ("GET", "/site/1/module/subject/{subject}", {"json": SOURCE}, None),
+        ("PUT", "/site/1/module/subject/{subject}",
+            {"json": lambda c: {**SOURCE, "payload": {"subject": c["subject_name"]}}}, None),
+        ("DELETE", "/site/1/module/subject/{subject}", {"json": SOURCE}, None),
+        ("DELETE", "/site/1/module/gallery/{gallery}/photo/{photo}", {"json": SOURCE}, None),
+        ("DELETE", "/site/1/module/gallery/{gallery}", {"json": SOURCE}, None),
+        ]
+
+
+def scenario_requests():
+    """
+    Yields the requests of one scenario pass, the caller sends each
+    response body back into the generator
+    """
+    context = {"subject_name": f"bench{uuid.uuid4().hex[:12]}"}
+    for method, path, spec, save in SCENARIO:
+        spec = dict(spec or {})
+        if callable(spec.get("json")):
+            spec["json"] = spec["json"](context)
+        body = yield {"method": method, "path": path.format(**context), **spec}
+        if save is not None:
+            save(body, context)
+
+
+def replay_requests(path):
+    items = []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            files = {}
+            for field, filename in item.get("files", {}).items():
+                with open(filename, "rb") as image:
+                    files[field] = (os.path.basename(filename), image.read())
+            items.append({**item, "files": files})
+    return items
+
+
+def fields(values):
+    """
+    Yields (name, value) pairs of a form or files dict whose values may be
+    lists of repeated fields
+    """
+    for name, value in values.items():
+        for item in value if isinstance(value, list) else [value]:
+            yield name, item
+
+
+def encode_multipart(form, files):
+    boundary = uuid.uuid4().hex
+    body = BytesIO()
+    for name, value in fields(form):
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in fields(files):
+        body.write(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+                )
+        body.write(content + b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+class ClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, item):
+        kwargs = {"headers": item.get("headers", {})}
+        if item.get("files") or item.get("form"):
+            data = defaultdict(list)
+            for name, value in fields(item.get("form", {})):
+                data[name].append(value)
+            for name, (filename, content) in fields(item.get("files", {})):
+                data[name].append((BytesIO(content), filename))
+            kwargs["data"] = dict(data)
+            kwargs["content_type"] = "multipart/form-data"
+        elif item.get("body") is not None:
+            kwargs["data"] = item["body"]
+            kwargs["content_type"] = "application/offset+octet-stream"
+        elif item.get("json") is not None:
+            kwargs["json"] = item["json"]
+        resp = self.client.open(item["path"], method=item["method"], **kwargs)
+        return resp.status_code, resp.get_data()
+
+    def close(self):
+        pass
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class ServerTransport:
+    def __init__(self, app):
+        self.server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+        self.base = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def send(self, item):
+        headers = dict(item.get("headers", {}))
+        data = None
+        if item.get("files") or item.get("form"):
+            data, headers["Content-Type"] = encode_multipart(item.get("form", {}), item.get("files", {}))
+        elif item.get("body") is not None:
+            data = item["body"]
+            headers["Content-Type"] = "application/offset+octet-stream"
+        elif item.get("json") is not None:
+            data = json.dumps(item["json"]).encode()
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.base + item["path"], data=data, headers=headers, method=item["method"])
+        try:
+            with urllib.request.urlopen(req) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def close(self):
+        self.server.shutdown()
+
+
+class Recorder:
+    def __init__(self, app):
+        self.app = app
+        self.adapter = app.url_map.bind("localhost")
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.queries = defaultdict(int)
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", self.count_query)
+
+    def count_query(self, *args):
+        if has_request_context() and request.endpoint:
+            with self.lock:
+                self.queries[request.endpoint] += 1
+
+    def endpoint(self, item):
+        try:
+            return self.adapter.match(item["path"].split("?")[0], method=item["method"])[0]
+        except Exception:
+            return "unmatched"
+
+    def send(self, transport, item):
+        endpoint = self.endpoint(item)
+        start = time.perf_counter()
+        status, body = transport.send(item)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies[endpoint].append(elapsed)
+            if status >= 400:
+                self.errors[endpoint] += 1
+        if status >= 400:
+            print(item["method"], item["path"], status, body[:200], file=sys.stderr)
+        try:
+            return json.loads(body) if body else None
+        except ValueError:
+            return None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_scenario(recorder, transport, passes):
+    for _ in range(passes):
+        steps = scenario_requests()
+        item = next(steps)
+        try:
+            while True:
+                item = steps.send(recorder.send(transport, item))
+        except StopIteration:
+            pass
+
+
+def run_replay(recorder, transport, items, passes):
+    for _ in range(passes):
+        for item in items:
+            recorder.send(transport, item)
+
+
+def summarize(recorder, mode, duration):
+    endpoints = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        endpoints[endpoint] = {
+                "count": len(latencies),
+                "errors": recorder.errors[endpoint],
+                "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+                "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+                "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+                "queries_per_request": round(recorder.queries[endpoint] / len(latencies), 2),
+                }
+    total = sum(x["count"] for x in endpoints.values())
+    return {
+            "mode": mode,
+            "requests": total,
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(total / duration, 1),
+            "endpoints": endpoints,
+            }
+
+
+def compare(baseline, results, threshold, min_delta_ms):
+    regressions = []
+    for endpoint, new in results["endpoints"].items():
+        old = baseline["endpoints"].get(endpoint)
+        if old is None:
+            continue
+        if new["p95_ms"] > old["p95_ms"] * (1 + threshold) and new["p95_ms"] - old["p95_ms"] > min_delta_ms:
+            regressions.append(f"{endpoint}: p95 {old['p95_ms']}ms -> {new['p95_ms']}ms")
+        if new["queries_per_request"] > old["queries_per_request"]:
+            regressions.append(
+                    f"{endpoint}: queries per request {old['queries_per_request']} -> {new['queries_per_request']}"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["client", "server"], default="client")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent clients in server mode.")
+    parser.add_argument("--passes", type=int, default=20, help="Scenario or replay passes per client.")
+    parser.add_argument("--replay", help="JSONL file with recorded requests to replay instead of the scenario.")
+    parser.add_argument("--photos", type=int, default=0, help="Generate a dataset of this many photos first.")
+    parser.add_argument("--output", help="Save the results as JSON.")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative p95 increase.")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore p95 changes below this.")
+    args = parser.parse_args()
+
+    # stdout is kept for the JSON results
+    with tempfile.TemporaryDirectory() as tmp, redirect_stdout(sys.stderr):
+        app = create_app({
+                "DATABASE_MODE": "reset",
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(tmp, "bench.db"),
+                "UPLOAD_FOLDER": os.path.join(tmp, "pictures/"),
+                "DERIVATIVE_WORKERS": 0,
+                "INGEST_WORKERS": 0,
+                })
+        if args.photos:
+            with app.app_context():
+                generate(users=10, sites=100, subjects=1000, subjects_per_site=20,
+                         galleries=max(args.photos // 50, 1), photos=args.photos, seed=1)
+
+        recorder = Recorder(app)
+        transport = ServerTransport(app) if args.mode == "server" else ClientTransport(app)
+        clients = args.concurrency if args.mode == "server" else 1
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=clients) as pool:
+                if args.replay:
+                    items = replay_requests(args.replay)
+                    futures = [pool.submit(run_replay, recorder, transport, items, args.passes)
+                               for _ in range(clients)]
+                else:
+                    futures = [pool.submit(run_scenario, recorder, transport, args.passes)
+                               for _ in range(clients)]
+                for future in futures:
+                    future.result()
+        finally:
+            transport.close()
+        results = summarize(recorder, args.mode, time.perf_counter() - start)
+
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["mode"] != results["mode"]:
+            print(f"WARNING comparing {results['mode']} results with a {baseline['mode']} baseline", file=sys.stderr)
+        regressions = compare(baseline, results, args.threshold, args.min_delta_ms)
+        for regression in regressions:
+            print("REGRESSION", regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
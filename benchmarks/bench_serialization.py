@@ -0,0 +1,93 @@
+"""
+Measures how many photo rows per second a large gallery page turns into
+JSON through the ORM (full objects and as_dict) and through the column
+projected read path in reads.py, with the stdlib json module and with
+orjson when it's installed.
+
+    python -m <package>.benchmarks.bench_serialization --photos 5000 --repeat 20
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from sqlalchemy import insert, select
+from .. import create_app, reads, serializer
+from ..exts import db
+from ..models import Gallery, Photo
+
+
+def fill_gallery(gallery_id, photos):
+    db.session.execute(insert(Photo.__table__), [
+            {
+                "filename": f"{x:064x}.png",
+                "sha256": f"{x:064x}",
+                "description": f"photo description {x}",
+                "sort": (x + 1) * 1024,
+                "gallery_id": gallery_id,
+                "derivatives": {"160": f"{x:064x}_160.webp", "640": f"{x:064x}_640.webp"}
+                }
+            for x in range(photos)
+            ])
+    db.session.commit()
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"))
+
+
+def orm_page(gallery_id):
+    gallery = db.session.get(Gallery, gallery_id)
+    return {"data": gallery.as_dict()}
+
+
+def core_page(gallery_id):
+    row = db.session.execute(reads.galleries(1).where(Gallery.id == gallery_id)).first()
+    return {"data": reads.gallery_dicts([row])[0]}
+
+
+def measure(build, dumps, gallery_id, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        dumps(build(gallery_id))
+        db.session.expunge_all()
+        db.session.rollback()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=5000, help="Photos in the measured gallery.")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    variants = [("orm + json", orm_page, stdlib_dumps), ("core + json", core_page, stdlib_dumps)]
+    with tempfile.TemporaryDirectory() as tmp, redirect_stdout(sys.stderr):
+        app = create_app({
+                "DATABASE_MODE": "reset",
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(tmp, "bench.db"),
+                "UPLOAD_FOLDER": os.path.join(tmp, "pictures/"),
+                })
+        with app.test_request_context():
+            if serializer.enabled():
+                variants.append(("core + orjson", core_page, app.json.dumps))
+            fill_gallery(1, args.photos)
+            photos = db.session.execute(select(Gallery.photo_count).where(Gallery.id == 1)).scalar()
+            results = {}
+            for name, build, dumps in variants:
+                measure(build, dumps, 1, 1)
+                elapsed = measure(build, dumps, 1, args.repeat)
+                results[name] = {
+                        "rows_per_s": round(photos * args.repeat / elapsed),
+                        "ms_per_page": round(elapsed / args.repeat * 1000, 2),
+                        }
+    baseline = results["orm + json"]["rows_per_s"]
+    for name, result in results.items():
+        result["speedup"] = round(result["rows_per_s"] / baseline, 2)
+    print(json.dumps({"photos_per_page": photos, "results": results}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Compares the throughput of concurrent readers and writers on a SQLite
+database with the default settings and with the engine profile from
+engine.py.
+
+    python -m <package>.benchmarks.bench_sqlite --readers 8 --writers 2
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from functools import partial
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from ..engine import SQLITE_ENGINE_OPTIONS, SQLITE_PRAGMAS, apply_pragmas, is_busy
+
+
+ROWS = 10000
+
+
+def make_engine(path, tuned):
+    if not tuned:
+        return create_engine(f"sqlite:///{path}")
+    engine = create_engine(f"sqlite:///{path}", **SQLITE_ENGINE_OPTIONS)
+    event.listen(engine, "connect", partial(apply_pragmas, SQLITE_PRAGMAS))
+    return engine
+
+
+def prepare(engine):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY, value TEXT, counter INTEGER)"))
+        conn.execute(
+                text("INSERT INTO item (value, counter) VALUES (:value, 0)"),
+                [{"value": f"item {x}"} for x in range(ROWS)]
+                )
+
+
+def reader(engine, stop, stats):
+    while not stop.is_set():
+        start = random.randint(1, ROWS - 50)
+        try:
+            with engine.connect() as conn:
+                conn.execute(
+                        text("SELECT * FROM item WHERE id BETWEEN :a AND :b"),
+                        {"a": start, "b": start + 50}
+                        ).all()
+            stats["reads"] += 1
+        except OperationalError as e:
+            if not is_busy(e):
+                raise
+            stats["busy"] += 1
+
+
+def writer(engine, stop, stats):
+    while not stop.is_set():
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                        text("UPDATE item SET counter = counter + 1 WHERE id = :id"),
+                        {"id": random.randint(1, ROWS)}
+                        )
+                conn.execute(
+                        text("INSERT INTO item (value, counter) VALUES ('new', 0)")
+                        )
+            stats["writes"] += 1
+        except OperationalError as e:
+            if not is_busy(e):
+                raise
+            stats["busy"] += 1
+
+
+def run(tuned, readers, writers, duration):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = make_engine(os.path.join(tmp, "bench.db"), tuned)
+        prepare(engine)
+        stop = threading.Event()
+        stats = [{"reads": 0, "writes": 0, "busy": 0} for _ in range(readers + writers)]
+        threads = [
+                threading.Thread(target=reader if i < readers else writer, args=(engine, stop, stats[i]))
+                for i in range(readers + writers)
+                ]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    total = {key: sum(x[key] for x in stats) for key in ["reads", "writes", "busy"]}
+    return {
+            "profile": "tuned" if tuned else "default",
+            "reads_per_s": round(total["reads"] / duration, 1),
+            "writes_per_s": round(total["writes"] / duration, 1),
+            "busy_errors": total["busy"],
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    results = [run(tuned, args.readers, args.writers, args.duration) for tuned in [False, True]]
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
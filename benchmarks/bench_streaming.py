@@ -0,0 +1,72 @@
+"""
+Measures the peak Python memory and the bytes sent for a gallery with
+many photos, built in one go and streamed, uncompressed and with every
+installed Content-Encoding.
+
+    python -m <package>.benchmarks.bench_streaming --photos 20000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from .. import create_app, compression
+from .bench_serialization import fill_gallery
+
+
+SOURCE = {"source": {"app_name": "pl.api.cms.bench", "user_id": 1}}
+
+
+def measure(client, stream, encoding):
+    tracemalloc.start()
+    start = time.perf_counter()
+    resp = client.get(
+            "/site/1/module/gallery/1",
+            json={**SOURCE, "stream": stream},
+            headers={"Accept-Encoding": encoding or "identity"},
+            buffered=False
+            )
+    # the body is consumed chunk by chunk the way a WSGI server sends it
+    sent = sum(len(x) for x in resp.response)
+    resp.close()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+            "peak_mb": round(peak / 1024 / 1024, 2),
+            "sent_kb": round(sent / 1024, 1),
+            "ms": round(elapsed * 1000, 1),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", type=int, default=20000, help="Photos in the measured gallery.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, redirect_stdout(sys.stderr):
+        app = create_app({
+                "DATABASE_MODE": "reset",
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(tmp, "bench.db"),
+                "UPLOAD_FOLDER": os.path.join(tmp, "pictures/"),
+                "GALLERY_PHOTOS_LIMIT": args.photos * 2,
+                "RESPONSE_CACHE_BYTES": 0,
+                "METRICS_ENABLED": False,
+                })
+        with app.app_context():
+            fill_gallery(1, args.photos)
+        client = app.test_client()
+        results = {}
+        for encoding in [None, *compression.available(app.config["COMPRESS_ENCODINGS"])]:
+            for stream in [False, True]:
+                measure(client, stream, encoding)
+                name = ("streamed" if stream else "buffered") + " + " + (encoding or "identity")
+                results[name] = measure(client, stream, encoding)
+    print(json.dumps({"photos": args.photos, "results": results}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event, select
+from .exts import db
+from .models import Site, Subject, Gallery, Photo, site_subjects, sqlite_trigger
+
+
+# Every write that can change what the cached read routes return bumps
+# site.version, the triggers also cover Core bulk updates.
+sqlite_trigger(Gallery.__table__, "gallery_insert_version", """
+        AFTER INSERT ON gallery
+        BEGIN
+            UPDATE site SET version = version + 1 WHERE id = NEW.site_id;
+        END""")
+
+sqlite_trigger(Gallery.__table__, "gallery_update_version", """
+        AFTER UPDATE ON gallery
+        BEGIN
+            UPDATE site SET version = version + 1 WHERE id IN (OLD.site_id, NEW.site_id);
+        END""")
+
+sqlite_trigger(Gallery.__table__, "gallery_delete_version", """
+        AFTER DELETE ON gallery
+        BEGIN
+            UPDATE site SET version = version + 1 WHERE id = OLD.site_id;
+        END""")
+
+sqlite_trigger(Photo.__table__, "photo_insert_version", """
+        AFTER INSERT ON photo
+        BEGIN
+            UPDATE site SET version = version + 1
+            WHERE id = (SELECT site_id FROM gallery WHERE id = NEW.gallery_id);
+        END""")
+
+sqlite_trigger(Photo.__table__, "photo_update_version", """
+        AFTER UPDATE ON photo
+        BEGIN
+            UPDATE site SET version = version + 1
+            WHERE id IN (SELECT site_id FROM gallery WHERE id IN (OLD.gallery_id, NEW.gallery_id));
+        END""")
+
+sqlite_trigger(Photo.__table__, "photo_delete_version", """
+        AFTER DELETE ON photo
+        BEGIN
+            UPDATE site SET version = version + 1
+            WHERE id = (SELECT site_id FROM gallery WHERE id = OLD.gallery_id);
+        END""")
+
+sqlite_trigger(site_subjects, "site_subjects_insert_version", """
+        AFTER INSERT ON site_subjects
+        BEGIN
+            UPDATE site SET version = version + 1 WHERE id = NEW.site_id;
+        END""")
+
+sqlite_trigger(site_subjects, "site_subjects_delete_version", """
+        AFTER DELETE ON site_subjects
+        BEGIN
+            UPDATE site SET version = version + 1 WHERE id = OLD.site_id;
+        END""")
+
+# A subject is listed by every site it's connected to, its connections_count
+# changes whenever another site links or unlinks it
+sqlite_trigger(Subject.__table__, "subject_update_version", """
+        AFTER UPDATE ON subject
+        BEGIN
+            UPDATE site SET version = version + 1
+            WHERE id IN (SELECT site_id FROM site_subjects WHERE subject_id = NEW.id);
+        END""")
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized responses bounded by their total size in bytes,
+    entries are valid as long as the site version they were built for
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, data, mimetype):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._entries[key] = (version, data, mimetype)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted[1])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SiteVersions:
+    """
+    Site versions known to this process, trusted for VERSION_TTL seconds so
+    that conditional requests can be answered without SQL; commits made by
+    this process clear them right away
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._versions = {}
+
+    def get(self, site_id):
+        entry = self._versions.get(site_id)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        version = db.session.execute(select(Site.version).where(Site.id == site_id)).scalar()
+        self._versions[site_id] = (version, time.monotonic() + self.ttl)
+        return version
+
+    def clear(self):
+        self._versions = {}
+
+
+def init_app(app):
+    app.extensions["response_cache"] = ResponseCache(app.config["RESPONSE_CACHE_BYTES"])
+    app.extensions["site_versions"] = SiteVersions(app.config["RESPONSE_CACHE_VERSION_TTL"])
+
+
+def cache_key(kwargs):
+    body = request.get_json(silent=True) or {}
+    query = {k: v for k, v in body.items() if k != "source"}
+    return json.dumps(
+            [request.endpoint, sorted(kwargs.items()), query, request.query_string.decode()],
+            sort_keys=True
+            )
+
+
+def cached_response(f):
+    """
+    Serves the view from the response cache and answers If-None-Match with
+    304 while the site version is unchanged, placed under check_user so that
+    access is still checked for every request
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        # inside a batch the reads see its uncommitted writes
+        if "batch" in g:
+            return f(*args, **kwargs)
+        site_id = kwargs["site_id"]
+        version = current_app.extensions["site_versions"].get(site_id)
+        key = cache_key(kwargs)
+        etag = f"{site_id}-{version}-{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}"
+
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+
+        cache = current_app.extensions["response_cache"]
+        entry = cache.get(key, version)
+        if entry is not None:
+            response = Response(entry[1], mimetype=entry[2])
+        else:
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            cache.put(key, version, response.get_data(), response.mimetype)
+        response.set_etag(etag, weak=True)
+        return response
+    return decorated
+
+
+@event.listens_for(db.session, "after_commit")
+def _forget_versions(session):
+    if has_app_context() and "site_versions" in current_app.extensions:
+        current_app.extensions["site_versions"].clear()
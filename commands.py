@@ -0,0 +1,108 @@
+import click
+import functools
+from flask.cli import with_appcontext
+import time
+from . import dataset, derivatives, uploads
+from .init_db import init_db, check_schema
+from .models import Photo, rebuild_counters
+from .search import rebuild_search
+
+
+def current_schema(f):
+    """
+    create_app doesn't check the schema revision when it's loaded to resolve
+    a command, the commands working on the data check it before they run
+    """
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            check_schema()
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        return f(*args, **kwargs)
+    return wrapper
+
+
+@click.command("seed")
+@click.confirmation_option(prompt="This drops all data, continue?")
+@with_appcontext
+def seed_command():
+    """Tworzy bazę danych na nowo i wypełnia ją danymi testowymi."""
+    init_db()
+
+
+@click.command("generate")
+@click.option("--users", type=int, default=100, show_default=True)
+@click.option("--sites", type=int, default=1000, show_default=True)
+@click.option("--subjects", type=int, default=5000, show_default=True)
+@click.option("--subjects-per-site", type=int, default=20, show_default=True)
+@click.option("--galleries", type=int, default=20000, show_default=True)
+@click.option("--photos", type=int, default=1000000, show_default=True)
+@click.option("--skew", type=float, default=1.1, show_default=True,
+              help="Zipf exponent of photos per gallery and subject popularity.")
+@click.option("--images", type=int, default=0, show_default=True,
+              help="Number of placeholder images written to the upload folder.")
+@click.option("--batch", type=int, default=50000, show_default=True)
+@click.option("--seed", type=int, default=None)
+@click.option("--search/--no-search", default=True, show_default=True,
+              help="Rebuild the search index afterwards.")
+@with_appcontext
+@current_schema
+def generate_command(**options):
+    """Dodaje do bazy losowe dane o zadanej wielkości."""
+    start = time.perf_counter()
+    dataset.generate(**options)
+    click.echo(f"Dataset generated in {time.perf_counter() - start:.1f}s")
+
+
+@click.command("rebuild-counters")
+@with_appcontext
+@current_schema
+def rebuild_counters_command():
+    """Przelicza liczniki powiązań tematyk i zdjęć w albumach."""
+    rebuild_counters()
+    click.echo("Counters rebuilt")
+
+
+@click.command("regenerate-derivatives")
+@click.option("--missing", is_flag=True, help="Only photos without derivatives.")
+@click.option("--workers", type=int, default=None, help="Number of worker processes.")
+@with_appcontext
+@current_schema
+def regenerate_derivatives_command(missing, workers):
+    """Generuje pomniejszone kopie zdjęć."""
+    if not derivatives.enabled():
+        raise click.ClickException("Derivatives are disabled or Pillow is not installed")
+    photos = Photo.query
+    if missing:
+        photos = photos.filter(Photo.derivatives.is_(None))
+    count = 0
+    for _ in derivatives.regenerate(photos.all(), workers):
+        count += 1
+    click.echo(f"Derivatives of {count} photos regenerated")
+
+
+@click.command("rebuild-search")
+@with_appcontext
+@current_schema
+def rebuild_search_command():
+    """Odbudowuje indeks wyszukiwania albumów i zdjęć."""
+    rebuild_search()
+    click.echo("Search index rebuilt")
+
+
+@click.command("clean-uploads")
+@with_appcontext
+@current_schema
+def clean_uploads_command():
+    """Usuwa wygasłe sesje przesyłania, zawieszone zadania i porzucone pliki tymczasowe."""
+    click.echo(f"Removed {uploads.collect()} unfinished uploads")
+
+
+def init_app(app):
+    app.cli.add_command(seed_command)
+    app.cli.add_command(generate_command)
+    app.cli.add_command(rebuild_counters_command)
+    app.cli.add_command(regenerate_derivatives_command)
+    app.cli.add_command(rebuild_search_command)
+    app.cli.add_command(clean_uploads_command)
@@ -0,0 +1,96 @@
+import importlib.util
+import zlib
+from flask import current_app, request
+
+
+def gzip_compressor():
+    compressor = zlib.compressobj(current_app.config["COMPRESS_GZIP_LEVEL"], zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def brotli_compressor():
+    import brotli
+
+    compressor = brotli.Compressor(quality=current_app.config["COMPRESS_BROTLI_QUALITY"])
+    return compressor.process, compressor.finish
+
+
+def zstd_compressor():
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor(level=current_app.config["COMPRESS_ZSTD_LEVEL"]).compressobj()
+    return compressor.compress, compressor.flush
+
+
+# Content-Encoding: (module it needs, compressor factory)
+ENCODINGS = {
+        "zstd": ("zstandard", zstd_compressor),
+        "br": ("brotli", brotli_compressor),
+        "gzip": (None, gzip_compressor),
+        }
+
+
+def available(preferred):
+    """
+    The preferred encodings whose optional module is installed
+    """
+    return [
+            x for x in preferred
+            if x in ENCODINGS and (ENCODINGS[x][0] is None or importlib.util.find_spec(ENCODINGS[x][0]))
+            ]
+
+
+def compress_stream(iterable, compressor):
+    compress, finish = compressor
+    try:
+        for chunk in iterable:
+            data = compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+
+
+def after_request(response):
+    """
+    Compresses JSON and text responses with the best encoding the client
+    accepts, buffered ones only from COMPRESS_MIN_SIZE bytes on, streamed
+    ones chunk by chunk as they are written
+    """
+    if response.status_code < 200 or response.status_code in (204, 304) \
+            or response.direct_passthrough \
+            or "Content-Encoding" in response.headers \
+            or response.mimetype not in current_app.config["COMPRESS_MIMETYPES"]:
+        return response
+    response.vary.add("Accept-Encoding")
+
+    encoding = request.accept_encodings.best_match(current_app.extensions["compression"])
+    if encoding is None:
+        return response
+    compressor = ENCODINGS[encoding][1]()
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, compressor)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        compress, finish = compressor
+        response.set_data(compress(data) + finish())
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    """
+    Registered after the other after_request hooks so that it runs first and
+    they see the size sent over the wire
+    """
+    encodings = available(app.config["COMPRESS_ENCODINGS"])
+    if not encodings:
+        return
+    app.extensions["compression"] = encodings
+    app.after_request(after_request)
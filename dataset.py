@@ -0,0 +1,142 @@
+import hashlib
+import itertools
+import os
+import random
+import struct
+import zlib
+from contextlib import contextmanager
+from sqlalchemy import func, insert, select, text
+from .exts import db
+from .models import User, Site, Subject, Gallery, Photo, user_sites, site_subjects, \
+        acl_generation, fold, rebuild_counters, TRIGGERS
+from .ordering import GAP
+from .search import rebuild_search
+from . import storage
+
+
+def zipf_weights(n, skew):
+    return list(itertools.accumulate(1 / k ** skew for k in range(1, n + 1)))
+
+
+def placeholder_png(index, size=8):
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    pixel = (index % 0xffffff).to_bytes(3, "big")
+    row = b"\x00" + pixel * (size - 1) + (index // 0xffffff % 0xffffff).to_bytes(3, "big")
+    return b"\x89PNG\r\n\x1a\n" \
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)) \
+        + chunk(b"IDAT", zlib.compress(row * size)) \
+        + chunk(b"IEND", b"")
+
+
+def write_images(count):
+    images = []
+    for i in range(count):
+        content = placeholder_png(i)
+        digest = hashlib.sha256(content).hexdigest()
+        name = storage.blob_name(digest, "png")
+        path = storage.upload_path(name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(content)
+        images.append((name, digest))
+    return images
+
+
+@contextmanager
+def suspended_triggers():
+    """
+    Drops the counter, ACL and search triggers for a bulk load, the derived
+    data is rebuilt once afterwards instead of row by row
+    """
+    for name in TRIGGERS:
+        db.session.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    try:
+        yield
+    finally:
+        for ddl in TRIGGERS.values():
+            db.session.execute(ddl)
+
+
+def next_id(model):
+    return (db.session.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def insert_batches(table, rows, batch):
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, batch)):
+        db.session.execute(insert(table), chunk)
+
+
+def generate(users, sites, subjects, subjects_per_site, galleries, photos,
+             skew=1.1, images=0, batch=50000, seed=None, search=True):
+    rand = random.Random(seed)
+    first_user, first_site, first_subject, first_gallery, first_photo = \
+        (next_id(x) for x in [User, Site, Subject, Gallery, Photo])
+    user_ids = range(first_user, first_user + users)
+    site_ids = range(first_site, first_site + sites)
+    subject_ids = range(first_subject, first_subject + subjects)
+    gallery_ids = range(first_gallery, first_gallery + galleries)
+    corpus = write_images(images) if images else [("placeholder.png", None)]
+
+    with suspended_triggers():
+        insert_batches(User.__table__, (
+                {"id": x, "username": f"user {x}"} for x in user_ids
+                ), batch)
+        insert_batches(Site.__table__, (
+                {"id": x, "name": f"site {x}"} for x in site_ids
+                ), batch)
+        insert_batches(user_sites, (
+                {"user_id": user_ids[i % users] if i < users else rand.choice(user_ids), "site_id": x}
+                for i, x in enumerate(site_ids)
+                ), batch)
+        insert_batches(Subject.__table__, (
+                {"id": x, "subject": f"subject {x}", "subject_folded": fold(f"subject {x}")}
+                for x in subject_ids
+                ), batch)
+
+        popularity = zipf_weights(subjects, skew)
+        insert_batches(site_subjects, (
+                {"site_id": site_id, "subject_id": subject_id}
+                for site_id in site_ids
+                for subject_id in set(rand.choices(subject_ids, cum_weights=popularity, k=subjects_per_site))
+                ), batch)
+
+        insert_batches(Gallery.__table__, (
+                {
+                    "id": x,
+                    "name": f"gallery {x}",
+                    "description": f"gallery description {x}",
+                    "sort": (i // sites + 1) * GAP,
+                    "site_id": site_ids[i % sites]
+                    }
+                for i, x in enumerate(gallery_ids)
+                ), batch)
+
+        shuffled = list(gallery_ids)
+        rand.shuffle(shuffled)
+        owners = rand.choices(shuffled, cum_weights=zipf_weights(galleries, skew), k=photos)
+        owners.sort()
+        positions = {}
+
+        def photo_rows():
+            for i, gallery_id in enumerate(owners):
+                positions[gallery_id] = positions.get(gallery_id, 0) + GAP
+                filename, digest = corpus[i % len(corpus)]
+                yield {
+                        "id": first_photo + i,
+                        "filename": filename,
+                        "sha256": digest,
+                        "description": f"description {first_photo + i}",
+                        "sort": positions[gallery_id],
+                        "gallery_id": gallery_id
+                        }
+
+        insert_batches(Photo.__table__, photo_rows(), batch)
+
+    db.session.execute(acl_generation.update().values(generation=acl_generation.c.generation + 1))
+    rebuild_counters()
+    if search:
+        rebuild_search()
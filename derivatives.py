@@ -0,0 +1,129 @@
+import glob
+import importlib.util
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from flask import current_app
+from sqlalchemy import update
+from .exts import db
+from .models import Photo
+
+
+FORMATS = {"webp": "WEBP", "jpg": "JPEG", "jpeg": "JPEG"}
+
+
+def enabled():
+    return bool(current_app.config["DERIVATIVE_SIZES"]) \
+        and importlib.util.find_spec("PIL") is not None
+
+
+def derivative_name(filename, size, extension):
+    return f"{os.path.splitext(filename)[0]}_{size}.{extension}"
+
+
+def render(folder, filename, sizes, extension):
+    """
+    Writes the resized copies of one photo, runs in a worker process
+    """
+    from PIL import Image
+
+    result = {}
+    with Image.open(os.path.join(folder, filename)) as image:
+        image.load()
+        if FORMATS[extension] == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        for size in sizes:
+            name = derivative_name(filename, size, extension)
+            path = os.path.join(folder, name)
+            if not os.path.exists(path):
+                copy = image.copy()
+                copy.thumbnail((size, size))
+                tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                copy.save(tmp, FORMATS[extension])
+                os.replace(tmp, path)
+            result[str(size)] = name
+    return result
+
+
+def render_args(photo):
+    return (
+            current_app.config["UPLOAD_FOLDER"],
+            photo.filename,
+            current_app.config["DERIVATIVE_SIZES"],
+            current_app.config["DERIVATIVE_FORMAT"]
+            )
+
+
+def get_pool(app):
+    pool = app.extensions.get("derivatives_pool")
+    if pool is None:
+        pool = app.extensions["derivatives_pool"] = \
+            ProcessPoolExecutor(max_workers=app.config["DERIVATIVE_WORKERS"])
+    return pool
+
+
+def record(photo_id, derivatives):
+    db.session.execute(
+            update(Photo)
+            .where(Photo.id == photo_id)
+            .values(derivatives=derivatives, edit_date=Photo.edit_date)
+            )
+    db.session.commit()
+
+
+def _rendered(app, photo_id, future):
+    try:
+        derivatives = future.result()
+    except Exception:
+        app.logger.exception("Rendering derivatives of the photo (%s) failed", photo_id)
+        return
+    with app.app_context():
+        record(photo_id, derivatives)
+
+
+def schedule(photo):
+    """
+    Renders derivatives of a committed photo on the process pool and saves
+    their names on the photo once done
+    """
+    if not enabled():
+        return
+    if current_app.config["DERIVATIVE_WORKERS"] == 0:
+        # the photo is already committed, an image that can't be rendered
+        # mustn't fail the request that saved it
+        try:
+            record(photo.id, render(*render_args(photo)))
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception("Rendering derivatives of the photo (%s) failed", photo.id)
+        return
+    app = current_app._get_current_object()
+    future = get_pool(app).submit(render, *render_args(photo))
+    future.add_done_callback(partial(_rendered, app, photo.id))
+
+
+def regenerate(photos, workers=None):
+    """
+    Renders derivatives of many photos in parallel, yields each photo id
+    """
+    photos = [(x.id, render_args(x)) for x in photos]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(photo_id, pool.submit(render, *args)) for photo_id, args in photos]
+        for photo_id, future in futures:
+            try:
+                record(photo_id, future.result())
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception("Rendering derivatives of the photo (%s) failed", photo_id)
+                continue
+            yield photo_id
+
+
+def remove(filename):
+    pattern = derivative_name(glob.escape(filename), "[0-9]*", "*")
+    for path in glob.glob(os.path.join(current_app.config["UPLOAD_FOLDER"], pattern)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,78 @@
+import random
+import sqlite3
+import time
+from functools import partial, wraps
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from .exts import db
+
+
+SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "foreign_keys": "ON",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        }
+
+SQLITE_ENGINE_OPTIONS = {
+        "pool_size": 8,
+        "max_overflow": 8,
+        "pool_timeout": 30,
+        }
+
+
+def apply_pragmas(pragmas, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def init_app(app):
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", partial(apply_pragmas, app.config["SQLITE_PRAGMAS"]))
+
+
+def begin_immediate():
+    """
+    Opens the session's transaction with the write lock taken up front,
+    pysqlite would only begin it before the first write
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == "sqlite" and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def is_busy(error):
+    code = getattr(error.orig, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return "database is locked" in str(error.orig)
+
+
+def retry_on_busy(f):
+    """
+    Reruns the view in a new transaction when SQLite reports the database
+    as busy, which busy_timeout alone can't resolve for deferred
+    transactions upgrading to a write lock
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        from . import batch
+        retries = current_app.config["SQLITE_BUSY_RETRIES"]
+        for attempt in range(retries + 1):
+            try:
+                return f(*args, **kwargs)
+            except OperationalError as e:
+                # inside a batch the rollback would discard the operations
+                # run before this one, the whole batch is retried instead
+                if attempt == retries or not is_busy(e) or batch.active():
+                    raise
+                db.session.rollback()
+                time.sleep(0.01 * 2 ** attempt * random.random())
+    return decorated
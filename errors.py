@@ -37,6 +37,17 @@ def handle404(e):
             }, 404
 
 
+@bp.app_errorhandler(409)
+def handle409(e):
+    return {
+            "error": {
+                "message": e.description,
+                "type": "Conflict",
+                "code": str(e.code),
+                }
+            }, 409
+
+
 @bp.app_errorhandler(500)
 def handle500(e):
     return {
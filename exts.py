@@ -1,5 +1,21 @@
+import os
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 
 db = SQLAlchemy()
-migrate = Migrate()
+
+
+def include_name(name, type_, parent_names):
+    # the FTS5 index and its shadow tables are created by the migrations'
+    # raw DDL, autogenerate can't reflect them
+    return not (type_ == "table" and name.startswith("search_index"))
+
+
+def init_migrate(app):
+    from flask_migrate import Migrate
+    Migrate(
+            app,
+            db,
+            directory=os.path.join(os.path.dirname(__file__), "migrations"),
+            render_as_batch=True,
+            include_name=include_name
+            )
@@ -0,0 +1,55 @@
+import mimetypes
+import os
+import re
+from flask import Blueprint, abort, current_app, request, send_file
+from werkzeug.utils import safe_join
+from . import storage
+
+bp = Blueprint("files", __name__)
+
+CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(_\d+)?\.\w+$")
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def spooled(path):
+    """
+    Unfinished uploads are spooled under tmp/, the path is compared after
+    safe_join has normalised it, so ./tmp/ or x/../tmp/ can't reach them
+    """
+    tmp_dir = os.path.abspath(storage.upload_path("tmp"))
+    return os.path.commonpath([tmp_dir, os.path.abspath(path)]) == tmp_dir
+
+
+@bp.route("/<path:filename>", methods=["GET"])
+def photo_file_get(filename):
+    """
+    [Public] Podaje plik zdjęcia lub jego pomniejszonej kopii
+    """
+    path = safe_join(current_app.config["UPLOAD_FOLDER"], filename)
+    if path is None or spooled(path) or not os.path.isfile(path):
+        abort(404, f"The file with the given name ({filename}) doesn't exist")
+    filename = os.path.relpath(path, current_app.config["UPLOAD_FOLDER"]).replace(os.sep, "/")
+
+    immutable = CONTENT_ADDRESSED.match(filename) is not None
+    etag = os.path.basename(filename) if immutable else True
+
+    accel_prefix = current_app.config["X_ACCEL_REDIRECT"]
+    if accel_prefix:
+        response = current_app.response_class(
+                mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                )
+        response.headers["X-Accel-Redirect"] = accel_prefix + filename
+        if immutable:
+            response.set_etag(etag)
+        response = response.make_conditional(request)
+    else:
+        response = send_file(path, etag=etag, conditional=True)
+
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,128 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, request
+from sqlalchemy import update
+from sqlalchemy.sql import func
+from . import derivatives, ordering, storage, uploads
+from .engine import retry_on_busy
+from .exts import db
+from .models import Gallery, Photo, UploadJob
+
+
+def requested():
+    """
+    Uploads are ingested in the background when enabled for the whole app
+    or asked for by the client with Prefer: respond-async
+    """
+    if current_app.config["UPLOAD_ASYNC"]:
+        return True
+    return "respond-async" in request.headers.get("Prefer", "")
+
+
+def get_pool(app):
+    pool = app.extensions.get("ingest_pool")
+    if pool is None:
+        pool = app.extensions["ingest_pool"] = \
+            ThreadPoolExecutor(max_workers=app.config["INGEST_WORKERS"], thread_name_prefix="ingest")
+    return pool
+
+
+def submit(gallery, tmp, digest, extension, description):
+    """
+    Records an upload job for a spooled file and hands it to the worker pool
+    """
+    uploads.maybe_collect()
+    job = UploadJob(id=uuid.uuid4().hex, site_id=gallery.site_id, gallery_id=gallery.id)
+    db.session.add(job)
+    db.session.commit()
+
+    args = (job.id, tmp, digest, extension, description)
+    if current_app.config["INGEST_WORKERS"] == 0:
+        run_logged(*args)
+    else:
+        app = current_app._get_current_object()
+        get_pool(app).submit(run, app, *args)
+    return job
+
+
+def run(app, *args):
+    with app.app_context():
+        run_logged(*args)
+
+
+def run_logged(*args):
+    # the job records the failure, the client isn't waiting for the outcome
+    try:
+        ingest(*args)
+    except Exception:
+        current_app.logger.exception("Ingesting the upload (%s) failed", args[0])
+
+
+def ingest(job_id, tmp, digest, extension, description):
+    photo = None
+    error = "The upload couldn't be processed"
+    try:
+        storage.validate(tmp, extension)
+        photo = insert_photo(job_id, tmp, digest, extension, description)
+    except (OSError, ValueError) as e:
+        error = str(e)
+    finally:
+        if photo is None:
+            abandon(job_id, tmp, digest, extension, error)
+    if photo is not None:
+        derivatives.schedule(photo)
+
+
+def abandon(job_id, tmp, digest, extension, error):
+    """
+    Cleans up after an upload that didn't become a photo, whatever stopped
+    it: removes the spooled file or the blob it was already moved to, and
+    fails the job unless it has been finished already
+    """
+    db.session.rollback()
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    else:
+        storage.release(storage.blob_name(digest, extension), digest)
+    db.session.execute(
+            update(UploadJob)
+            .where(UploadJob.id == job_id, UploadJob.status == "pending")
+            .values(status="failed", error=error, finish_date=func.now())
+            )
+    db.session.commit()
+
+
+@retry_on_busy
+def insert_photo(job_id, tmp, digest, extension, description):
+    job = db.session.get(UploadJob, job_id)
+    if job.status != "pending":
+        # failed as stale by uploads.collect while it waited in the queue
+        return None
+    gallery = \
+        Gallery.query\
+        .filter_by(site_id=job.site_id, id=job.gallery_id)\
+        .first()
+    if gallery is None:
+        finish(job_id, error=f"The gallery with the given id ({job.gallery_id}) doesn't exist")
+        return None
+
+    photo = Photo(
+            filename=storage.blob_filename(digest, extension),
+            sha256=digest,
+            description=description,
+            sort=ordering.next_position(Photo, [Photo.gallery_id == gallery.id])
+            )
+    gallery.photos.append(photo)
+    storage.commit_blob_durably(tmp, photo.filename)
+    finish(job_id, photo_id=photo.id)
+    return photo
+
+
+def finish(job_id, photo_id=None, error=None):
+    job = db.session.get(UploadJob, job_id)
+    job.status = "failed" if error else "done"
+    job.photo_id = photo_id
+    job.error = error
+    job.finish_date = func.now()
+    db.session.commit()
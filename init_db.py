@@ -1,11 +1,51 @@
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
 from .exts import db
 from .models import *
 
 
+# The head revision in migrations/versions, a new migration has to move it
+SCHEMA_REVISION = "5a1c0e7d2b3f"
+
+
+def schema_revision():
+    try:
+        return db.session.execute(text("SELECT version_num FROM alembic_version")).scalar()
+    except OperationalError:
+        db.session.rollback()
+        return None
+
+
+def check_schema():
+    """
+    Raises when the database isn't migrated to the revision of the code
+    """
+    revision = schema_revision()
+    if revision != SCHEMA_REVISION:
+        raise RuntimeError(
+                f"The database schema is at revision {revision}, expected {SCHEMA_REVISION}, "
+                "run `flask db upgrade` or `flask seed`"
+                )
+
+
+def stamp_schema():
+    """
+    Marks a database created by create_all as migrated to the head revision
+    """
+    db.session.execute(text("""
+            CREATE TABLE IF NOT EXISTS alembic_version (
+                version_num VARCHAR(32) NOT NULL,
+                CONSTRAINT alembic_version_pkc PRIMARY KEY (version_num)
+            )"""))
+    db.session.execute(text("DELETE FROM alembic_version"))
+    db.session.execute(text("INSERT INTO alembic_version (version_num) VALUES (:revision)"), {"revision": SCHEMA_REVISION})
+
+
 def init_db():
     db.drop_all()
     db.create_all()
-    
+    stamp_schema()
+
     user1=User(username="user1")
     user2=User(username="user2")
 
@@ -40,31 +80,31 @@ def init_db():
     site4.subjects.append(subject2)
     site4.subjects.append(subject1)
 
-    gallery1 = Gallery(name="gallery 1", description="gallery description 1", sort=1, site_id=0)
-    gallery2 = Gallery(name="gallery 2", description="gallery description 2", sort=1, site_id=1)
-    gallery3 = Gallery(name="gallery 3", description="gallery description 3", sort=1, site_id=1)
-    gallery4 = Gallery(name="gallery 4", description="gallery description 4", sort=1, site_id=1)
-    gallery5 = Gallery(name="gallery 5", description="gallery description 5", sort=1, site_id=2)
-    gallery6 = Gallery(name="gallery 6", description="gallery description 6", sort=1, site_id=2)
-    gallery7 = Gallery(name="gallery 7", description="gallery description 7", sort=1, site_id=2)
-    gallery8 = Gallery(name="gallery 8", description="gallery description 8", sort=1, site_id=2)
-    gallery9 = Gallery(name="gallery 9", description="gallery description 9", sort=1, site_id=3)
-    gallery10 = Gallery(name="gallery 10", description="gallery description 10", sort=1, site_id=3)
-    gallery11 = Gallery(name="gallery 11", description="gallery description 11", sort=1, site_id=3)
-    gallery12 = Gallery(name="gallery 12", description="gallery description 12", sort=1, site_id=3)
-    gallery13 = Gallery(name="gallery 13", description="gallery description 13", sort=1, site_id=4)
-    gallery14 = Gallery(name="gallery 14", description="gallery description 14", sort=1, site_id=4)
-    gallery15 = Gallery(name="gallery 15", description="gallery description 15", sort=1, site_id=4)
-    gallery16 = Gallery(name="gallery 16", description="gallery description 16", sort=1, site_id=4)
-
-    photo1=Photo(filename="111.png", description="description 1", sort=1)
-    photo2=Photo(filename="222.png", description="description 2", sort=1)
-    photo3=Photo(filename="333.png", description="description 3", sort=1)
-    photo4=Photo(filename="444.png", description="description 4", sort=1)
-    photo5=Photo(filename="555.png", description="description 5", sort=1)
-    photo6=Photo(filename="666.png", description="description 6", sort=1)
-    photo7=Photo(filename="777.png", description="description 7", sort=1)
-    photo8=Photo(filename="888.png", description="description 8", sort=1)
+    gallery1 = Gallery(name="gallery 1", description="gallery description 1", sort=1024, site_id=0)
+    gallery2 = Gallery(name="gallery 2", description="gallery description 2", sort=2048, site_id=1)
+    gallery3 = Gallery(name="gallery 3", description="gallery description 3", sort=3072, site_id=1)
+    gallery4 = Gallery(name="gallery 4", description="gallery description 4", sort=4096, site_id=1)
+    gallery5 = Gallery(name="gallery 5", description="gallery description 5", sort=1024, site_id=2)
+    gallery6 = Gallery(name="gallery 6", description="gallery description 6", sort=2048, site_id=2)
+    gallery7 = Gallery(name="gallery 7", description="gallery description 7", sort=3072, site_id=2)
+    gallery8 = Gallery(name="gallery 8", description="gallery description 8", sort=4096, site_id=2)
+    gallery9 = Gallery(name="gallery 9", description="gallery description 9", sort=1024, site_id=3)
+    gallery10 = Gallery(name="gallery 10", description="gallery description 10", sort=2048, site_id=3)
+    gallery11 = Gallery(name="gallery 11", description="gallery description 11", sort=3072, site_id=3)
+    gallery12 = Gallery(name="gallery 12", description="gallery description 12", sort=4096, site_id=3)
+    gallery13 = Gallery(name="gallery 13", description="gallery description 13", sort=1024, site_id=4)
+    gallery14 = Gallery(name="gallery 14", description="gallery description 14", sort=2048, site_id=4)
+    gallery15 = Gallery(name="gallery 15", description="gallery description 15", sort=3072, site_id=4)
+    gallery16 = Gallery(name="gallery 16", description="gallery description 16", sort=4096, site_id=4)
+
+    photo1=Photo(filename="111.png", description="description 1", sort=1024)
+    photo2=Photo(filename="222.png", description="description 2", sort=2048)
+    photo3=Photo(filename="333.png", description="description 3", sort=3072)
+    photo4=Photo(filename="444.png", description="description 4", sort=4096)
+    photo5=Photo(filename="555.png", description="description 5", sort=1024)
+    photo6=Photo(filename="666.png", description="description 6", sort=2048)
+    photo7=Photo(filename="777.png", description="description 7", sort=3072)
+    photo8=Photo(filename="888.png", description="description 8", sort=4096)
 
     gallery1.photos.append(photo1)
     gallery1.photos.append(photo2)
@@ -0,0 +1,236 @@
+import glob
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from flask import Blueprint, Response, current_app, request
+from sqlalchemy import event
+from .exts import db
+
+
+bp = Blueprint("metrics", __name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+        "http_request_duration_seconds": ("histogram", "Request latency by endpoint"),
+        "http_requests_total": ("counter", "Requests by endpoint and status"),
+        "http_response_bytes_total": ("counter", "Response body bytes by endpoint"),
+        "db_queries_total": ("counter", "SQL statements executed by endpoint"),
+        "db_query_duration_seconds_total": ("counter", "Time spent in SQL statements by endpoint"),
+        "db_rows_total": ("counter", "Rows returned or affected by SQL statements by endpoint"),
+        }
+
+# Stack of the statistics of the requests handled by the current thread,
+# the operations of a batch run as requests nested in the batch's
+_state = threading.local()
+
+
+class Stats:
+    """
+    Duration and SQL statistics of one request, a statement is counted for
+    the innermost request only
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+
+    def count_row(self, cursor, row):
+        self.rows += 1
+        return row
+
+
+class Registry:
+    """
+    Counters keyed by (name, labels), histograms are stored as their
+    _bucket, _sum and _count counters so that snapshots of several
+    processes merge by adding values up
+    """
+
+    def __init__(self):
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._values[name, labels] += value
+
+    def observe(self, name, labels, value):
+        with self._lock:
+            for bound in BUCKETS:
+                self._values[name + "_bucket", labels + (("le", str(bound)),)] += value <= bound
+            self._values[name + "_bucket", labels + (("le", "+Inf"),)] += 1
+            self._values[name + "_sum", labels] += value
+            self._values[name + "_count", labels] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[name, list(labels), value] for (name, labels), value in self._values.items()]
+
+
+def metric_type(name):
+    for suffix in ("_bucket", "_sum", "_count"):
+        base = name[:-len(suffix)]
+        if name.endswith(suffix) and METRICS.get(base, ("",))[0] == "histogram":
+            return base
+    return name
+
+
+def render(snapshots):
+    values = defaultdict(float)
+    for snapshot in snapshots:
+        for name, labels, value in snapshot:
+            values[name, tuple(tuple(x) for x in labels)] += value
+
+    families = defaultdict(list)
+    for (name, labels), value in values.items():
+        families[metric_type(name)].append((name, labels, value))
+
+    lines = []
+    for family in sorted(families):
+        kind, description = METRICS.get(family, ("untyped", ""))
+        lines.append(f"# HELP {family} {description}")
+        lines.append(f"# TYPE {family} {kind}")
+        for name, labels, value in sorted(families[family], key=series_order):
+            label_text = ",".join(f'{k}="{escape(v)}"' for k, v in labels)
+            lines.append(f"{name}{{{label_text}}} {value:g}" if labels else f"{name} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def series_order(series):
+    name, labels, value = series
+    le = dict(labels).get("le")
+    return name, [x for x in labels if x[0] != "le"], float(le) if le else 0
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def snapshot_path(app):
+    return os.path.join(app.config["METRICS_DIR"], f"metrics_{os.getpid()}.json")
+
+
+def flush(app, force=False):
+    """
+    Writes this process' counters where the other workers can read them,
+    at most once per METRICS_FLUSH_INTERVAL
+    """
+    state = app.extensions["metrics"]
+    now = time.monotonic()
+    if not force and now - state["flushed"] < app.config["METRICS_FLUSH_INTERVAL"]:
+        return
+    state["flushed"] = now
+    path = snapshot_path(app)
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as file:
+        json.dump(state["registry"].snapshot(), file)
+    os.replace(tmp, path)
+
+
+def collect(app):
+    if not app.config["METRICS_DIR"]:
+        return [app.extensions["metrics"]["registry"].snapshot()]
+    flush(app, force=True)
+    snapshots = []
+    for path in glob.glob(os.path.join(app.config["METRICS_DIR"], "metrics_*.json")):
+        try:
+            with open(path) as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def current():
+    stack = getattr(_state, "stack", None)
+    return stack[-1] if stack else None
+
+
+def before_request():
+    stats = request.environ["metrics.stats"] = Stats()
+    if not hasattr(_state, "stack"):
+        _state.stack = []
+    _state.stack.append(stats)
+
+
+def after_request(response):
+    stats = request.environ.get("metrics.stats")
+    if stats is None:
+        return response
+    app = current_app._get_current_object()
+    registry = app.extensions["metrics"]["registry"]
+    endpoint_labels = (("endpoint", request.endpoint or "none"), ("method", request.method))
+
+    registry.observe("http_request_duration_seconds", endpoint_labels, time.perf_counter() - stats.start)
+    registry.inc("http_requests_total", endpoint_labels + (("status", str(response.status_code)),))
+    registry.inc("http_response_bytes_total", endpoint_labels, response.content_length or 0)
+    registry.inc("db_queries_total", endpoint_labels, stats.queries)
+    registry.inc("db_query_duration_seconds_total", endpoint_labels, stats.sql_seconds)
+    registry.inc("db_rows_total", endpoint_labels, stats.rows)
+
+    if app.config["METRICS_DIR"]:
+        flush(app)
+    return response
+
+
+def teardown_request(error):
+    stats = request.environ.get("metrics.stats")
+    stack = getattr(_state, "stack", [])
+    if stats is not None and stats in stack:
+        del stack[stack.index(stats):]
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current()
+    if stats is not None:
+        conn.info.setdefault("metrics_start", []).append(time.perf_counter())
+        # rows fetched by SELECTs are counted by the cursor's row factory,
+        # set only on the cursors of measured requests
+        if conn.dialect.name == "sqlite":
+            cursor.row_factory = stats.count_row
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current()
+    starts = conn.info.get("metrics_start")
+    if stats is not None and starts:
+        stats.sql_seconds += time.perf_counter() - starts.pop()
+        stats.queries += 1
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+
+
+def handle_error(context):
+    # a failed statement never reaches after_cursor_execute
+    starts = context.connection.info.get("metrics_start") if context.connection is not None else None
+    if current() is not None and context.execution_context is not None and starts:
+        starts.pop()
+
+
+def init_app(app):
+    if not app.config["METRICS_ENABLED"]:
+        return
+    app.extensions["metrics"] = {"registry": Registry(), "flushed": 0.0}
+    if app.config["METRICS_DIR"]:
+        os.makedirs(app.config["METRICS_DIR"], exist_ok=True)
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    app.register_blueprint(bp)
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(db.engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(db.engine, "handle_error", handle_error)
+
+
+@bp.route("/metrics")
+def metrics_get():
+    """
+    [Admin] Podaje metryki aplikacji w formacie Prometheus
+    """
+    return Response(render(collect(current_app)), mimetype="text/plain; version=0.0.4")
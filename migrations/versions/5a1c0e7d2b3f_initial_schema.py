@@ -0,0 +1,324 @@
+"""initial schema
+
+Revision ID: 5a1c0e7d2b3f
+Revises:
+Create Date: 2026-10-18 20:00:00
+
+The schema as created by db.create_all(), frozen as SQL so that later
+model changes don't alter what this revision creates. It includes the
+counter and site version triggers, the search index and the
+acl_generation row.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1c0e7d2b3f'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+STATEMENTS = (
+    """
+    CREATE TABLE acl_generation (
+        id INTEGER NOT NULL,
+        generation INTEGER NOT NULL,
+        PRIMARY KEY (id)
+    )""",
+    """
+    INSERT INTO acl_generation (id, generation) VALUES (1, 0)""",
+    """
+    CREATE TABLE user (
+        id INTEGER NOT NULL,
+        username TEXT NOT NULL,
+        PRIMARY KEY (id),
+        UNIQUE (username)
+    )""",
+    """
+    CREATE TABLE site (
+        id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        version INTEGER DEFAULT '0' NOT NULL,
+        PRIMARY KEY (id)
+    )""",
+    """
+    CREATE TABLE subject (
+        id INTEGER NOT NULL,
+        subject VARCHAR(64) NOT NULL,
+        subject_folded VARCHAR(64) NOT NULL,
+        connections_count INTEGER DEFAULT '0' NOT NULL,
+        PRIMARY KEY (id)
+    )""",
+    """
+    CREATE INDEX ix_subject_subject_folded ON subject (subject_folded)""",
+    """
+    CREATE TRIGGER subject_update_version
+            AFTER UPDATE ON subject
+            BEGIN
+                UPDATE site SET version = version + 1
+                WHERE id IN (SELECT site_id FROM site_subjects WHERE subject_id = NEW.id);
+            END""",
+    """
+    CREATE TABLE user_sites (
+        user_id INTEGER NOT NULL,
+        site_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, site_id),
+        FOREIGN KEY(user_id) REFERENCES user (id),
+        FOREIGN KEY(site_id) REFERENCES site (id)
+    )""",
+    """
+    CREATE TRIGGER user_sites_insert_generation
+            AFTER INSERT ON user_sites
+            BEGIN
+                UPDATE acl_generation SET generation = generation + 1;
+            END""",
+    """
+    CREATE TRIGGER user_sites_delete_generation
+            AFTER DELETE ON user_sites
+            BEGIN
+                UPDATE acl_generation SET generation = generation + 1;
+            END""",
+    """
+    CREATE TABLE site_subjects (
+        site_id INTEGER NOT NULL,
+        subject_id INTEGER NOT NULL,
+        PRIMARY KEY (site_id, subject_id),
+        FOREIGN KEY(site_id) REFERENCES site (id),
+        FOREIGN KEY(subject_id) REFERENCES subject (id)
+    )""",
+    """
+    CREATE INDEX ix_site_subjects_subject_id ON site_subjects (subject_id)""",
+    """
+    CREATE TRIGGER site_subjects_insert_count
+            AFTER INSERT ON site_subjects
+            BEGIN
+                UPDATE subject SET connections_count = connections_count + 1
+                WHERE id = NEW.subject_id;
+            END""",
+    """
+    CREATE TRIGGER site_subjects_delete_count
+            AFTER DELETE ON site_subjects
+            BEGIN
+                UPDATE subject SET connections_count = connections_count - 1
+                WHERE id = OLD.subject_id;
+            END""",
+    """
+    CREATE TRIGGER site_subjects_insert_version
+            AFTER INSERT ON site_subjects
+            BEGIN
+                UPDATE site SET version = version + 1 WHERE id = NEW.site_id;
+            END""",
+    """
+    CREATE TRIGGER site_subjects_delete_version
+            AFTER DELETE ON site_subjects
+            BEGIN
+                UPDATE site SET version = version + 1 WHERE id = OLD.site_id;
+            END""",
+    """
+    CREATE TABLE gallery (
+        id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        description TEXT,
+        sort INTEGER CHECK (sort >= 1),
+        private BOOLEAN,
+        edit_date DATETIME,
+        photo_count INTEGER DEFAULT '0' NOT NULL,
+        site_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(site_id) REFERENCES site (id)
+    )""",
+    """
+    CREATE INDEX ix_gallery_site_id ON gallery (site_id)""",
+    """
+    CREATE TRIGGER gallery_insert_version
+            AFTER INSERT ON gallery
+            BEGIN
+                UPDATE site SET version = version + 1 WHERE id = NEW.site_id;
+            END""",
+    """
+    CREATE TRIGGER gallery_update_version
+            AFTER UPDATE ON gallery
+            BEGIN
+                UPDATE site SET version = version + 1 WHERE id IN (OLD.site_id, NEW.site_id);
+            END""",
+    """
+    CREATE TRIGGER gallery_delete_version
+            AFTER DELETE ON gallery
+            BEGIN
+                UPDATE site SET version = version + 1 WHERE id = OLD.site_id;
+            END""",
+    """
+    CREATE TABLE upload_job (
+        id VARCHAR(32) NOT NULL,
+        site_id INTEGER NOT NULL,
+        gallery_id INTEGER NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        photo_id INTEGER,
+        error TEXT,
+        create_date DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        finish_date DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(site_id) REFERENCES site (id)
+    )""",
+    """
+    CREATE TABLE upload_session (
+        id VARCHAR(32) NOT NULL,
+        site_id INTEGER NOT NULL,
+        gallery_id INTEGER NOT NULL,
+        filename VARCHAR(256) NOT NULL,
+        description TEXT,
+        length INTEGER NOT NULL,
+        "offset" INTEGER NOT NULL,
+        create_date DATETIME DEFAULT (CURRENT_TIMESTAMP),
+        expire_date DATETIME NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(site_id) REFERENCES site (id)
+    )""",
+    """
+    CREATE TABLE photo (
+        id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        sha256 VARCHAR(64),
+        derivatives JSON,
+        description TEXT,
+        sort INTEGER CHECK (sort >= 1),
+        edit_date DATETIME,
+        gallery_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(gallery_id) REFERENCES gallery (id)
+    )""",
+    """
+    CREATE INDEX ix_photo_sha256 ON photo (sha256)""",
+    """
+    CREATE INDEX ix_photo_gallery_id ON photo (gallery_id)""",
+    """
+    CREATE TRIGGER photo_insert_count
+            AFTER INSERT ON photo
+            WHEN NEW.gallery_id IS NOT NULL
+            BEGIN
+                UPDATE gallery SET photo_count = photo_count + 1
+                WHERE id = NEW.gallery_id;
+            END""",
+    """
+    CREATE TRIGGER photo_delete_count
+            AFTER DELETE ON photo
+            WHEN OLD.gallery_id IS NOT NULL
+            BEGIN
+                UPDATE gallery SET photo_count = photo_count - 1
+                WHERE id = OLD.gallery_id;
+            END""",
+    """
+    CREATE TRIGGER photo_move_count
+            AFTER UPDATE OF gallery_id ON photo
+            WHEN OLD.gallery_id IS NOT NEW.gallery_id
+            BEGIN
+                UPDATE gallery SET photo_count = photo_count - 1
+                WHERE id = OLD.gallery_id;
+                UPDATE gallery SET photo_count = photo_count + 1
+                WHERE id = NEW.gallery_id;
+            END""",
+    """
+    DROP TABLE IF EXISTS search_index""",
+    """
+    CREATE VIRTUAL TABLE search_index USING fts5(
+                site_id UNINDEXED,
+                gallery_id UNINDEXED,
+                name,
+                description,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )""",
+    """
+    CREATE TRIGGER gallery_insert_search
+            AFTER INSERT ON gallery
+            BEGIN
+                INSERT INTO search_index (rowid, site_id, gallery_id, name, description)
+                VALUES (NEW.id * 2, NEW.site_id, NEW.id, NEW.name, NEW.description);
+            END""",
+    """
+    CREATE TRIGGER gallery_update_search
+            AFTER UPDATE OF name, description, site_id ON gallery
+            BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.id * 2;
+                INSERT INTO search_index (rowid, site_id, gallery_id, name, description)
+                VALUES (NEW.id * 2, NEW.site_id, NEW.id, NEW.name, NEW.description);
+            END""",
+    """
+    CREATE TRIGGER gallery_move_search
+            AFTER UPDATE OF site_id ON gallery
+            WHEN OLD.site_id IS NOT NEW.site_id
+            BEGIN
+                UPDATE search_index SET site_id = NEW.site_id
+                WHERE rowid IN (SELECT id * 2 + 1 FROM photo WHERE gallery_id = NEW.id);
+            END""",
+    """
+    CREATE TRIGGER gallery_delete_search
+            AFTER DELETE ON gallery
+            BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.id * 2;
+            END""",
+    """
+    CREATE TRIGGER photo_insert_search
+            AFTER INSERT ON photo
+            BEGIN
+                INSERT INTO search_index (rowid, site_id, gallery_id, description)
+                VALUES (
+                    NEW.id * 2 + 1,
+                    (SELECT site_id FROM gallery WHERE id = NEW.gallery_id),
+                    NEW.gallery_id,
+                    NEW.description
+                );
+            END""",
+    """
+    CREATE TRIGGER photo_update_search
+            AFTER UPDATE OF description, gallery_id ON photo
+            BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.id * 2 + 1;
+                INSERT INTO search_index (rowid, site_id, gallery_id, description)
+                VALUES (
+                    NEW.id * 2 + 1,
+                    (SELECT site_id FROM gallery WHERE id = NEW.gallery_id),
+                    NEW.gallery_id,
+                    NEW.description
+                );
+            END""",
+    """
+    CREATE TRIGGER photo_delete_search
+            AFTER DELETE ON photo
+            BEGIN
+                DELETE FROM search_index WHERE rowid = OLD.id * 2 + 1;
+            END""",
+    """
+    CREATE TRIGGER photo_insert_version
+            AFTER INSERT ON photo
+            BEGIN
+                UPDATE site SET version = version + 1
+                WHERE id = (SELECT site_id FROM gallery WHERE id = NEW.gallery_id);
+            END""",
+    """
+    CREATE TRIGGER photo_update_version
+            AFTER UPDATE ON photo
+            BEGIN
+                UPDATE site SET version = version + 1
+                WHERE id IN (SELECT site_id FROM gallery WHERE id IN (OLD.gallery_id, NEW.gallery_id));
+            END""",
+    """
+    CREATE TRIGGER photo_delete_version
+            AFTER DELETE ON photo
+            BEGIN
+                UPDATE site SET version = version + 1
+                WHERE id = (SELECT site_id FROM gallery WHERE id = OLD.gallery_id);
+            END""",
+)
+
+TABLES = ('acl_generation', 'user', 'site', 'subject', 'user_sites', 'site_subjects', 'gallery', 'upload_job', 'upload_session', 'photo', 'search_index')
+
+
+def upgrade():
+    for statement in STATEMENTS:
+        op.execute(statement)
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.execute(f"DROP TABLE IF EXISTS {table}")
@@ -1,8 +1,27 @@
+import unicodedata
+from flask import current_app
 from .exts import db
-from sqlalchemy import CheckConstraint
+from sqlalchemy import CheckConstraint, DDL, event, select
+from sqlalchemy.orm import validates
 from sqlalchemy.sql import func
 
 
+TRIGGERS = {}
+
+FOLD_TABLE = str.maketrans({"ł": "l"})
+
+
+def fold(text):
+    text = unicodedata.normalize("NFKD", text.casefold().translate(FOLD_TABLE))
+    return "".join(x for x in text if not unicodedata.combining(x))
+
+
+def sqlite_trigger(table, name, definition):
+    ddl = DDL(f"CREATE TRIGGER {name} {definition}")
+    event.listen(table, "after_create", ddl.execute_if(dialect="sqlite"))
+    TRIGGERS[name] = ddl
+
+
 user_sites = db.Table(
         "user_sites",
         db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
@@ -10,10 +29,22 @@ user_sites = db.Table(
         )
 
 
+acl_generation = db.Table(
+        "acl_generation",
+        db.Column('id', db.Integer, primary_key=True),
+        db.Column('generation', db.Integer, nullable=False)
+        )
+
+
+event.listen(acl_generation, "after_create", DDL(
+        "INSERT INTO acl_generation (id, generation) VALUES (1, 0)"
+        ))
+
+
 site_subjects = db.Table(
         "site_subjects",
         db.Column('site_id', db.Integer, db.ForeignKey('site.id'), primary_key=True),
-        db.Column('subject_id', db.Integer, db.ForeignKey('subject.id'), primary_key=True)
+        db.Column('subject_id', db.Integer, db.ForeignKey('subject.id'), primary_key=True, index=True)
         )
 
 
@@ -32,6 +63,7 @@ class User(db.Model):
 class Site(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.Text, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     galleries = db.relationship('Gallery', backref='site')
     subjects = db.relationship('Subject', secondary=site_subjects, backref='sites', lazy='dynamic')
@@ -46,12 +78,19 @@ class Site(db.Model):
 class Subject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     subject = db.Column(db.String(64), nullable=False)
+    subject_folded = db.Column(db.String(64), nullable=False, index=True)
+    connections_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    @validates("subject")
+    def validate_subject(self, key, subject):
+        self.subject_folded = fold(subject)
+        return subject
 
     def as_dict(self):
         return {
                 "id": self.id,
                 "subject": self.subject,
-                "connections_count": len(self.sites)
+                "connections_count": self.connections_count
                 }
 
 
@@ -62,33 +101,39 @@ class Gallery(db.Model):
     sort = db.Column(db.Integer, CheckConstraint('sort >= 1'))
     private = db.Column(db.Boolean)
     edit_date = db.Column(db.DateTime, onupdate=func.now())             
+    photo_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
-    site_id = db.Column(db.Integer, db.ForeignKey('site.id'))
+    site_id = db.Column(db.Integer, db.ForeignKey('site.id'), index=True)
 
     photos = db.relationship('Photo', backref='gallery', lazy='dynamic')
 
-    def as_dict(self):
+    def as_dict(self, photos=None):
+        if photos is None:
+            photos = self.photos.order_by(Photo.sort, Photo.id)
         return {
                 "id": self.id,
                 "name": self.name,
                 "description": self.description,
                 "sort": self.sort,
                 "edit_date": str(self.edit_date),
-                "photos": [p.as_dict() for p in self.photos]
+                "photo_count": self.photo_count,
+                "photos": [p.as_dict() for p in photos]
                 }
 
     def photos_count(self):
-        return len(self.photos)
+        return self.photo_count
 
 
 class Photo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.Text, nullable=False)
+    sha256 = db.Column(db.String(64), index=True)
+    derivatives = db.Column(db.JSON)
     description = db.Column(db.Text)
     sort = db.Column(db.Integer, CheckConstraint('sort >= 1'))
     edit_date = db.Column(db.DateTime, onupdate=func.now())
 
-    gallery_id = db.Column(db.Integer, db.ForeignKey('gallery.id'))
+    gallery_id = db.Column(db.Integer, db.ForeignKey('gallery.id'), index=True)
 
     def as_dict(self):
         return {
@@ -97,4 +142,128 @@ class Photo(db.Model):
                 "description": self.description,
                 "sort": self.sort,
                 "edit_date": str(self.edit_date),
+                "derivatives": {
+                    size: current_app.config["UPLOAD_URL"] + name
+                    for size, name in (self.derivatives or {}).items()
+                    },
+                }
+
+
+class UploadJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    site_id = db.Column(db.Integer, db.ForeignKey('site.id'), nullable=False)
+    gallery_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default="pending")
+    photo_id = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    create_date = db.Column(db.DateTime, server_default=func.now())
+    finish_date = db.Column(db.DateTime)
+
+    def as_dict(self):
+        return {
+                "id": self.id,
+                "status": self.status,
+                "gallery_id": self.gallery_id,
+                "photo_id": self.photo_id,
+                "error": self.error,
+                "create_date": str(self.create_date),
+                "finish_date": str(self.finish_date) if self.finish_date else None
                 }
+
+
+class UploadSession(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    site_id = db.Column(db.Integer, db.ForeignKey('site.id'), nullable=False)
+    gallery_id = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(256), nullable=False)
+    description = db.Column(db.Text)
+    length = db.Column(db.Integer, nullable=False)
+    offset = db.Column(db.Integer, nullable=False, default=0)
+    create_date = db.Column(db.DateTime, server_default=func.now())
+    expire_date = db.Column(db.DateTime, nullable=False)
+
+    def as_dict(self):
+        return {
+                "id": self.id,
+                "gallery_id": self.gallery_id,
+                "filename": self.filename,
+                "length": self.length,
+                "offset": self.offset,
+                "create_date": str(self.create_date),
+                "expire_date": str(self.expire_date)
+                }
+
+
+sqlite_trigger(user_sites, "user_sites_insert_generation", """
+        AFTER INSERT ON user_sites
+        BEGIN
+            UPDATE acl_generation SET generation = generation + 1;
+        END""")
+
+sqlite_trigger(user_sites, "user_sites_delete_generation", """
+        AFTER DELETE ON user_sites
+        BEGIN
+            UPDATE acl_generation SET generation = generation + 1;
+        END""")
+
+sqlite_trigger(site_subjects, "site_subjects_insert_count", """
+        AFTER INSERT ON site_subjects
+        BEGIN
+            UPDATE subject SET connections_count = connections_count + 1
+            WHERE id = NEW.subject_id;
+        END""")
+
+sqlite_trigger(site_subjects, "site_subjects_delete_count", """
+        AFTER DELETE ON site_subjects
+        BEGIN
+            UPDATE subject SET connections_count = connections_count - 1
+            WHERE id = OLD.subject_id;
+        END""")
+
+sqlite_trigger(Photo.__table__, "photo_insert_count", """
+        AFTER INSERT ON photo
+        WHEN NEW.gallery_id IS NOT NULL
+        BEGIN
+            UPDATE gallery SET photo_count = photo_count + 1
+            WHERE id = NEW.gallery_id;
+        END""")
+
+sqlite_trigger(Photo.__table__, "photo_delete_count", """
+        AFTER DELETE ON photo
+        WHEN OLD.gallery_id IS NOT NULL
+        BEGIN
+            UPDATE gallery SET photo_count = photo_count - 1
+            WHERE id = OLD.gallery_id;
+        END""")
+
+sqlite_trigger(Photo.__table__, "photo_move_count", """
+        AFTER UPDATE OF gallery_id ON photo
+        WHEN OLD.gallery_id IS NOT NEW.gallery_id
+        BEGIN
+            UPDATE gallery SET photo_count = photo_count - 1
+            WHERE id = OLD.gallery_id;
+            UPDATE gallery SET photo_count = photo_count + 1
+            WHERE id = NEW.gallery_id;
+        END""")
+
+
+def rebuild_counters():
+    subject = Subject.__table__
+    gallery = Gallery.__table__
+    photo = Photo.__table__
+    db.session.execute(
+            subject.update().values(
+                connections_count=select(func.count())
+                .where(site_subjects.c.subject_id == subject.c.id)
+                .scalar_subquery()
+                )
+            )
+    db.session.execute(
+            gallery.update().values(
+                photo_count=select(func.count())
+                .where(photo.c.gallery_id == gallery.c.id)
+                .scalar_subquery()
+                )
+            )
+    db.session.commit()
+
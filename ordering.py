@@ -0,0 +1,92 @@
+from sqlalchemy import bindparam, func, select, tuple_
+from .exts import db
+
+
+# Positions are spaced by GAP so that moving an item only rewrites its own
+# sort value, until two neighbours end up adjacent and the scope is renumbered.
+GAP = 1024
+
+
+def next_position(model, scope):
+    last = db.session.query(func.max(model.sort)).filter(*scope).scalar()
+    return (last or 0) + GAP
+
+
+def apply(model, ids, touch=True):
+    table = model.__table__
+    values = {"sort": bindparam("position")}
+    if not touch:
+        values["edit_date"] = table.c.edit_date
+    db.session.execute(
+            table.update()
+            .where(table.c.id == bindparam("item_id"))
+            .values(values),
+            [{"item_id": x, "position": (i + 1) * GAP} for i, x in enumerate(ids)]
+            )
+    db.session.expire_all()
+
+
+def renumber(model, scope):
+    ids = db.session.scalars(
+            select(model.id)
+            .where(*scope)
+            .order_by(model.sort, model.id)
+            ).all()
+    apply(model, ids, touch=False)
+
+
+def reorder(model, scope, ids):
+    """
+    Sets the order of all items in the scope at once, returns False when
+    the ids don't list every item of the scope exactly once
+    """
+    if not isinstance(ids, list) or not all(type(x) is int for x in ids):
+        return False
+    current = set(db.session.scalars(select(model.id).where(*scope)))
+    if len(ids) != len(set(ids)) or set(ids) != current:
+        return False
+    apply(model, ids)
+    return True
+
+
+def neighbours(model, scope, item, up):
+    key = tuple_(model.sort, model.id)
+    query = model.query.filter(*scope)
+    if up:
+        query = query\
+            .filter(key > (item.sort, item.id))\
+            .order_by(model.sort, model.id)
+    else:
+        query = query\
+            .filter(key < (item.sort, item.id))\
+            .order_by(model.sort.desc(), model.id.desc())
+    return query.limit(2).all()
+
+
+def between(up, near):
+    if len(near) == 2:
+        position = (near[0].sort + near[1].sort) // 2
+    else:
+        position = near[0].sort + GAP if up else near[0].sort // 2
+    if position < 1 or position == near[0].sort:
+        return None
+    if len(near) == 2 and position == near[1].sort:
+        return None
+    return position
+
+
+def move(model, scope, item, up):
+    """
+    Moves the item past its next neighbour towards higher (up) or lower sort
+    """
+    if db.session.query(model.id).filter(*scope, model.sort.is_(None)).first():
+        renumber(model, scope)
+    near = neighbours(model, scope, item, up)
+    if not near:
+        return
+    position = between(up, near)
+    if position is None:
+        renumber(model, scope)
+        near = neighbours(model, scope, item, up)
+        position = between(up, near)
+    item.sort = position
@@ -0,0 +1,111 @@
+import base64
+import json
+import math
+import time
+from flask import abort, current_app
+from sqlalchemy import func, select, tuple_
+from .exts import db
+
+
+SCALAR_TYPES = (str, int, float, type(None))
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def is_scalar(value, types=SCALAR_TYPES):
+    # bool is an int, but no key column is a boolean
+    return isinstance(value, types) and not isinstance(value, bool)
+
+
+def key_type(key):
+    try:
+        return key.type.python_type
+    except NotImplementedError:
+        return SCALAR_TYPES
+
+
+def decode_cursor(cursor, name, types=SCALAR_TYPES):
+    """
+    Returns the (key, id) of the cursor, the key has to be one of the given
+    types, so a forged cursor can't put a list or an object in the query
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, AttributeError):
+        abort(400, "The cursor is invalid")
+    if not isinstance(values, list) or len(values) != 3 or values[0] != name:
+        abort(400, f"The cursor doesn't match the order ({name})")
+    if not is_scalar(values[1], types) or not is_scalar(values[2], int):
+        abort(400, "The cursor is invalid")
+    return values[1], values[2]
+
+
+def keyset(statement, name, key, id_column, cursor, per_page, desc=False):
+    """
+    Seeks past the (key, id) of the last seen row instead of using OFFSET,
+    so every page costs the same. The statement has to select the id
+    column, returns the rows and the next cursor.
+    """
+    if cursor:
+        seek = tuple_(key, id_column)
+        last = decode_cursor(cursor, name, key_type(key))
+        statement = statement.where(seek < last if desc else seek > last)
+    order = [key.desc(), id_column.desc()] if desc else [key.asc(), id_column.asc()]
+    rows = db.session.execute(
+            statement
+            .add_columns(key.label("cursor_key"))
+            .order_by(*order)
+            .limit(per_page + 1)
+            ).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor([name, rows[-1].cursor_key, rows[-1].id])
+    return rows, next_cursor
+
+
+def offset_page(statement, page, per_page):
+    """
+    OFFSET pagination of a select, handles the page arguments like
+    Flask-SQLAlchemy's paginate(error_out=False). Returns the rows and the
+    pagination dict.
+    """
+    page = page if page >= 1 else 1
+    per_page = per_page if per_page >= 1 else 20
+    rows = db.session.execute(
+            statement
+            .limit(per_page)
+            .offset((page - 1) * per_page)
+            ).all()
+    if page == 1 and len(rows) < per_page:
+        total = len(rows)
+    else:
+        total = db.session.execute(
+                select(func.count())
+                .select_from(statement.order_by(None).subquery())
+                ).scalar()
+    pagination = {
+            "page": page,
+            "pages": math.ceil(total / per_page),
+            "per_page": per_page,
+            "total": total
+            }
+    return rows, pagination
+
+
+def cached_total(key, count):
+    totals = current_app.extensions.setdefault("pagination_totals", {})
+    now = time.monotonic()
+    cached = totals.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    total = count()
+    totals[key] = (now + current_app.config["PAGINATION_TOTAL_TTL"], total)
+    return total
+
+
+def forget_total(key):
+    current_app.extensions.setdefault("pagination_totals", {}).pop(key, None)
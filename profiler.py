@@ -0,0 +1,165 @@
+import cProfile
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import partial
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from . import batch
+from .exts import db
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread at a fixed interval and counts the
+    stacks in the collapsed format flamegraph tools read
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def requested():
+    if current_app.config["PROFILE_ALL"]:
+        return True
+    token = current_app.config["PROFILE_TOKEN"]
+    header = request.headers.get("X-Profile")
+    # compare_digest only takes ASCII str, the header may be anything
+    return bool(token and header) and hmac.compare_digest(header.encode(), token.encode())
+
+
+def before_request():
+    # the operations of a batch share its g, they're profiled as part of it
+    if batch.active() or not requested():
+        return
+    g.profile = {
+            "id": uuid.uuid4().hex,
+            "start": time.perf_counter(),
+            "sql": [],
+            "sampler": StackSampler(threading.get_ident(), current_app.config["PROFILE_INTERVAL"]),
+            "profiler": cProfile.Profile(),
+            }
+    g.profile["sampler"].start()
+    try:
+        g.profile["profiler"].enable()
+    except ValueError:
+        # another profiler is already active in this process
+        g.profile["profiler"] = None
+
+
+def after_request(response):
+    """
+    Hands the profile over to the response, which stops it once the body is
+    sent, so the time spent in streamed bodies is profiled as well
+    """
+    profile = g.get("profile")
+    if profile is None or batch.active():
+        return response
+    profile["closing"] = True
+    meta = {
+            "id": profile["id"],
+            "method": request.method,
+            "path": request.full_path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            }
+    response.call_on_close(partial(finish, current_app.config["PROFILE_DIR"], profile, meta))
+    response.headers["X-Profile-Id"] = profile["id"]
+    return response
+
+
+def stop(profile):
+    if profile["profiler"] is not None:
+        profile["profiler"].disable()
+    profile["sampler"].stop()
+
+
+def finish(folder, profile, meta):
+    stop(profile)
+    duration = time.perf_counter() - profile["start"]
+
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, profile["id"])
+    if profile["profiler"] is not None:
+        profile["profiler"].dump_stats(path + ".pstats")
+    with open(path + ".collapsed", "w") as file:
+        file.write(profile["sampler"].collapsed())
+    with open(path + ".json", "w") as file:
+        json.dump({
+                **meta,
+                "duration_ms": round(duration * 1000, 3),
+                "sql_ms": round(sum(x["duration_ms"] for x in profile["sql"]), 3),
+                "sql": profile["sql"],
+                }, file, indent=4)
+
+
+def teardown_request(error):
+    # a streamed body keeps the request context until it's sent, the
+    # profile is stopped by the response unless after_request didn't run
+    if batch.active():
+        return
+    profile = g.pop("profile", None)
+    if profile is not None and not profile.get("closing"):
+        stop(profile)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "profile" in g:
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("profile_start")
+    if has_request_context() and "profile" in g and starts:
+        g.profile["sql"].append({
+                "statement": statement,
+                "parameters": repr(parameters)[:1000],
+                "executemany": executemany,
+                "duration_ms": round((time.perf_counter() - starts.pop()) * 1000, 3),
+                })
+
+
+def init_app(app):
+    """
+    Registers the hooks only when profiling can be requested at all, so a
+    disabled profiler costs nothing per request
+    """
+    config = app.config
+    if not config["PROFILE_DIR"] or not (config["PROFILE_TOKEN"] or config["PROFILE_ALL"]):
+        return
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(db.engine, "after_cursor_execute", after_cursor_execute)
@@ -0,0 +1,175 @@
+from flask import abort, current_app
+from sqlalchemy import func, select
+from .exts import db
+from .pagination import encode_cursor
+from .models import Subject, Gallery, Photo, site_subjects
+
+
+gallery = Gallery.__table__
+photo = Photo.__table__
+subject = Subject.__table__
+
+# The read routes select only the requested columns with Core and build
+# the same dicts as the models' as_dict() straight from the rows, skipping
+# ORM object hydration. The first field of each set is always selected.
+GALLERY_FIELDS = {
+        "id": gallery.c.id,
+        "name": gallery.c.name,
+        "description": gallery.c.description,
+        "sort": gallery.c.sort,
+        "edit_date": gallery.c.edit_date,
+        "photo_count": gallery.c.photo_count,
+        }
+
+PHOTO_FIELDS = {
+        "id": photo.c.id,
+        "filename": photo.c.filename,
+        "description": photo.c.description,
+        "sort": photo.c.sort,
+        "edit_date": photo.c.edit_date,
+        "derivatives": photo.c.derivatives,
+        }
+
+GALLERY_COLUMNS = tuple(GALLERY_FIELDS.values())
+
+PHOTO_COLUMNS = tuple(PHOTO_FIELDS.values())
+
+SUBJECT_COLUMNS = (
+        subject.c.id,
+        subject.c.subject,
+        subject.c.connections_count,
+        )
+
+PHOTO_CURSOR_KEY = func.coalesce(photo.c.sort, 0)
+
+
+def formatter(name):
+    """
+    Returns the function turning a column value into its JSON value, or
+    None when the value is used as is. Built once per response, the config
+    lookups stay out of the per row loop.
+    """
+    if name == "edit_date":
+        return str
+    if name == "derivatives":
+        upload_url = current_app.config["UPLOAD_URL"]
+        return lambda derivatives: {
+                size: upload_url + x
+                for size, x in (derivatives or {}).items()
+                }
+    return None
+
+
+def parse_fields(value, available):
+    """
+    Returns the requested field names in the order of the available ones,
+    all of them when none were requested
+    """
+    if value is None:
+        return list(available)
+    if isinstance(value, str):
+        value = value.split(",")
+    if not isinstance(value, list) or not all(isinstance(x, str) for x in value):
+        abort(400, "The fields should be a list of names")
+    requested = {x.strip() for x in value}
+    unknown = requested - set(available)
+    if unknown:
+        abort(400, f"Unknown fields ({', '.join(sorted(unknown))})")
+    first = next(iter(available))
+    return [x for x in available if x == first or x in requested]
+
+
+def row_dicts(rows, fields):
+    """
+    Turns rows selecting the fields in order into dicts, rows may carry
+    further columns after them
+    """
+    fields = list(fields)
+    formatters = [(x, formatter(x)) for x in fields]
+    result = [dict(zip(fields, row)) for row in rows]
+    for name, format in formatters:
+        if format is None:
+            continue
+        for item in result:
+            item[name] = format(item[name])
+    return result
+
+
+def galleries(site_id, fields=GALLERY_FIELDS):
+    return \
+        select(*[GALLERY_FIELDS[x] for x in fields])\
+        .where(gallery.c.site_id == site_id)
+
+
+def photos(gallery_id, fields=PHOTO_FIELDS):
+    return \
+        select(*[PHOTO_FIELDS[x] for x in fields])\
+        .where(photo.c.gallery_id == gallery_id)
+
+
+def photos_by_gallery(gallery_ids, limit=None):
+    """
+    Returns the photo dicts of the galleries and the cursor of the rest of
+    their photos when there are more than the limit, keyed by gallery id
+    and fetched with a single query
+    """
+    result = {x: ([], None) for x in gallery_ids}
+    if not result:
+        return result
+    columns = (*PHOTO_COLUMNS, photo.c.gallery_id, PHOTO_CURSOR_KEY.label("cursor_key"))
+    if limit is None:
+        statement = \
+            select(*columns)\
+            .where(photo.c.gallery_id.in_(result))\
+            .order_by(photo.c.gallery_id, PHOTO_CURSOR_KEY, photo.c.id)
+    else:
+        # one more photo than the limit tells whether the gallery has more
+        position = func.row_number().over(
+                partition_by=photo.c.gallery_id,
+                order_by=(PHOTO_CURSOR_KEY, photo.c.id)
+                )
+        ranked = \
+            select(*columns, position.label("position"))\
+            .where(photo.c.gallery_id.in_(result))\
+            .subquery()
+        statement = \
+            select(*[ranked.c[x.name] for x in columns])\
+            .where(ranked.c.position <= limit + 1)\
+            .order_by(ranked.c.gallery_id, ranked.c.position)
+
+    rows = {x: [] for x in gallery_ids}
+    for row in db.session.execute(statement):
+        rows[row.gallery_id].append(row)
+    for gallery_id, gallery_rows in rows.items():
+        next_cursor = None
+        if limit is not None and len(gallery_rows) > limit:
+            gallery_rows = gallery_rows[:limit]
+            next_cursor = encode_cursor(["sort", gallery_rows[-1].cursor_key, gallery_rows[-1].id])
+        result[gallery_id] = (row_dicts(gallery_rows, PHOTO_FIELDS), next_cursor)
+    return result
+
+
+def gallery_dicts(rows, fields=GALLERY_FIELDS, include_photos=True, photos_limit=None):
+    result = row_dicts(rows, fields)
+    if include_photos:
+        photos = photos_by_gallery([x["id"] for x in result], photos_limit)
+        for item in result:
+            item["photos"], next_cursor = photos[item["id"]]
+            if photos_limit is not None:
+                item["photos_next_cursor"] = next_cursor
+    return result
+
+
+def subjects(site_id):
+    return \
+        select(*SUBJECT_COLUMNS)\
+        .join(site_subjects, site_subjects.c.subject_id == subject.c.id)\
+        .where(site_subjects.c.site_id == site_id)
+
+
+def subject_dict(row):
+    return {
+            "id": row.id,
+            "subject": row.subject,
+            "connections_count": row.connections_count
+            }
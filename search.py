@@ -0,0 +1,128 @@
+from sqlalchemy import DDL, event, text
+from .exts import db
+from .models import Photo, sqlite_trigger
+
+
+# Galleries are stored under rowid id * 2 and photos under id * 2 + 1,
+# so the triggers can reach their rows by rowid instead of scanning.
+event.listen(Photo.__table__, "after_create", DDL(
+        "DROP TABLE IF EXISTS search_index"
+        ).execute_if(dialect="sqlite"))
+
+event.listen(Photo.__table__, "after_create", DDL("""
+        CREATE VIRTUAL TABLE search_index USING fts5(
+            site_id UNINDEXED,
+            gallery_id UNINDEXED,
+            name,
+            description,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )""").execute_if(dialect="sqlite"))
+
+sqlite_trigger(Photo.__table__, "gallery_insert_search", """
+        AFTER INSERT ON gallery
+        BEGIN
+            INSERT INTO search_index (rowid, site_id, gallery_id, name, description)
+            VALUES (NEW.id * 2, NEW.site_id, NEW.id, NEW.name, NEW.description);
+        END""")
+
+sqlite_trigger(Photo.__table__, "gallery_update_search", """
+        AFTER UPDATE OF name, description, site_id ON gallery
+        BEGIN
+            DELETE FROM search_index WHERE rowid = OLD.id * 2;
+            INSERT INTO search_index (rowid, site_id, gallery_id, name, description)
+            VALUES (NEW.id * 2, NEW.site_id, NEW.id, NEW.name, NEW.description);
+        END""")
+
+sqlite_trigger(Photo.__table__, "gallery_move_search", """
+        AFTER UPDATE OF site_id ON gallery
+        WHEN OLD.site_id IS NOT NEW.site_id
+        BEGIN
+            UPDATE search_index SET site_id = NEW.site_id
+            WHERE rowid IN (SELECT id * 2 + 1 FROM photo WHERE gallery_id = NEW.id);
+        END""")
+
+sqlite_trigger(Photo.__table__, "gallery_delete_search", """
+        AFTER DELETE ON gallery
+        BEGIN
+            DELETE FROM search_index WHERE rowid = OLD.id * 2;
+        END""")
+
+sqlite_trigger(Photo.__table__, "photo_insert_search", """
+        AFTER INSERT ON photo
+        BEGIN
+            INSERT INTO search_index (rowid, site_id, gallery_id, description)
+            VALUES (
+                NEW.id * 2 + 1,
+                (SELECT site_id FROM gallery WHERE id = NEW.gallery_id),
+                NEW.gallery_id,
+                NEW.description
+            );
+        END""")
+
+sqlite_trigger(Photo.__table__, "photo_update_search", """
+        AFTER UPDATE OF description, gallery_id ON photo
+        BEGIN
+            DELETE FROM search_index WHERE rowid = OLD.id * 2 + 1;
+            INSERT INTO search_index (rowid, site_id, gallery_id, description)
+            VALUES (
+                NEW.id * 2 + 1,
+                (SELECT site_id FROM gallery WHERE id = NEW.gallery_id),
+                NEW.gallery_id,
+                NEW.description
+            );
+        END""")
+
+sqlite_trigger(Photo.__table__, "photo_delete_search", """
+        AFTER DELETE ON photo
+        BEGIN
+            DELETE FROM search_index WHERE rowid = OLD.id * 2 + 1;
+        END""")
+
+
+def match_query(query):
+    return " ".join('"' + x.replace('"', '""') + '"*' for x in query.split())
+
+
+def search(site_id, query, page, per_page):
+    """
+    Returns one page of galleries and photos of the site ranked by bm25
+    and whether there are more results
+    """
+    rows = db.session.execute(
+            text("""
+                SELECT rowid, gallery_id, name, description, bm25(search_index) AS rank
+                FROM search_index
+                WHERE search_index MATCH :query AND site_id = :site_id
+                ORDER BY rank
+                LIMIT :limit OFFSET :offset
+                """),
+            {
+                "query": match_query(query),
+                "site_id": site_id,
+                "limit": per_page + 1,
+                "offset": (page - 1) * per_page
+                }
+            ).all()
+    results = [{
+            "type": "photo" if x.rowid % 2 else "gallery",
+            "id": x.rowid // 2,
+            "gallery_id": x.gallery_id,
+            "name": x.name,
+            "description": x.description,
+            "rank": x.rank
+            } for x in rows[:per_page]]
+    return results, len(rows) > per_page
+
+
+def rebuild_search():
+    db.session.execute(text("DELETE FROM search_index"))
+    db.session.execute(text("""
+            INSERT INTO search_index (rowid, site_id, gallery_id, name, description)
+            SELECT id * 2, site_id, id, name, description FROM gallery
+            """))
+    db.session.execute(text("""
+            INSERT INTO search_index (rowid, site_id, gallery_id, description)
+            SELECT photo.id * 2 + 1, gallery.site_id, photo.gallery_id, photo.description
+            FROM photo LEFT JOIN gallery ON gallery.id = photo.gallery_id
+            """))
+    db.session.commit()
@@ -0,0 +1,51 @@
+import importlib.util
+from flask.json.provider import DefaultJSONProvider
+
+
+def enabled():
+    return importlib.util.find_spec("orjson") is not None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Serializes JSON responses with orjson, keeping Flask's sorted keys and
+    its handling of dates and dataclasses. Pretty printed output (debug
+    mode) still goes through the stdlib json module.
+    """
+
+    def options(self):
+        import orjson
+
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME \
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        import orjson
+
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.options()).decode()
+
+    def response(self, *args, **kwargs):
+        import orjson
+
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        data = orjson.dumps(obj, default=self.default, option=self.options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+
+def init_app(app):
+    """
+    Has to run before the engine is created, JSON columns are then decoded
+    with orjson as well
+    """
+    if enabled():
+        import orjson
+
+        app.json = OrjsonProvider(app)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"].setdefault("json_deserializer", orjson.loads)
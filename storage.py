@@ -0,0 +1,186 @@
+import hashlib
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import func, select
+from . import derivatives
+from .engine import begin_immediate, retry_on_busy
+from .exts import db
+from .models import Gallery, Photo
+
+
+CHUNK_SIZE = 64 * 1024
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+SIGNATURES = {
+        "png": (b"\x89PNG\r\n\x1a\n",),
+        "jpg": (b"\xff\xd8\xff",),
+        "jpeg": (b"\xff\xd8\xff",),
+        "gif": (b"GIF87a", b"GIF89a"),
+        }
+
+
+def upload_path(*parts):
+    return os.path.join(current_app.config["UPLOAD_FOLDER"], *parts)
+
+
+def blob_name(digest, extension):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+
+
+def spool(stream):
+    """
+    Streams the upload into a temporary file while hashing it
+    """
+    tmp_dir = upload_path("tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            while chunk := stream.read(CHUNK_SIZE):
+                digest.update(chunk)
+                file.write(chunk)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return tmp, digest.hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_pool(app):
+    pool = app.extensions.get("spool_pool")
+    if pool is None:
+        pool = app.extensions["spool_pool"] = \
+            ThreadPoolExecutor(max_workers=app.config["UPLOAD_BATCH_WORKERS"], thread_name_prefix="spool")
+    return pool
+
+
+def spool_many(streams):
+    """
+    Spools several uploads concurrently, returns (tmp, digest) or the
+    raised error for each stream in order
+    """
+    app = current_app._get_current_object()
+
+    def task(stream):
+        with app.app_context():
+            return spool(stream)
+
+    futures = [get_pool(app).submit(task, x) for x in streams]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except OSError as e:
+            results.append(e)
+    return results
+
+
+def validate(path, extension):
+    """
+    Checks that the file starts with the signature of its image format
+    """
+    with open(path, "rb") as file:
+        head = file.read(8)
+    if not head.startswith(SIGNATURES[extension]):
+        raise ValueError(f"The file isn't a valid {extension} image")
+
+
+def sync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def blob_filename(digest, extension):
+    """
+    Returns the name the blob is stored under, an identical blob that is
+    already stored keeps its name
+    """
+    return find(digest) or blob_name(digest, extension)
+
+
+def commit_blob(tmp, name):
+    """
+    Moves the spooled file under its content address, unless an identical
+    blob is already stored. The photo rows referencing it are flushed first,
+    the flush holds SQLite's write lock until they're committed, and
+    release() checks the references under the same lock, so the blob can't
+    be removed between being found here and the commit.
+    """
+    db.session.flush()
+    return place_blob(tmp, name)
+
+
+def place_blob(tmp, name):
+    path = upload_path(name)
+    if os.path.exists(path):
+        os.remove(tmp)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+    return name
+
+
+def commit_blob_durably(tmp, name):
+    """
+    commit_blob that flushes the file and its directory entry to disk
+    """
+    sync_file(tmp)
+    commit_blob(tmp, name)
+    sync_file(os.path.dirname(upload_path(name)))
+    return name
+
+
+def find(digest, site_id=None):
+    query = \
+        db.session.query(Photo.filename)\
+        .filter(Photo.sha256 == digest)
+    if site_id is not None:
+        query = query.join(Gallery).filter(Gallery.site_id == site_id)
+    return query.limit(1).scalar()
+
+
+def find_many(digests):
+    """
+    Returns the stored file names of the given blobs keyed by their digest
+    """
+    if not digests:
+        return {}
+    rows = db.session.execute(
+            select(Photo.sha256, func.min(Photo.filename))
+            .where(Photo.sha256.in_(set(digests)))
+            .group_by(Photo.sha256)
+            ).all()
+    return dict(rows)
+
+
+@retry_on_busy
+def release(filename, digest):
+    """
+    Removes the file once no photo references its blob anymore, the check
+    and the removal run under the write lock (see commit_blob)
+    """
+    begin_immediate()
+    try:
+        if digest is None or find(digest) is None:
+            try:
+                os.remove(upload_path(filename))
+            except FileNotFoundError:
+                pass
+            derivatives.remove(filename)
+    finally:
+        db.session.commit()
@@ -0,0 +1,77 @@
+from flask import current_app, request, stream_with_context
+from .exts import db
+from .reads import row_dicts
+
+
+# Stands in the document for the list written from the stream
+STREAM = object()
+
+
+def requested():
+    return request.json.get("stream") is True
+
+
+def stream_rows(statement, fields):
+    """
+    Yields the row dicts of a select fetched in batches of STREAM_YIELD_PER
+    rows, so only one batch is held in memory at a time
+    """
+    result = db.session.execute(
+            statement.execution_options(yield_per=current_app.config["STREAM_YIELD_PER"])
+            )
+    try:
+        for rows in result.partitions():
+            yield from row_dicts(rows, fields)
+    finally:
+        result.close()
+
+
+def splice(document, dumps):
+    """
+    Returns the JSON text of the document before and after STREAM, or None
+    when the document doesn't contain it. The key holding it is written
+    last, so the rest of the document is serialized as a whole and no user
+    data is searched for a marker.
+    """
+    if document is STREAM:
+        return "", ""
+    if not isinstance(document, dict):
+        return None
+    for key, value in document.items():
+        parts = splice(value, dumps)
+        if parts is not None:
+            rest = {k: v for k, v in document.items() if k != key}
+            head = dumps(rest)[:-1] + ("," if rest else "") + dumps(key) + ":"
+            return head + parts[0], parts[1] + "}"
+    return None
+
+
+def json_stream(document, items):
+    """
+    Returns a response writing the document with the items as the list in
+    place of STREAM, serialized one by one and sent in chunks of about
+    STREAM_CHUNK_BYTES
+    """
+    dumps = current_app.json.dumps
+    head, tail = splice(document, dumps)
+    chunk_bytes = current_app.config["STREAM_CHUNK_BYTES"]
+
+    def generate():
+        chunk = [head, "["]
+        size = 0
+        separator = ""
+        for item in items:
+            data = dumps(item)
+            chunk.append(separator)
+            chunk.append(data)
+            separator = ","
+            size += len(data)
+            if size >= chunk_bytes:
+                yield "".join(chunk)
+                chunk.clear()
+                size = 0
+        chunk.append("]")
+        chunk.append(tail)
+        yield "".join(chunk)
+
+    return current_app.response_class(stream_with_context(generate()), mimetype=current_app.json.mimetype)
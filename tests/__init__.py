@@ -4,9 +4,11 @@ from .. import create_app
 
 @pytest.fixture()
 def app():
-    app = create_app()
-    app.config.update({
+    app = create_app({
         "TESTING": True,
+        "DATABASE_MODE": "reset",
+        "DERIVATIVE_WORKERS": 0,
+        "INGEST_WORKERS": 0,
     })
 
     yield app
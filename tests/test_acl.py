@@ -0,0 +1,45 @@
+from . import app
+from ..acl import ACLCache, allowed_sites
+from ..exts import db
+from ..models import User, Site, user_sites
+
+
+def test_cache_lru_eviction():
+    cache = ACLCache(2, 60)
+    cache.put(1, frozenset([1]))
+    cache.put(2, frozenset([2]))
+    cache.get(1)
+    cache.put(3, frozenset([3]))
+    assert cache.get(1) == frozenset([1])
+    assert cache.get(2) is None
+    assert cache.get(3) == frozenset([3])
+
+
+def test_cache_ttl_expiry():
+    cache = ACLCache(2, -1)
+    cache.put(1, frozenset([1]))
+    assert cache.get(1) is None
+
+
+def test_allowed_sites(app):
+    with app.test_request_context():
+        assert allowed_sites(1) == frozenset([1, 4])
+        assert allowed_sites(5) is None
+
+
+def test_invalidated_on_user_sites_change(app):
+    with app.test_request_context():
+        assert 3 not in allowed_sites(1)
+        user = db.session.get(User, 1)
+        user.sites.append(db.session.get(Site, 3))
+        db.session.commit()
+        assert 3 in allowed_sites(1)
+
+
+def test_shared_generation(app):
+    app.config["ACL_CACHE_SHARED"] = True
+    with app.test_request_context():
+        assert 2 not in allowed_sites(1)
+        db.session.execute(user_sites.insert().values(user_id=1, site_id=2))
+        db.session.commit()
+        assert 2 in allowed_sites(1)
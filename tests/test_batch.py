@@ -0,0 +1,101 @@
+import sqlite3
+import pytest
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from . import app, client
+from .test_metrics import sample
+from ..batch import Batch
+from ..engine import retry_on_busy
+from ..exts import db
+
+
+SOURCE = {"source": {"app_name": "pl.api.cms", "user_id": 1}}
+
+RENAME = {
+        "method": "PUT",
+        "path": "/site/1/module/gallery/1",
+        "json": {"payload": {"name": "batch name", "description": "batch description"}}
+        }
+
+
+def test_batch(app, client):
+    with app.app_context():
+        engine = db.engine
+    commits = []
+
+    def count(conn):
+        commits.append(conn)
+
+    event.listen(engine, "commit", count)
+    resp = client.post("/batch", json={
+            **SOURCE,
+            "operations": [
+                RENAME,
+                {"method": "POST", "path": "/site/1/module/subject", "json": {"payload": {"subject": "batch"}}},
+                {"method": "PUT", "path": "/site/1/module/gallery/99", "json": RENAME["json"]},
+                {"path": "/site/2/module/gallery/1"},
+                {"path": "/site/1/module/gallery/1", "json": {"fields": ["name"], "include": []}},
+                {"method": "POST", "path": "/batch"}
+                ]
+            })
+    event.remove(engine, "commit", count)
+    assert resp.status_code == 200
+    assert resp.json["committed"] is True
+    assert [x["status"] for x in resp.json["data"]] == [204, 201, 404, 403, 200, 400]
+    assert resp.json["data"][4]["body"] == {"data": {"id": 1, "name": "batch name"}}
+    assert len(commits) == 1
+
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE)
+    assert resp.json["data"]["name"] == "batch name"
+
+
+def test_batch_atomic(client):
+    resp = client.post("/batch", json={
+            **SOURCE,
+            "atomic": True,
+            "operations": [
+                RENAME,
+                {"method": "DELETE", "path": "/site/1/module/gallery/1/photo/1"},
+                {"method": "DELETE", "path": "/site/1/module/gallery/1/photo/99"},
+                {"method": "DELETE", "path": "/site/1/module/gallery/1/photo/2"}
+                ]
+            })
+    assert resp.status_code == 200
+    assert resp.json["committed"] is False
+    assert [x["status"] for x in resp.json["data"]] == [204, 204, 404, 424]
+
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE)
+    assert resp.json["data"]["name"] != "batch name"
+    assert len(resp.json["data"]["photos"]) == 4
+
+    resp = client.post("/batch", json={**SOURCE, "operations": []})
+    assert resp.status_code == 400
+
+
+def test_batch_metrics(client):
+    client.post("/batch", json={**SOURCE, "operations": [RENAME, {"path": "/site/1/module/gallery/1"}]})
+    text = client.get("/metrics").get_data(as_text=True)
+    assert sample(text, "http_requests_total", endpoint="batch.batch_post", status="200") == 1
+    assert sample(text, "http_requests_total", endpoint="views.gallery_change", status="204") == 1
+    assert sample(text, "http_requests_total", endpoint="views.gallery_get_one", status="200") == 1
+    # the batch's own statements: the ACL lookup, the savepoints and the commit
+    assert sample(text, "db_queries_total", endpoint="batch.batch_post") >= 4
+    assert sample(text, "db_queries_total", endpoint="views.gallery_get_one") >= 2
+    batch_seconds = sample(text, "http_request_duration_seconds_sum", endpoint="batch.batch_post")
+    assert batch_seconds >= sample(text, "http_request_duration_seconds_sum", endpoint="views.gallery_get_one")
+
+
+def test_batch_busy_not_retried(app):
+    calls = []
+
+    @retry_on_busy
+    def view():
+        calls.append(1)
+        raise OperationalError("COMMIT", {}, sqlite3.OperationalError("database is locked"))
+
+    with app.test_request_context():
+        g.batch = Batch(frozenset())
+        with pytest.raises(OperationalError):
+            view()
+    assert len(calls) == 1
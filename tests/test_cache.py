@@ -0,0 +1,83 @@
+from sqlalchemy import event
+from . import app, client
+from ..cache import ResponseCache
+from ..exts import db
+from ..models import Subject
+
+
+SOURCE = {"source": {"app_name": "pl.api.cms", "user_id": 1}}
+
+
+def test_conditional_get(app, client):
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE)
+    assert resp.status_code == 200
+    etag = resp.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.headers["ETag"] == etag
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE)
+    assert resp.status_code == 200
+    event.remove(engine, "before_cursor_execute", count)
+    assert statements == []
+
+    other = client.get("/site/1/module/gallery/2", json=SOURCE)
+    assert other.headers["ETag"] != etag
+
+
+def test_version_bumped_by_writes(client):
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE)
+    etag = resp.headers["ETag"]
+
+    resp = client.put(
+            "/site/1/module/gallery/1/photo/1/update",
+            json={**SOURCE, "payload": {"description": "changed"}}
+            )
+    assert resp.status_code == 204
+
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+    assert resp.json["data"]["photos"][0]["description"] == "changed"
+
+
+def test_subject_change_bumps_linked_sites(app, client):
+    resp = client.get("/site/1/module/subject", json=SOURCE)
+    etag = resp.headers["ETag"]
+
+    with app.app_context():
+        db.session.get(Subject, 1).subject = "muzyka klasyczna"
+        db.session.commit()
+
+    resp = client.get("/site/1/module/subject", json=SOURCE, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert "muzyka klasyczna" in [x["subject"] for x in resp.json]
+
+
+def test_forbidden_before_cache(client):
+    client.get("/site/1/module/gallery/1", json=SOURCE)
+    resp = client.get("/site/2/module/gallery/1", json=SOURCE)
+    assert resp.status_code == 403
+
+
+def test_response_cache_bound():
+    cache = ResponseCache(10)
+    cache.put("a", 1, b"1234", "application/json")
+    cache.put("b", 1, b"1234", "application/json")
+    assert cache.get("a", 1) is not None
+    cache.put("c", 1, b"1234", "application/json")
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) is not None
+    assert cache.get("a", 2) is None
+    cache.put("d", 1, b"12345678901", "application/json")
+    assert cache.get("d", 1) is None
+    assert cache.size == 8
@@ -0,0 +1,22 @@
+from sqlalchemy import func, select, text
+from . import app, runner
+from ..exts import db
+from ..models import Gallery, Photo, Subject, site_subjects, TRIGGERS
+
+
+def test_generate(app, runner):
+    result = runner.invoke(args=[
+            "generate", "--users", "3", "--sites", "5", "--subjects", "10",
+            "--subjects-per-site", "4", "--galleries", "20", "--photos", "300",
+            "--images", "3", "--batch", "7", "--seed", "1"
+            ])
+    assert result.exit_code == 0
+    with app.app_context():
+        assert db.session.execute(select(func.count()).select_from(Photo)).scalar() == 308
+        assert db.session.execute(select(func.sum(Gallery.photo_count))).scalar() == 308
+        assert db.session.execute(select(func.sum(Subject.connections_count))).scalar() == \
+            db.session.execute(select(func.count()).select_from(site_subjects)).scalar()
+        triggers = db.session.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+                ).scalars()
+        assert set(triggers) == set(TRIGGERS)
@@ -0,0 +1,36 @@
+import sqlite3
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from . import app
+from ..engine import retry_on_busy
+from ..exts import db
+
+
+def test_pragmas(app):
+    with app.app_context():
+        assert db.session.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert db.session.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert db.session.execute(text("PRAGMA foreign_keys")).scalar() == 1
+        assert db.session.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+
+def test_retry_on_busy(app):
+    calls = []
+
+    @retry_on_busy
+    def view():
+        calls.append(1)
+        if len(calls) < 3:
+            raise OperationalError("COMMIT", {}, sqlite3.OperationalError("database is locked"))
+        return "ok"
+
+    with app.app_context():
+        assert view() == "ok"
+        assert len(calls) == 3
+
+        app.config["SQLITE_BUSY_RETRIES"] = 1
+        calls.clear()
+        with pytest.raises(OperationalError):
+            view()
+        assert len(calls) == 2
@@ -0,0 +1,86 @@
+import json
+import re
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from . import app, client
+from .. import create_app, metrics
+from ..exts import db
+from ..metrics import Registry, render
+
+
+def sample(text, name, **labels):
+    for line in text.splitlines():
+        if line.startswith(name + "{") and all(f'{k}="{v}"' in line for k, v in labels.items()):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_metrics(client):
+    source = {"source": {"app_name": "pl.api.cms", "user_id": 1}}
+    client.get("/site/1/module/gallery/1", json=source)
+    client.get("/site/1/module/gallery/1", json=source)
+    client.get("/site/1/module/gallery/100", json=source)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert sample(text, "http_requests_total", endpoint="views.gallery_get_one", status="200") == 2
+    assert sample(text, "http_requests_total", endpoint="views.gallery_get_one", status="404") == 1
+    assert sample(text, "http_request_duration_seconds_count", endpoint="views.gallery_get_one") == 3
+    assert sample(text, "http_request_duration_seconds_bucket", endpoint="views.gallery_get_one", le="+Inf") == 3
+    assert sample(text, "db_queries_total", endpoint="views.gallery_get_one") >= 5
+    # the gallery and its 4 photos, the second request is served from the cache
+    assert sample(text, "db_rows_total", endpoint="views.gallery_get_one") >= 5
+    assert sample(text, "http_response_bytes_total", endpoint="views.gallery_get_one") > 0
+
+
+def test_metrics_failed_statement(app):
+    with app.test_request_context():
+        metrics.before_request()
+        connection = db.session.connection()
+        with pytest.raises(OperationalError):
+            db.session.execute(text("SELECT * FROM missing_table"))
+        assert connection.info["metrics_start"] == []
+        db.session.rollback()
+        assert db.session.execute(text("SELECT 1 UNION SELECT 2")).all() == [(1,), (2,)]
+        assert metrics.current().rows == 2
+        metrics.teardown_request(None)
+        assert metrics.current() is None
+
+        # outside of measured requests the rows are fetched without a row factory
+        db.session.execute(text("SELECT 1"))
+        assert db.session.connection().connection.dbapi_connection.row_factory is None
+
+
+def test_metrics_multiprocess(tmp_path):
+    registry = Registry()
+    registry.inc("db_queries_total", (("endpoint", "a"),), 2)
+    (tmp_path / "metrics_1.json").write_text(json.dumps(registry.snapshot()))
+
+    app = create_app({
+            "TESTING": True,
+            "DATABASE_MODE": "reset",
+            "DERIVATIVE_WORKERS": 0,
+            "METRICS_DIR": str(tmp_path)
+            })
+    client = app.test_client()
+    client.get("/ping")
+    text = client.get("/metrics").get_data(as_text=True)
+
+    assert sample(text, "db_queries_total", endpoint="a") == 2
+    assert sample(text, "http_requests_total", endpoint="views.ping_api_get") == 1
+    assert len(list(tmp_path.glob("metrics_*.json"))) == 2
+
+
+def test_render_merges_snapshots():
+    registry = Registry()
+    registry.observe("http_request_duration_seconds", (("endpoint", "a"),), 0.02)
+    text = render([registry.snapshot(), registry.snapshot()])
+    assert sample(text, "http_request_duration_seconds_bucket", endpoint="a", le="0.01") == 0
+    assert sample(text, "http_request_duration_seconds_bucket", endpoint="a", le="0.025") == 2
+    assert sample(text, "http_request_duration_seconds_count", endpoint="a") == 2
+    assert re.search(r'^http_request_duration_seconds_sum\{endpoint="a"\} 0.04$', text, re.M)
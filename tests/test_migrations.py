@@ -0,0 +1,57 @@
+import os
+import pytest
+from alembic.script import ScriptDirectory
+from flask_migrate import upgrade
+from sqlalchemy import text
+from . import app
+from .. import create_app
+from ..exts import db, init_migrate
+from ..init_db import SCHEMA_REVISION
+
+
+def schema():
+    rows = db.session.execute(text("SELECT type, name, sql FROM sqlite_master ORDER BY name"))
+    return [(type_, name, " ".join((sql or "").split())) for type_, name, sql in rows]
+
+
+def test_head_revision(app):
+    init_migrate(app)
+    with app.app_context():
+        config = app.extensions["migrate"].migrate.get_config()
+        assert ScriptDirectory.from_config(config).get_current_head() == SCHEMA_REVISION
+
+
+def test_upgrade_matches_models(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "DATABASE_MODE": "reset",
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(tmp_path, "test.db"),
+    })
+    init_migrate(app)
+    with app.app_context():
+        created = schema()
+        db.drop_all()
+        tables = db.session.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'search_index_%'"
+                )).scalars().all()
+        for name in tables:
+            db.session.execute(text(f'DROP TABLE "{name}"'))
+        db.session.commit()
+        assert schema() == []
+
+        upgrade()
+        assert schema() == created
+
+
+def test_stale_schema_refused(tmp_path):
+    config = {
+        "TESTING": True,
+        "DATABASE_MODE": "reset",
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(tmp_path, "test.db"),
+    }
+    app = create_app(config)
+    with app.app_context():
+        db.session.execute(text("UPDATE alembic_version SET version_num = 'stale'"))
+        db.session.commit()
+    with pytest.raises(RuntimeError, match="stale"):
+        create_app({**config, "DATABASE_MODE": "persistent"})
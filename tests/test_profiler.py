@@ -0,0 +1,95 @@
+import json
+import pstats
+import threading
+from .. import create_app, profiler
+
+
+def make_app(tmp_path, **config):
+    return create_app({
+            "TESTING": True,
+            "DATABASE_MODE": "reset",
+            "DERIVATIVE_WORKERS": 0,
+            "PROFILE_DIR": str(tmp_path),
+            **config
+            })
+
+
+def test_profile_request(tmp_path):
+    client = make_app(tmp_path, PROFILE_TOKEN="secret").test_client()
+    source = {"source": {"app_name": "pl.api.cms", "user_id": 1}}
+
+    response = client.get("/site/1/module/gallery/1", json=source)
+    assert "X-Profile-Id" not in response.headers
+
+    response = client.get("/site/1/module/gallery/1", json=source, headers={"X-Profile": "wrong"})
+    assert "X-Profile-Id" not in response.headers
+
+    response = client.get("/site/1/module/gallery/1", json=source, headers={"X-Profile": "żółw"})
+    assert response.status_code == 200
+    assert "X-Profile-Id" not in response.headers
+
+    response = client.get("/site/1/module/gallery/2", json=source, headers={"X-Profile": "secret"})
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+    # the profile is written once the server closes the response
+    response.close()
+
+    with open(tmp_path / f"{profile_id}.json") as file:
+        report = json.load(file)
+    assert report["endpoint"] == "views.gallery_get_one"
+    assert report["status"] == 200
+    assert any("FROM photo" in x["statement"] for x in report["sql"])
+    assert pstats.Stats(str(tmp_path / f"{profile_id}.pstats")).total_calls > 0
+    assert (tmp_path / f"{profile_id}.collapsed").exists()
+    assert len(list(tmp_path.iterdir())) == 3
+
+
+def test_profile_disabled(tmp_path):
+    app = make_app(tmp_path)
+    response = app.test_client().get("/ping", headers={"X-Profile": ""})
+    assert "X-Profile-Id" not in response.headers
+    assert profiler.before_request not in app.before_request_funcs.get(None, [])
+
+
+def test_profile_streamed_request(tmp_path):
+    client = make_app(tmp_path, PROFILE_TOKEN="secret").test_client()
+    source = {"source": {"app_name": "pl.api.cms", "user_id": 1}}
+    response = client.get(
+            "/site/1/module/gallery/1/photos",
+            json={**source, "stream": True},
+            headers={"X-Profile": "secret"},
+            buffered=False
+            )
+    profile_id = response.headers["X-Profile-Id"]
+    assert not (tmp_path / f"{profile_id}.json").exists()
+    assert len(json.loads(b"".join(response.response))["data"]) == 4
+    response.close()
+
+    with open(tmp_path / f"{profile_id}.json") as file:
+        report = json.load(file)
+    # the photos are selected while the body is streamed
+    assert any("FROM photo" in x["statement"] for x in report["sql"])
+
+
+def test_profile_batch(tmp_path):
+    client = make_app(tmp_path, PROFILE_TOKEN="secret").test_client()
+    threads = threading.active_count()
+    response = client.post(
+            "/batch",
+            json={
+                "source": {"app_name": "pl.api.cms", "user_id": 1},
+                "operations": [{"path": "/site/1/module/gallery/1"}, {"path": "/site/1/module/gallery/2"}]
+                },
+            headers={"X-Profile": "secret"}
+            )
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+    response.close()
+
+    with open(tmp_path / f"{profile_id}.json") as file:
+        report = json.load(file)
+    assert report["endpoint"] == "batch.batch_post"
+    # the operations' statements are part of the batch's profile
+    assert any("FROM photo" in x["statement"] for x in report["sql"])
+    assert len(list(tmp_path.iterdir())) == 3
+    assert threading.active_count() == threads
@@ -0,0 +1,41 @@
+import json
+import pytest
+from sqlalchemy import select
+from . import app, client
+from .. import reads, serializer
+from ..exts import db
+from ..models import Subject, Gallery, Photo
+
+
+def test_rows_match_as_dict(app):
+    with app.app_context():
+        db.session.execute(
+                Photo.__table__.update()
+                .where(Photo.id == 1)
+                .values(derivatives={"160": "111_160.webp"})
+                )
+        galleries = Gallery.query.order_by(Gallery.id).all()
+        rows = db.session.execute(
+                select(*reads.GALLERY_COLUMNS)
+                .order_by(Gallery.id)
+                ).all()
+        assert reads.gallery_dicts(rows) == [x.as_dict() for x in galleries]
+
+        subjects = Subject.query.order_by(Subject.id).all()
+        rows = db.session.execute(
+                select(*reads.SUBJECT_COLUMNS)
+                .order_by(Subject.id)
+                ).all()
+        assert [reads.subject_dict(x) for x in rows] == [x.as_dict() for x in subjects]
+
+
+@pytest.mark.skipif(not serializer.enabled(), reason="orjson is not installed")
+def test_orjson_provider(app, client):
+    assert isinstance(app.json, serializer.OrjsonProvider)
+    source = {"source": {"app_name": "pl.api.cms", "user_id": 1}}
+    resp = client.get("/site/1/module/gallery/1", json=source)
+    assert resp.mimetype == "application/json"
+    with app.test_request_context():
+        expected = serializer.DefaultJSONProvider(app).dumps(resp.json)
+    assert json.loads(resp.data) == json.loads(expected)
+    assert list(resp.json["data"]) == sorted(resp.json["data"])
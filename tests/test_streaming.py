@@ -0,0 +1,61 @@
+import gzip
+import json
+from . import app, client
+
+
+SOURCE = {"source": {"app_name": "pl.api.cms", "user_id": 1}}
+
+
+def test_streamed_matches_buffered(app, client):
+    app.config["STREAM_YIELD_PER"] = 1
+    app.config["STREAM_CHUNK_BYTES"] = 1
+
+    buffered = client.get("/site/1/module/gallery/1", json={**SOURCE, "fields": ["name"]})
+    streamed = client.get("/site/1/module/gallery/1", json={**SOURCE, "fields": ["name"], "stream": True})
+    assert streamed.status_code == 200
+    assert streamed.is_streamed
+    assert "ETag" not in streamed.headers
+    data = json.loads(streamed.get_data())["data"]
+    assert set(data) == {"id", "name", "photos"}
+    assert data["photos"] == buffered.json["data"]["photos"]
+
+    photos = client.get("/site/1/module/gallery/1/photos", json={**SOURCE, "fields": "sort", "stream": True})
+    assert [x["id"] for x in photos.json["data"]] == [1, 2, 3, 4]
+    assert set(photos.json["data"][0]) == {"id", "sort"}
+
+    subjects = client.get("/site/1/module/subject", json={**SOURCE, "stream": True})
+    assert subjects.json == client.get("/site/1/module/subject", json=SOURCE).json
+
+
+def test_streamed_marker_in_data(client):
+    # the name is the text the placeholder used to be replaced at
+    resp = client.put("/site/1/module/gallery/1", json={**SOURCE, "payload": {"name": "\0stream\0", "description": "x"}})
+    assert resp.status_code == 204
+    streamed = client.get("/site/1/module/gallery/1", json={**SOURCE, "stream": True})
+    data = json.loads(streamed.get_data())["data"]
+    assert data["name"] == "\0stream\0"
+    assert len(data["photos"]) == 4
+
+
+def test_compression(app, client):
+    app.config["COMPRESS_MIN_SIZE"] = 1
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE, headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in resp.vary
+    assert json.loads(gzip.decompress(resp.get_data()))["data"]["id"] == 1
+
+    resp = client.get(
+            "/site/1/module/gallery/1",
+            json={**SOURCE, "stream": True},
+            headers={"Accept-Encoding": "gzip;q=1, identity;q=0.5"}
+            )
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert len(json.loads(gzip.decompress(resp.get_data()))["data"]["photos"]) == 4
+
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE, headers={"Accept-Encoding": "gzip;q=0"})
+    assert "Content-Encoding" not in resp.headers
+
+    app.config["COMPRESS_MIN_SIZE"] = 1024 * 1024
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE, headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in resp.headers
+    assert resp.json["data"]["id"] == 1
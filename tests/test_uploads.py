@@ -0,0 +1,108 @@
+import datetime
+import os
+from sqlalchemy import update
+from . import app, client, runner
+from ..exts import db
+from ..models import Photo, UploadJob, UploadSession
+
+
+SOURCE = {"source": {"app_name": "pl.api.cms", "user_id": 1}}
+
+
+def start(client, content, filename="big.png"):
+    resp = client.post("/site/1/module/gallery/1/upload", json={
+            **SOURCE,
+            "payload": {"filename": filename, "length": len(content), "description": "resumed"}
+            })
+    assert resp.status_code == 201
+    assert resp.headers["Upload-Offset"] == "0"
+    return resp.headers["Location"]
+
+
+def patch(client, location, offset, chunk):
+    return client.patch(
+            location,
+            data=chunk,
+            headers={"Upload-Offset": str(offset)},
+            content_type="application/offset+octet-stream"
+            )
+
+
+def test_resumable_upload(app, client):
+    with open("./test.png", "rb") as file:
+        content = file.read()
+    location = start(client, content)
+    half = len(content) // 2
+
+    resp = patch(client, location, 0, content[:half])
+    assert resp.status_code == 204
+    assert resp.headers["Upload-Offset"] == str(half)
+    resp = client.head(location)
+    assert resp.status_code == 200
+    assert resp.headers["Upload-Offset"] == str(half)
+    assert resp.headers["Upload-Length"] == str(len(content))
+
+    resp = patch(client, location, 0, content[:half])
+    assert resp.status_code == 409
+    resp = patch(client, location, half, content[half:] + b"extra")
+    assert resp.status_code == 400
+
+    resp = patch(client, location, half, content[half:])
+    assert resp.status_code == 200
+    with app.app_context():
+        photo = db.session.get(Photo, resp.json["photo_id"])
+        assert photo.description == "resumed"
+        with open(os.path.join(app.config["UPLOAD_FOLDER"], photo.filename), "rb") as file:
+            assert file.read() == content
+    assert client.head(location).status_code == 404
+    assert not os.path.exists(os.path.join(app.config["UPLOAD_FOLDER"], "tmp", "session_" + location.rsplit("/", 1)[1]))
+
+
+def test_resumable_upload_invalid(client):
+    resp = client.post("/site/1/module/gallery/1/upload", json={
+            **SOURCE,
+            "payload": {"filename": "big.txt", "length": 10}
+            })
+    assert resp.status_code == 400
+    resp = client.post("/site/1/module/gallery/1/upload", json={
+            **SOURCE,
+            "payload": {"filename": "big.png", "length": 1024 * 1024 * 1024}
+            })
+    assert resp.status_code == 400
+
+    location = start(client, b"not an image")
+    resp = patch(client, location, 0, b"not an image")
+    assert resp.status_code == 400
+    assert client.head(location).status_code == 404
+
+
+def test_expired_uploads_collected(app, client, runner):
+    location = start(client, b"x" * 100)
+    upload_id = location.rsplit("/", 1)[1]
+    tmp = os.path.join(app.config["UPLOAD_FOLDER"], "tmp")
+    assert os.path.getsize(os.path.join(tmp, "session_" + upload_id)) == 100
+
+    orphans = [os.path.join(tmp, "session_orphan"), os.path.join(tmp, "tmporphan")]
+    for orphan in orphans:
+        open(orphan, "wb").close()
+        os.utime(orphan, (0, 0))
+    with app.app_context():
+        db.session.execute(
+                update(UploadSession)
+                .where(UploadSession.id == upload_id)
+                .values(expire_date=db.func.datetime("now", "-1 seconds"))
+                )
+        db.session.add(UploadJob(id="stale", site_id=1, gallery_id=1, create_date=datetime.datetime(2000, 1, 1)))
+        db.session.add(UploadJob(id="queued", site_id=1, gallery_id=1))
+        db.session.commit()
+    assert client.head(location).status_code == 404
+
+    result = runner.invoke(args=["clean-uploads"])
+    assert "Removed 4" in result.output
+    assert not os.path.exists(os.path.join(tmp, "session_" + upload_id))
+    for orphan in orphans:
+        assert not os.path.exists(orphan)
+    with app.app_context():
+        assert db.session.get(UploadSession, upload_id) is None
+        assert db.session.get(UploadJob, "stale").status == "failed"
+        assert db.session.get(UploadJob, "queued").status == "pending"
@@ -1,8 +1,18 @@
 import pytest
 import json
+import hashlib
 import os
+import struct
+import threading
+import time
+import zlib
 from io import BytesIO
-from . import app, client
+from sqlalchemy import delete, event
+from . import app, client, runner
+from .. import ingest, storage
+from ..exts import db
+from ..models import Subject, Gallery, Photo, UploadJob
+from ..pagination import encode_cursor
 
 
 SOURCE = {
@@ -47,6 +57,108 @@ def test_gallery_list(client):
     assert resp.json["data"][0]["id"]>resp.json["data"][-1]["id"]
 
 
+def test_gallery_list_query_count(app, client):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count)
+    counts = []
+    for per_page in [4, 1, 3]:
+        statements.clear()
+        payload = {
+                **SOURCE,
+                "include": ["photos"],
+                "paginate": {
+                        "page": 1,
+                        "per_page": per_page,
+                        "order": "id",
+                        "order_desc": False
+                    }
+                }
+        resp = client.get(
+                "/site/1/module/gallery",
+                data=json.dumps(payload),
+                content_type="application/json"
+                )
+        assert resp.status_code == 200
+        counts.append(len(statements))
+    event.remove(engine, "before_cursor_execute", count)
+    assert counts[1] == counts[2]
+    photos = resp.json["data"][0]["photos"]
+    assert [x["sort"] for x in photos] == sorted(x["sort"] for x in photos)
+
+
+def test_gallery_list_cursor(client):
+    ids = []
+    cursor = None
+    while True:
+        payload = {
+                **SOURCE,
+                "paginate": {
+                        "cursor": cursor,
+                        "per_page": 2,
+                        "order": "sort",
+                        "order_desc": True,
+                        "with_total": True
+                    }
+                }
+        resp = client.get(
+                "/site/1/module/gallery",
+                data=json.dumps(payload),
+                content_type="application/json"
+                )
+        assert resp.status_code == 200
+        assert len(resp.json["data"]) <= 2
+        ids += [x["id"] for x in resp.json["data"]]
+        cursor = resp.json["pagination"]["next_cursor"]
+        if cursor is None:
+            break
+    assert len(ids) == len(set(ids)) == resp.json["pagination"]["total"]
+
+
+def test_gallery_list_invalid_cursor(client):
+    payload = {
+            **SOURCE,
+            "paginate": {
+                    "cursor": "invalid",
+                    "per_page": 2,
+                    "order": "id",
+                    "order_desc": False
+                }
+            }
+    resp = client.get(
+            "/site/1/module/gallery",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    check_error(400, "Bad Request", resp)
+
+    payload["paginate"]["cursor"] = None
+    for per_page in [0, -1, 101, "2"]:
+        payload["paginate"]["per_page"] = per_page
+        resp = client.get(
+                "/site/1/module/gallery",
+                data=json.dumps(payload),
+                content_type="application/json"
+                )
+        check_error(400, "Bad Request", resp)
+    payload["paginate"]["per_page"] = 2
+
+    for values in [["id", "1", 1], ["id", True, 1], ["id", [1], 1], ["id", 1, 1.5], ["name", 1, 1]]:
+        payload["paginate"]["cursor"] = encode_cursor(values)
+        payload["paginate"]["order"] = values[0]
+        resp = client.get(
+                "/site/1/module/gallery",
+                data=json.dumps(payload),
+                content_type="application/json"
+                )
+        check_error(400, "Bad Request", resp)
+
+
 def test_gallery_add(client):
     payload = {
             **SOURCE,
@@ -79,6 +191,130 @@ def test_gallery_get_one(client):
     assert all(x in resp.json["data"] for x in ["id", "name", "description"])
 
 
+def test_gallery_get_fields(client):
+    payload = {
+            **SOURCE,
+            "fields": "name,photo_count",
+            "photos_limit": 3
+            }
+    resp = client.get(
+            "/site/1/module/gallery/1",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert resp.status_code == 200
+    data = resp.json["data"]
+    assert set(data) == {"id", "name", "photo_count", "photos", "photos_next_cursor"}
+    assert len(data["photos"]) == 3
+    assert data["photos_next_cursor"] is not None
+
+    payload = {
+            **SOURCE,
+            "paginate": {
+                    "cursor": data["photos_next_cursor"],
+                    "per_page": 10
+                },
+            "fields": ["description"]
+            }
+    resp = client.get(
+            "/site/1/module/gallery/1/photos",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert resp.status_code == 200
+    assert resp.json["data"] == [{"id": 4, "description": "description 8"}]
+    assert resp.json["pagination"]["next_cursor"] is None
+
+
+def test_gallery_get_list_include(client):
+    payload = {
+            **SOURCE,
+            "paginate": {
+                    "page": 1,
+                    "per_page": 10,
+                    "order": "id",
+                    "order_desc": False
+                }
+            }
+    resp = client.get(
+            "/site/1/module/gallery",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert resp.status_code == 200
+    assert all("photos" not in x for x in resp.json["data"])
+
+    payload["include"] = ["photos"]
+    payload["photos_limit"] = 1
+    resp = client.get(
+            "/site/1/module/gallery",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert resp.status_code == 200
+    assert len(resp.json["data"][0]["photos"]) == 1
+    assert resp.json["data"][0]["photos_next_cursor"] is not None
+
+
+def test_gallery_photos_get_list(client):
+    ids = []
+    cursor = None
+    while True:
+        payload = {
+                **SOURCE,
+                "paginate": {
+                        "cursor": cursor,
+                        "per_page": 3
+                    }
+                }
+        resp = client.get(
+                "/site/1/module/gallery/1/photos",
+                data=json.dumps(payload),
+                content_type="application/json"
+                )
+        assert resp.status_code == 200
+        ids.extend(x["id"] for x in resp.json["data"])
+        cursor = resp.json["pagination"]["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == [1, 2, 3, 4]
+
+
+def test_gallery_fields_unknown(client):
+    payload = {
+            **SOURCE,
+            "fields": ["name", "secret"]
+            }
+    resp = client.get(
+            "/site/1/module/gallery/1",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    check_error(400, "Bad Request", resp)
+    resp = client.get(
+            "/site/1/module/gallery/99/photos",
+            data=json.dumps(SOURCE),
+            content_type="application/json"
+            )
+    check_error(404, "Not found", resp)
+
+
+def test_gallery_fields_wrong_type(client):
+    for extra in ({"fields": [1]}, {"include": 5}, {"include": [["photos"]]}):
+        resp = client.get(
+                "/site/1/module/gallery/1",
+                data=json.dumps({**SOURCE, **extra}),
+                content_type="application/json"
+                )
+        check_error(400, "Bad Request", resp)
+    resp = client.get(
+            "/site/1/module/gallery/1/photos",
+            data=json.dumps({**SOURCE, "fields": [None]}),
+            content_type="application/json"
+            )
+    check_error(400, "Bad Request", resp)
+
+
 def test_gallery_photo_upload(client):
     payload = {
             **SOURCE
@@ -96,6 +332,325 @@ def test_gallery_photo_upload(client):
     assert resp.json["photo_id"] > 0
 
 
+def test_gallery_photo_upload_deduplicated(client):
+    with open("./test.png", "rb") as file:
+        content = file.read()
+    digest = hashlib.sha256(content).hexdigest()
+    ids = []
+    for _ in range(2):
+        resp = client.post(
+                "/site/1/module/gallery/1",
+                data={**SOURCE, "description": "file description", "file":(BytesIO(content), 'test.png')},
+                content_type="multipart/form-data"
+                )
+        assert resp.status_code == 200
+        ids.append(resp.json["photo_id"])
+
+    resp = client.get(
+            f"/site/1/module/photo/blob/{digest}",
+            data=json.dumps(SOURCE),
+            content_type="application/json"
+            )
+    assert resp.status_code == 200
+    assert resp.json["exists"]
+
+    resp = client.post(
+            "/site/1/module/gallery/1",
+            data={**SOURCE, "description": "file description", "sha256": digest},
+            content_type="multipart/form-data"
+            )
+    assert resp.status_code == 200
+    ids.append(resp.json["photo_id"])
+
+    resp = client.get(
+            "/site/1/module/gallery/1",
+            data=json.dumps(SOURCE),
+            content_type="application/json"
+            )
+    filenames = {x["filename"] for x in resp.json["data"]["photos"] if x["id"] in ids}
+    assert filenames == {f"{digest[:2]}/{digest[2:4]}/{digest}.png"}
+
+
+def test_release_waits_for_uploads(app):
+    digest = "f" * 64
+    name = f"ff/ff/{digest}.png"
+    path = os.path.join(app.config["UPLOAD_FOLDER"], name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(b"blob")
+
+    def release():
+        with app.app_context():
+            storage.release(name, digest)
+
+    with app.app_context():
+        # an upload that found the blob holds the write lock from its flush
+        db.session.add(Photo(filename=name, sha256=digest, description="found", sort=1, gallery_id=1))
+        db.session.flush()
+        thread = threading.Thread(target=release)
+        thread.start()
+        time.sleep(0.2)
+        db.session.commit()
+    thread.join()
+    assert os.path.exists(path)
+
+    with app.app_context():
+        db.session.execute(delete(Photo).where(Photo.sha256 == digest))
+        db.session.commit()
+        storage.release(name, digest)
+    assert not os.path.exists(path)
+
+
+def test_reused_blob_not_released(app, client, monkeypatch):
+    with open("./test.png", "rb") as file:
+        content = file.read() + b"reused"
+    digest = hashlib.sha256(content).hexdigest()
+    resp = client.post(
+            "/site/1/module/gallery/1",
+            data={**SOURCE, "description": "first", "file": (BytesIO(content), 'test.png')},
+            content_type="multipart/form-data"
+            )
+    first_id = resp.json["photo_id"]
+    path = os.path.join(app.config["UPLOAD_FOLDER"], storage.blob_name(digest, "png"))
+
+    def delete_first():
+        with app.app_context():
+            db.session.execute(delete(Photo).where(Photo.id == first_id))
+            db.session.commit()
+            storage.release(storage.blob_name(digest, "png"), digest)
+
+    find = storage.find
+    thread = threading.Thread(target=delete_first)
+
+    def find_then_delete(digest, site_id=None):
+        filename = find(digest, site_id)
+        if site_id is not None:
+            # the only other photo of the blob is deleted while the upload runs
+            thread.start()
+            time.sleep(0.2)
+        return filename
+
+    monkeypatch.setattr(storage, "find", find_then_delete)
+    resp = client.post(
+            "/site/1/module/gallery/1",
+            data={**SOURCE, "description": "reused", "sha256": digest},
+            content_type="multipart/form-data"
+            )
+    thread.join()
+    assert resp.status_code == 200
+    assert os.path.exists(path)
+
+    resp = client.delete(
+            f"/site/1/module/gallery/1/photo/{resp.json['photo_id']}",
+            data=json.dumps(SOURCE),
+            content_type="application/json"
+            )
+    assert resp.status_code == 204
+    assert not os.path.exists(path)
+
+
+def test_gallery_photo_probe_missing(client):
+    resp = client.get(
+            f"/site/1/module/photo/blob/{'0' * 64}",
+            data=json.dumps(SOURCE),
+            content_type="application/json"
+            )
+    assert resp.status_code == 200
+    assert not resp.json["exists"]
+
+
+def test_gallery_photo_upload_async(client):
+    with open("./test.png", "rb") as file:
+        content = file.read()
+    resp = client.post(
+            "/site/1/module/gallery/1",
+            data={"description": "async description", "file": (BytesIO(content), 'test.png')},
+            content_type="multipart/form-data",
+            headers={"Prefer": "respond-async"}
+            )
+    assert resp.status_code == 202
+    job_id = resp.json["job_id"]
+
+    resp = client.get(f"/site/1/module/upload/{job_id}", json=SOURCE)
+    assert resp.status_code == 200
+    job = resp.json["data"]
+    assert job["status"] == "done"
+    assert job["error"] is None
+
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE)
+    photos = resp.json["data"]["photos"]
+    assert photos[-1]["id"] == job["photo_id"]
+    assert photos[-1]["description"] == "async description"
+
+    resp = client.get(f"/site/4/module/upload/{job_id}", json=SOURCE)
+    assert resp.status_code == 404
+
+
+def test_gallery_photo_upload_async_invalid(app, client):
+    resp = client.post(
+            "/site/1/module/gallery/1",
+            data={"description": "not an image", "file": (BytesIO(b"plain text"), 'test.png')},
+            content_type="multipart/form-data",
+            headers={"Prefer": "respond-async"}
+            )
+    assert resp.status_code == 202
+
+    resp = client.get(f"/site/1/module/upload/{resp.json['job_id']}", json=SOURCE)
+    assert resp.json["data"]["status"] == "failed"
+    assert "valid png" in resp.json["data"]["error"]
+    assert os.listdir(os.path.join(app.config["UPLOAD_FOLDER"], "tmp")) == []
+
+
+def test_gallery_photo_upload_async_crash(app, client, monkeypatch):
+    def crash(job_id, photo_id=None, error=None):
+        raise RuntimeError("crash")
+
+    with open("./test.png", "rb") as file:
+        content = file.read() + b"crash"
+    digest = hashlib.sha256(content).hexdigest()
+    monkeypatch.setattr(ingest, "finish", crash)
+    resp = client.post(
+            "/site/1/module/gallery/1",
+            data={"description": "crash", "file": (BytesIO(content), 'test.png')},
+            content_type="multipart/form-data",
+            headers={"Prefer": "respond-async"}
+            )
+    assert resp.status_code == 202
+
+    with app.app_context():
+        job = db.session.get(UploadJob, resp.json["job_id"])
+        assert job.status == "failed"
+        assert db.session.query(Photo).filter_by(sha256=digest).count() == 0
+    assert os.listdir(os.path.join(app.config["UPLOAD_FOLDER"], "tmp")) == []
+    assert not os.path.exists(os.path.join(app.config["UPLOAD_FOLDER"], storage.blob_name(digest, "png")))
+
+
+def test_gallery_photos_upload_batch(client):
+    with open("./test.png", "rb") as file:
+        content = file.read()
+    resp = client.post(
+            "/site/1/module/gallery/1/photos",
+            data={
+                "file": [
+                    (BytesIO(content), 'a.png'),
+                    (BytesIO(b"text"), 'b.txt'),
+                    (BytesIO(content), 'c.png')
+                    ],
+                "description": ["first", "second", "third"]
+                },
+            content_type="multipart/form-data"
+            )
+    assert resp.status_code == 200
+    results = resp.json["data"]
+    assert [x["filename"] for x in results] == ["a.png", "b.txt", "c.png"]
+    assert "error" in results[1] and "photo_id" not in results[1]
+    ids = [results[0]["photo_id"], results[2]["photo_id"]]
+
+    resp = client.get("/site/1/module/gallery/1", json=SOURCE)
+    photos = resp.json["data"]["photos"]
+    assert [x["id"] for x in photos[-2:]] == ids
+    assert [x["description"] for x in photos[-2:]] == ["first", "third"]
+    assert photos[-1]["sort"] - photos[-2]["sort"] == photos[-2]["sort"] - photos[-3]["sort"]
+    assert photos[-1]["filename"] == photos[-2]["filename"]
+
+    resp = client.post(
+            "/site/1/module/gallery/1/photos",
+            data={"file": [(BytesIO(content), 'a.png')], "description": []},
+            content_type="multipart/form-data"
+            )
+    assert resp.status_code == 400
+
+
+def test_gallery_photo_derivatives(app, client, runner):
+    pytest.importorskip("PIL")
+    with open("./test.png", "rb") as file:
+        file_bytes = BytesIO(file.read())
+    resp = client.post(
+            "/site/1/module/gallery/1",
+            data={**SOURCE, "description": "file description", "file":(file_bytes, 'test.png')},
+            content_type="multipart/form-data"
+            )
+    photo_id = resp.json["photo_id"]
+    resp = client.get(
+            "/site/1/module/gallery/1",
+            data=json.dumps(SOURCE),
+            content_type="application/json"
+            )
+    photo = [x for x in resp.json["data"]["photos"] if x["id"] == photo_id][0]
+    assert set(photo["derivatives"]) == {"160", "640", "1280"}
+    assert photo["derivatives"]["160"].startswith("/pictures/")
+    assert photo["derivatives"]["160"].endswith("_160.webp")
+
+    result = runner.invoke(args=["regenerate-derivatives", "--missing", "--workers", "1"])
+    assert result.exit_code == 0
+
+
+def png_chunk(kind, body):
+    return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+
+
+def test_gallery_photo_derivatives_failed(app, client, runner):
+    pytest.importorskip("PIL")
+    # Pillow refuses to open it with DecompressionBombError, not an OSError
+    bomb = b"\x89PNG\r\n\x1a\n" \
+        + png_chunk(b"IHDR", struct.pack(">IIBBBBB", 30000, 30000, 8, 2, 0, 0, 0)) \
+        + png_chunk(b"IDAT", zlib.compress(b"")) \
+        + png_chunk(b"IEND", b"")
+    resp = client.post(
+            "/site/1/module/gallery/1",
+            data={**SOURCE, "description": "bomb", "file": (BytesIO(bomb), 'bomb.png')},
+            content_type="multipart/form-data"
+            )
+    assert resp.status_code == 200
+    photo_id = resp.json["photo_id"]
+
+    result = runner.invoke(args=["regenerate-derivatives", "--missing", "--workers", "1"])
+    assert result.exit_code == 0
+    with app.app_context():
+        assert db.session.get(Photo, photo_id).derivatives is None
+
+
+def test_photo_file_get(client):
+    with open("./test.png", "rb") as file:
+        content = file.read()
+    resp = client.post(
+            "/site/1/module/gallery/1",
+            data={**SOURCE, "description": "file description", "file":(BytesIO(content), 'test.png')},
+            content_type="multipart/form-data"
+            )
+    digest = hashlib.sha256(content).hexdigest()
+    url = f"/pictures/{digest[:2]}/{digest[2:4]}/{digest}.png"
+
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.data == content
+    assert "immutable" in resp.headers["cache-control"]
+    etag = resp.headers["etag"]
+
+    resp = client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+    resp = client.get(url, headers={"Range": "bytes=0-9"})
+    assert resp.status_code == 206
+    assert resp.data == content[:10]
+
+
+def test_photo_file_get_404(app, client):
+    resp = client.get("/pictures/../master.db")
+    assert resp.status_code == 404
+    tmp_dir = os.path.join(app.config["UPLOAD_FOLDER"], "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    with open(os.path.join(tmp_dir, "spooled.png"), "wb") as file:
+        file.write(b"unfinished")
+    try:
+        for url in ["/pictures/tmp/spooled.png", "/pictures/./tmp/spooled.png", "/pictures/00/../tmp/spooled.png"]:
+            assert client.get(url).status_code == 404
+    finally:
+        os.remove(os.path.join(tmp_dir, "spooled.png"))
+    resp = client.get("/pictures/00/00/missing.png")
+    check_error(404, "Not found", resp)
+
+
 def test_gallery_change(client):
     payload = {
             **SOURCE,
@@ -138,6 +693,84 @@ def test_gallery_move_down(client):
     assert resp.status_code == 204
 
 
+def gallery_order(client, site_id):
+    payload = {
+            **SOURCE,
+            "paginate": {
+                    "page": 1,
+                    "per_page": 100,
+                    "order": "sort",
+                    "order_desc": False
+                }
+            }
+    resp = client.get(
+            f"/site/{site_id}/module/gallery",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    return [x["id"] for x in resp.json["data"]]
+
+
+def test_gallery_reorder(client):
+    order = gallery_order(client, 1)[::-1]
+    resp = client.put(
+            "/site/1/module/gallery/reorder",
+            data=json.dumps({**SOURCE, "order": order}),
+            content_type="application/json"
+            )
+    assert resp.status_code == 204
+    assert gallery_order(client, 1) == order
+
+    resp = client.put(
+            "/site/1/module/gallery/reorder",
+            data=json.dumps({**SOURCE, "order": order[1:]}),
+            content_type="application/json"
+            )
+    check_error(400, "Bad Request", resp)
+    for wrong in (5, "1,2", [order], [str(x) for x in order], None):
+        for path in ("/site/1/module/gallery/reorder", "/site/1/module/gallery/1/photos/reorder"):
+            resp = client.put(
+                    path,
+                    data=json.dumps({**SOURCE, "order": wrong}),
+                    content_type="application/json"
+                    )
+            check_error(400, "Bad Request", resp)
+
+
+def test_gallery_move_renumbers(client):
+    order = gallery_order(client, 1)
+    for _ in range(24):
+        resp = client.put(
+                f"/site/1/module/gallery/{order[0]}/move_up",
+                data=json.dumps(SOURCE),
+                content_type="application/json"
+                )
+        assert resp.status_code == 204
+        order = [order[1], order[0]] + order[2:]
+        assert gallery_order(client, 1) == order
+
+
+def test_gallery_photos_reorder(client):
+    resp = client.get(
+            "/site/1/module/gallery/1",
+            data=json.dumps(SOURCE),
+            content_type="application/json"
+            )
+    order = [x["id"] for x in resp.json["data"]["photos"]][::-1]
+    resp = client.put(
+            "/site/1/module/gallery/1/photos/reorder",
+            data=json.dumps({**SOURCE, "order": order}),
+            content_type="application/json"
+            )
+    assert resp.status_code == 204
+    resp = client.get(
+            "/site/1/module/gallery/1",
+            data=json.dumps(SOURCE),
+            content_type="application/json"
+            )
+    assert [x["id"] for x in resp.json["data"]["photos"]] == order
+
+
 def test_gallery_photos_update(client):
     payload = {
             **SOURCE,
@@ -149,6 +782,10 @@ def test_gallery_photos_update(client):
                     {
                         "id": 2,
                         "description": "new description"
+                    },
+                    {
+                        "id": 5,
+                        "description": "new description"
                     }
                 ]
             }
@@ -157,7 +794,49 @@ def test_gallery_photos_update(client):
             data=json.dumps(payload),
             content_type="application/json"
             )
-    assert resp.status_code == 204
+    assert resp.status_code == 200
+    assert resp.json["updated"] == [1, 2]
+    assert resp.json["skipped"] == [5]
+
+    resp = client.get(
+            "/site/1/module/gallery/1",
+            data=json.dumps(SOURCE),
+            content_type="application/json"
+            )
+    photos = {x["id"]: x for x in resp.json["data"]["photos"]}
+    assert photos[1]["description"] == "new description"
+    assert photos[1]["edit_date"] != "None"
+
+
+def test_gallery_photos_sort(client):
+    payload = {
+            **SOURCE,
+            "photos":[
+                    {
+                        "id": 1,
+                        "sort": 3
+                    },
+                    {
+                        "id": 2,
+                        "sort": 2
+                    }
+                ]
+            }
+    resp = client.put(
+            "/site/1/module/gallery/1/photos/sort",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert resp.status_code == 200
+    assert resp.json["updated"] == [1, 2]
+
+    payload["photos"][0]["sort"] = 0
+    resp = client.put(
+            "/site/1/module/gallery/1/photos/sort",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    check_error(400, "Bad Request", resp)
 
 
 def test_gallery_photo_reupload(client):
@@ -252,6 +931,35 @@ def test_subjects_get_list(client):
     assert all(x in resp.json[0] for x in ["id", "subject", "connections_count"])
 
 
+def test_counters(app, client, runner):
+    payload = {
+            **SOURCE
+            }
+    resp = client.get(
+            "/site/1/module/subject/1",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert resp.json["connections_count"] == 2
+    resp = client.delete(
+            "/site/1/module/subject/1",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert resp.status_code == 204
+    with app.app_context():
+        assert db.session.get(Subject, 1).connections_count == 1
+        assert db.session.get(Gallery, 1).photo_count == 4
+        db.session.get(Subject, 1).connections_count = 100
+        db.session.get(Gallery, 1).photo_count = 100
+        db.session.commit()
+    result = runner.invoke(args=["rebuild-counters"])
+    assert result.exit_code == 0
+    with app.app_context():
+        assert db.session.get(Subject, 1).connections_count == 1
+        assert db.session.get(Gallery, 1).photo_count == 4
+
+
 def test_subjects_add(client):
     payload = {
             **SOURCE,
@@ -325,6 +1033,100 @@ def test_subject_prefix_row_get_list(client):
     assert resp.json[0]["id"] == 1
 
 
+def test_subject_prefix_folded(client):
+    payload = {
+            **SOURCE,
+            "payload": {
+                "subject": "Łódzkie muzea"
+                }
+            }
+    resp = client.post(
+            "/site/1/module/subject",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert resp.status_code == 201
+    payload = {
+            **SOURCE,
+            "limit": 1
+            }
+    resp = client.get(
+            "/site/1/module/subject/lodz",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert resp.status_code == 200
+    assert [x["subject"] for x in resp.json] == ["Łódzkie muzea"]
+    resp = client.get(
+            "/site/1/module/subject/m",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert len(resp.json) == 1
+
+    for limit in [0, -1, "5", 1000]:
+        resp = client.get(
+                "/site/1/module/subject/m",
+                data=json.dumps({**SOURCE, "limit": limit}),
+                content_type="application/json"
+                )
+        check_error(400, "Bad Request", resp)
+
+
+def test_search(client, runner):
+    payload = {
+            **SOURCE,
+            "query": "descr",
+            "paginate": {
+                "page": 1,
+                "per_page": 5
+                }
+            }
+    resp = client.get(
+            "/site/1/module/search",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert resp.status_code == 200
+    assert len(resp.json["data"]) == 5
+    assert resp.json["pagination"]["has_next"]
+    assert {"photo", "gallery"} == {x["type"] for x in resp.json["data"]}
+
+    payload["query"] = "gallery"
+    resp = client.get(
+            "/site/3/module/search",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    check_error(403, "Forbidden", resp)
+
+    result = runner.invoke(args=["rebuild-search"])
+    assert result.exit_code == 0
+    resp = client.get(
+            "/site/1/module/search",
+            data=json.dumps(payload),
+            content_type="application/json"
+            )
+    assert len(resp.json["data"]) == 3
+    assert all(x["type"] == "gallery" for x in resp.json["data"])
+
+    for paginate in [{"page": 0}, {"page": "2"}, {"per_page": -5}, {"per_page": None}]:
+        resp = client.get(
+                "/site/1/module/search",
+                data=json.dumps({**payload, "paginate": paginate}),
+                content_type="application/json"
+                )
+        check_error(400, "Bad Request", resp)
+
+    for query in ["", "  ", 5, ["gallery"], None]:
+        resp = client.get(
+                "/site/1/module/search",
+                data=json.dumps({**payload, "query": query}),
+                content_type="application/json"
+                )
+        check_error(400, "Bad Request", resp)
+
+
 def test_gallery_options(client):
     resp = client.options("/site/1/module/gallery")
     assert resp.status_code == 200
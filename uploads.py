@@ -0,0 +1,184 @@
+import errno
+import os
+import time
+import uuid
+from flask import current_app
+from sqlalchemy import delete, func, select, update
+from werkzeug.exceptions import ClientDisconnected
+from . import batch, storage
+from .exts import db
+from .models import UploadJob, UploadSession
+
+
+SPOOL_PREFIX = "session_"
+
+
+def spool_path(upload_id):
+    return storage.upload_path("tmp", SPOOL_PREFIX + upload_id)
+
+
+def expires():
+    return func.datetime("now", f"+{current_app.config['UPLOAD_SESSION_TTL']} seconds")
+
+
+def preallocate(fd, length):
+    """
+    Reserves the whole file up front, so a full disk fails the session
+    creation instead of a chunk halfway through
+    """
+    try:
+        os.posix_fallocate(fd, 0, length)
+    except AttributeError:
+        os.ftruncate(fd, length)
+    except OSError as e:
+        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+            raise
+        os.ftruncate(fd, length)
+
+
+def create(gallery, filename, length, description):
+    """
+    Records an upload session and preallocates its spool file
+    """
+    session = UploadSession(
+            id=uuid.uuid4().hex,
+            site_id=gallery.site_id,
+            gallery_id=gallery.id,
+            filename=filename,
+            description=description,
+            length=length,
+            expire_date=expires()
+            )
+    path = spool_path(session.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        preallocate(fd, length)
+    except OSError:
+        os.close(fd)
+        os.remove(path)
+        raise
+    os.close(fd)
+    db.session.add(session)
+    batch.commit()
+    db.session.refresh(session)
+    return session
+
+
+def write(session, offset, stream):
+    """
+    Writes the chunk at its offset with pwrite and returns how many bytes
+    were received and whether the client went away before sending all of
+    them; the bytes that arrived are kept either way
+    """
+    fd = os.open(spool_path(session.id), os.O_WRONLY)
+    received = 0
+    disconnected = False
+    try:
+        while chunk := stream.read(storage.CHUNK_SIZE):
+            if offset + received + len(chunk) > session.length:
+                raise ValueError("The chunk doesn't fit in the upload length")
+            os.pwrite(fd, chunk, offset + received)
+            received += len(chunk)
+    except ClientDisconnected:
+        disconnected = True
+    finally:
+        os.close(fd)
+    return received, disconnected
+
+
+def advance(session, offset, received):
+    """
+    Moves the session offset past the written chunk unless another request
+    has moved it first, and extends the session's lifetime
+    """
+    result = db.session.execute(
+            update(UploadSession)
+            .where(UploadSession.id == session.id, UploadSession.offset == offset)
+            .values(offset=offset + received, expire_date=expires())
+            .execution_options(synchronize_session=False)
+            )
+    db.session.commit()
+    db.session.refresh(session)
+    return result.rowcount == 1
+
+
+def discard(session):
+    db.session.delete(session)
+    batch.commit()
+    batch.defer(remove_spool, session.id)
+
+
+def remove_spool(upload_id):
+    remove_file(spool_path(upload_id))
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def collect():
+    """
+    Removes the expired sessions with their spool files, fails the upload
+    jobs pending longer than UPLOAD_JOB_TIMEOUT and removes the files in
+    tmp/ without a live session that weren't written to for as long, which
+    covers the uploads of crashed requests and jobs. Returns the number of
+    removed sessions, jobs and files.
+    """
+    expired = db.session.scalars(
+            select(UploadSession.id)
+            .where(UploadSession.expire_date <= func.now())
+            ).all()
+    if expired:
+        db.session.execute(delete(UploadSession).where(UploadSession.id.in_(expired)))
+        db.session.commit()
+    removed = 0
+    for upload_id in expired:
+        remove_spool(upload_id)
+        removed += 1
+
+    timeout = current_app.config["UPLOAD_JOB_TIMEOUT"]
+    result = db.session.execute(
+            update(UploadJob)
+            .where(
+                UploadJob.status == "pending",
+                UploadJob.create_date <= func.datetime("now", f"-{timeout} seconds")
+                )
+            .values(status="failed", error="The upload wasn't processed in time", finish_date=func.now())
+            .execution_options(synchronize_session=False)
+            )
+    db.session.commit()
+    removed += result.rowcount
+
+    tmp_dir = storage.upload_path("tmp")
+    if not os.path.isdir(tmp_dir):
+        return removed
+    live = {SPOOL_PREFIX + x for x in db.session.scalars(select(UploadSession.id))}
+    cutoff = time.time() - timeout
+    for entry in os.scandir(tmp_dir):
+        if entry.name in live or not entry.is_file():
+            continue
+        try:
+            stale = entry.stat().st_mtime < cutoff
+        except FileNotFoundError:
+            continue
+        if stale:
+            remove_file(entry.path)
+            removed += 1
+    return removed
+
+
+def maybe_collect():
+    """
+    Collects expired sessions at most once per UPLOAD_SESSION_GC_INTERVAL
+    in each process, outside of batches
+    """
+    extensions = current_app.extensions
+    now = time.monotonic()
+    if batch.active() or now < extensions.get("upload_gc", 0):
+        return
+    extensions["upload_gc"] = now + current_app.config["UPLOAD_SESSION_GC_INTERVAL"]
+    collect()
@@ -1,24 +1,45 @@
-from flask import Blueprint, request, abort, current_app
+from flask import Blueprint, current_app, g, request, abort
 from functools import wraps
-from werkzeug.utils import secure_filename
 import os
-import datetime
 import re
-from .models import User, Site, Subject, Gallery, Photo
+from sqlalchemy import func, select, bindparam
+from .models import Site, Subject, Gallery, Photo, UploadJob, UploadSession, fold
 from .exts import db
+from . import batch, derivatives, ingest, ordering, reads, storage, streaming, uploads
+from .acl import allowed_sites
+from .engine import begin_immediate, retry_on_busy
+from .search import search
+from .pagination import keyset, offset_page, cached_total, forget_total
+from .cache import cached_response
 
 
 bp = Blueprint("views", __name__)
 
 ALLOWED_EXTENSIONS = ["gif", "jpg", "jpeg", "png"]
 
+PREFIX_END = chr(0x10ffff)
+
+GALLERY_CURSOR_KEYS = {
+        "id": Gallery.id,
+        "sort": func.coalesce(Gallery.sort, 0),
+        "name": Gallery.name,
+        }
+
 
 def mes_404(res, id):
     return f"The {res} with the given id ({id}) doesn't exist"
 
 
-def unique_filename(filename):
-    return str(datetime.datetime.now().date()) + '_' + str(datetime.datetime.now().time()).replace(':', '.')+"_"+filename
+def cursor_per_page(paginate):
+    """
+    Page size of the cursor pagination, bounded so that one request can't
+    read a whole site
+    """
+    per_page = paginate.get("per_page", 20)
+    max_per_page = current_app.config["CURSOR_PER_PAGE_LIMIT"]
+    if not isinstance(per_page, int) or not 1 <= per_page <= max_per_page:
+        abort(400, f"The per page value should be a positive number up to {max_per_page}")
+    return per_page
 
 
 def allowed_file(filename):
@@ -26,19 +47,35 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def gallery_read_args(include_photos):
+    """
+    Reads the sparse fieldset, photo embedding and preview size of gallery reads
+    """
+    fields = reads.parse_fields(request.json.get("fields"), reads.GALLERY_FIELDS)
+    include = request.json.get("include")
+    if include is not None:
+        if isinstance(include, str):
+            include = include.split(",")
+        if not isinstance(include, list) or not all(isinstance(x, str) for x in include):
+            abort(400, "The include should be a list of names")
+        include_photos = "photos" in include
+    photos_limit = request.json.get("photos_limit", current_app.config["GALLERY_PHOTOS_LIMIT"])
+    if not isinstance(photos_limit, int) or photos_limit < 0:
+        abort(400, "The photos limit should be a non-negative number")
+    return fields, include_photos, photos_limit
+
+
 def check_user(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         if "source" not in request.json:
             abort(400, "The source object is required in request json")
         user_id = request.json["source"]["user_id"]
-        site = \
-            User.query\
-            .get_or_404(user_id, mes_404("user", user_id))\
-            .sites\
-            .filter(Site.id == kwargs["site_id"])\
-            .first()
-        if not site:
+        # a batch has checked the user's sites once for all its operations
+        sites = g.batch.sites if batch.active() else allowed_sites(user_id)
+        if sites is None:
+            abort(404, mes_404("user", user_id))
+        if kwargs["site_id"] not in sites:
             abort(403, f"The user with id ({user_id}) is not allowed to access that site")
         return f(*args, **kwargs)
     return decorated
@@ -54,31 +91,53 @@ def ping_api_get():
 
 @bp.route("/site/<int:site_id>/module/gallery", methods=["GET"])
 @check_user
+@cached_response
 def gallery_get_list(site_id):
     """
     [User] Podaje listę albumów w galerii z paginacją
     """
     paginate = request.json["paginate"]
-    key = getattr(Gallery, paginate["order"] if paginate["order"] else "sort")
-    key = key.desc() if paginate["order_desc"] else key.asc()
-
-    galleries = \
-        Gallery.query\
-        .filter_by(site_id=site_id)\
-        .order_by(key)\
-        .paginate(page=paginate["page"], per_page=paginate["per_page"], error_out=False)
-
-    pagination = {
-            "page": galleries.page,
-            "pages": galleries.pages,
-            "per_page": galleries.per_page,
-            "total": galleries.total
-            }
-    galleries = [x.as_dict() for x in galleries]
+    order = paginate["order"] if paginate["order"] else "sort"
+    fields, include_photos, photos_limit = gallery_read_args(False)
+
+    if "cursor" in paginate:
+        if order not in GALLERY_CURSOR_KEYS:
+            abort(400, f"The cursor pagination doesn't support the order ({order})")
+        per_page = cursor_per_page(paginate)
+        galleries, next_cursor = keyset(
+                reads.galleries(site_id, fields),
+                order,
+                GALLERY_CURSOR_KEYS[order],
+                Gallery.id,
+                paginate["cursor"],
+                per_page,
+                paginate["order_desc"]
+                )
+        pagination = {
+                "per_page": per_page,
+                "next_cursor": next_cursor
+                }
+        if paginate.get("with_total"):
+            pagination["total"] = cached_total(
+                    ("gallery", site_id),
+                    Gallery.query.filter_by(site_id=site_id).count
+                    )
+    else:
+        key = getattr(Gallery, order)
+        key = key.desc() if paginate["order_desc"] else key.asc()
+
+        galleries, pagination = offset_page(
+                reads.galleries(site_id, fields).order_by(key),
+                paginate["page"],
+                paginate["per_page"]
+                )
+
+    galleries = reads.gallery_dicts(galleries, fields, include_photos, photos_limit)
     return {"pagination": pagination, "data": galleries}, 200
 
 
 @bp.route("/site/<int:site_id>/module/gallery", methods=["POST"])
+@retry_on_busy
 @check_user
 def gallery_add(site_id):
     """
@@ -91,10 +150,12 @@ def gallery_add(site_id):
     gallery = Gallery(
             name=payload["name"],
             description=payload["description"],
+            sort=ordering.next_position(Gallery, [Gallery.site_id == site_id])
             )
     site.galleries.append(gallery)
-    db.session.commit()
+    batch.commit()
     db.session.refresh(gallery)
+    forget_total(("gallery", site_id))
     return {"gallery_id": gallery.id}, 201
 
 
@@ -109,54 +170,332 @@ def gallery_get_options(site_id):
 
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>", methods=["GET"])
 @check_user
+@cached_response
 def gallery_get_one(site_id, gallery_id):
     """
     [User] Podaje dane galerii i zdjęcia
     """
-    gallery = \
-        Gallery.query\
-        .filter_by(site_id=site_id, id=gallery_id)\
-        .first_or_404(mes_404("gallery", gallery_id))
-    result = {"data": gallery.as_dict()}
+    fields, include_photos, photos_limit = gallery_read_args(True)
+    gallery = db.session.execute(
+            reads.galleries(site_id, fields)
+            .where(Gallery.id == gallery_id)
+            ).first()
+    if gallery is None:
+        abort(404, mes_404("gallery", gallery_id))
+    if include_photos and streaming.requested():
+        result = {"data": {**reads.gallery_dicts([gallery], fields, False)[0], "photos": streaming.STREAM}}
+        photos = reads.photos(gallery_id).order_by(reads.PHOTO_CURSOR_KEY, reads.photo.c.id)
+        return streaming.json_stream(result, streaming.stream_rows(photos, reads.PHOTO_FIELDS))
+    result = {"data": reads.gallery_dicts([gallery], fields, include_photos, photos_limit)[0]}
     return result, 200
 
 
+@bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/photos", methods=["GET"])
+@check_user
+@cached_response
+def gallery_photos_get_list(site_id, gallery_id):
+    """
+    [User] Podaje zdjęcia albumu z paginacją
+    """
+    exists = db.session.execute(
+            select(Gallery.id)
+            .where(Gallery.site_id == site_id, Gallery.id == gallery_id)
+            ).first()
+    if exists is None:
+        abort(404, mes_404("gallery", gallery_id))
+    fields = reads.parse_fields(request.json.get("fields"), reads.PHOTO_FIELDS)
+    if streaming.requested():
+        photos = reads.photos(gallery_id, fields).order_by(reads.PHOTO_CURSOR_KEY, reads.photo.c.id)
+        return streaming.json_stream({"data": streaming.STREAM}, streaming.stream_rows(photos, fields))
+
+    paginate = request.json.get("paginate", {})
+    per_page = cursor_per_page(paginate)
+
+    photos, next_cursor = keyset(
+            reads.photos(gallery_id, fields),
+            "sort",
+            reads.PHOTO_CURSOR_KEY,
+            reads.photo.c.id,
+            paginate.get("cursor"),
+            per_page
+            )
+    pagination = {
+            "per_page": per_page,
+            "next_cursor": next_cursor
+            }
+    return {"pagination": pagination, "data": reads.row_dicts(photos, fields)}, 200
+
+
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>", methods=["POST"])
 def gallery_photo_upload(site_id, gallery_id):
     """
     [User] Dodaje zdjęcie do albumu
     """
-    if 'file' not in request.files:
+    if 'file' not in request.files and 'sha256' not in request.form:
         abort(400, "The file was not provided")
-    file = request.files['file']
     gallery = \
         Gallery.query\
         .filter_by(site_id=site_id, id=gallery_id)\
         .first_or_404(mes_404("gallery", gallery_id))
-    if file.filename == '':
-        abort(500, description="Filename must be provided")
-    if not allowed_file(file.filename):
-        abort(400, "Only jpg, jpeg, gif and png files are allowed")
 
-    filename = secure_filename(file.filename)
-    filename = unique_filename(filename)
-    file.save(os.path.join(current_app.config["UPLOAD_FOLDER"], filename))
+    if 'file' in request.files:
+        file = request.files['file']
+        if file.filename == '':
+            abort(500, description="Filename must be provided")
+        if not allowed_file(file.filename):
+            abort(400, "Only jpg, jpeg, gif and png files are allowed")
+        extension = file.filename.rsplit('.', 1)[1].lower()
+        if ingest.requested():
+            tmp, digest = storage.spool(file.stream)
+            job = ingest.submit(gallery, tmp, digest, extension, request.form['description'])
+            return {"job_id": job.id}, 202
+        tmp, digest = storage.spool(file.stream)
+        filename = storage.blob_filename(digest, extension)
+    else:
+        tmp = None
+        digest = request.form['sha256']
+        # held until the photo is committed, so release() can't remove
+        # the blob found here in between (see storage.commit_blob)
+        begin_immediate()
+        filename = storage.find(digest, site_id)
+        if filename is None:
+            abort(404, f"The file with the given hash ({digest}) doesn't exist")
 
     description = request.form['description']
 
     photo = Photo(
             filename=filename,
+            sha256=digest,
             description=description,
-            sort=1
+            sort=ordering.next_position(Photo, [Photo.gallery_id == gallery.id])
             )
     gallery.photos.append(photo)
-    db.session.commit()
+    if tmp is not None:
+        storage.commit_blob(tmp, filename)
+    batch.commit()
     db.session.refresh(photo)
+    batch.defer(derivatives.schedule, photo)
 
     return {"photo_id": photo.id}, 200
 
 
+@bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/photos", methods=["POST"])
+def gallery_photos_upload(site_id, gallery_id):
+    """
+    [User] Dodaje wiele zdjęć do albumu w jednym żądaniu
+    """
+    files = request.files.getlist('file')
+    descriptions = request.form.getlist('description')
+    if not files:
+        abort(400, "The files were not provided")
+    if len(files) > current_app.config["UPLOAD_BATCH_LIMIT"]:
+        abort(400, f"At most {current_app.config['UPLOAD_BATCH_LIMIT']} files can be uploaded at once")
+    if len(descriptions) != len(files):
+        abort(400, "Each file needs its own description")
+    gallery = \
+        Gallery.query\
+        .filter_by(site_id=site_id, id=gallery_id)\
+        .first_or_404(mes_404("gallery", gallery_id))
+
+    results = [{"filename": x.filename} for x in files]
+    accepted = []
+    for i, file in enumerate(files):
+        if not allowed_file(file.filename):
+            results[i]["error"] = "Only jpg, jpeg, gif and png files are allowed"
+        else:
+            accepted.append(i)
+
+    spooled = storage.spool_many([files[i].stream for i in accepted])
+    existing = storage.find_many([x[1] for x in spooled if not isinstance(x, Exception)])
+    position = ordering.next_position(Photo, [Photo.gallery_id == gallery.id])
+    photos = []
+    placed = []
+    for i, blob in zip(accepted, spooled):
+        if isinstance(blob, Exception):
+            results[i]["error"] = "The file couldn't be saved"
+            continue
+        tmp, digest = blob
+        extension = files[i].filename.rsplit('.', 1)[1].lower()
+        filename = existing.get(digest) or storage.blob_name(digest, extension)
+        placed.append((tmp, filename, digest))
+        photo = Photo(
+                filename=filename,
+                sha256=digest,
+                description=descriptions[i],
+                sort=position
+                )
+        position += ordering.GAP
+        photos.append((i, photo))
+
+    gallery.photos.extend(x[1] for x in photos)
+    try:
+        for tmp, filename, digest in placed:
+            storage.commit_blob(tmp, filename)
+        for i, photo in photos:
+            results[i]["photo_id"] = photo.id
+        batch.commit()
+    except Exception:
+        db.session.rollback()
+        for tmp, filename, digest in placed:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            else:
+                storage.release(filename, digest)
+        raise
+
+    for _, photo in photos:
+        batch.defer(derivatives.schedule, photo)
+    return {"data": results}, 200
+
+
+@bp.route("/site/<int:site_id>/module/upload/<string:job_id>", methods=["GET"])
+@check_user
+def upload_job_get(site_id, job_id):
+    """
+    [User] Podaje stan przetwarzania przesłanego zdjęcia
+    """
+    job = \
+        UploadJob.query\
+        .filter_by(site_id=site_id, id=job_id)\
+        .first_or_404(mes_404("upload job", job_id))
+    return {"data": job.as_dict()}, 200
+
+
+@bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/upload", methods=["POST"])
+@retry_on_busy
+@check_user
+def upload_session_add(site_id, gallery_id):
+    """
+    [User] Rozpoczyna wznawialne przesyłanie zdjęcia do albumu
+    """
+    payload = request.json["payload"]
+    length = payload.get("length")
+    filename = payload.get("filename", "")
+    if not isinstance(length, int) or length < 1:
+        abort(400, "The upload length should be a positive number of bytes")
+    if length > current_app.config["UPLOAD_SESSION_MAX_BYTES"]:
+        abort(400, f"The upload can't be longer than {current_app.config['UPLOAD_SESSION_MAX_BYTES']} bytes")
+    if not allowed_file(filename):
+        abort(400, "Only jpg, jpeg, gif and png files are allowed")
+    gallery = \
+        Gallery.query\
+        .filter_by(site_id=site_id, id=gallery_id)\
+        .first_or_404(mes_404("gallery", gallery_id))
+
+    uploads.maybe_collect()
+    session = uploads.create(gallery, filename, length, payload.get("description", ""))
+    headers = {
+            "Location": f"/site/{site_id}/module/upload/session/{session.id}",
+            "Upload-Offset": "0",
+            "Upload-Length": str(length)
+            }
+    return {"upload_id": session.id, "data": session.as_dict()}, 201, headers
+
+
+def get_upload_session(site_id, upload_id):
+    # the unguessable session id stands in for the source object, which
+    # chunk requests can't carry in their body
+    return \
+        UploadSession.query\
+        .filter(
+            UploadSession.site_id == site_id,
+            UploadSession.id == upload_id,
+            UploadSession.expire_date > func.now()
+            )\
+        .first_or_404(mes_404("upload session", upload_id))
+
+
+@bp.route("/site/<int:site_id>/module/upload/session/<string:upload_id>", methods=["GET", "HEAD"])
+def upload_session_get(site_id, upload_id):
+    """
+    [User] Podaje liczbę bajtów przesłanych w ramach sesji
+    """
+    session = get_upload_session(site_id, upload_id)
+    headers = {
+            "Upload-Offset": str(session.offset),
+            "Upload-Length": str(session.length),
+            "Cache-Control": "no-store"
+            }
+    return {"data": session.as_dict()}, 200, headers
+
+
+@bp.route("/site/<int:site_id>/module/upload/session/<string:upload_id>", methods=["PATCH"])
+def upload_session_patch(site_id, upload_id):
+    """
+    [User] Zapisuje fragment pliku od podanego przesunięcia, po ostatnim dodaje zdjęcie do albumu
+    """
+    session = get_upload_session(site_id, upload_id)
+    offset = request.headers.get("Upload-Offset", type=int)
+    if offset is None:
+        abort(400, "The Upload-Offset header is required")
+    if offset != session.offset:
+        abort(409, f"The upload continues at the offset ({session.offset})")
+    try:
+        received, disconnected = uploads.write(session, offset, request.stream)
+    except ValueError as e:
+        abort(400, str(e))
+    if not uploads.advance(session, offset, received):
+        abort(409, f"The upload continues at the offset ({session.offset})")
+    if disconnected:
+        abort(400, "The chunk was not received completely")
+    if session.offset < session.length:
+        return '', 204, {"Upload-Offset": str(session.offset)}
+    return finish_upload_session(session)
+
+
+def finish_upload_session(session):
+    """
+    Turns the completed upload into a photo, the same way as a single
+    request upload
+    """
+    tmp = uploads.spool_path(session.id)
+    extension = session.filename.rsplit('.', 1)[1].lower()
+    description = session.description
+    gallery = \
+        Gallery.query\
+        .filter_by(site_id=session.site_id, id=session.gallery_id)\
+        .first()
+    if gallery is None:
+        uploads.discard(session)
+        abort(404, mes_404("gallery", session.gallery_id))
+    digest = storage.hash_file(tmp)
+
+    if ingest.requested():
+        db.session.delete(session)
+        job = ingest.submit(gallery, tmp, digest, extension, description)
+        return {"job_id": job.id}, 202
+    try:
+        storage.validate(tmp, extension)
+    except ValueError as e:
+        uploads.discard(session)
+        abort(400, str(e))
+
+    photo = Photo(
+            filename=storage.blob_filename(digest, extension),
+            sha256=digest,
+            description=description,
+            sort=ordering.next_position(Photo, [Photo.gallery_id == gallery.id])
+            )
+    gallery.photos.append(photo)
+    db.session.delete(session)
+    storage.commit_blob_durably(tmp, photo.filename)
+    batch.commit()
+    db.session.refresh(photo)
+    batch.defer(derivatives.schedule, photo)
+    return {"photo_id": photo.id}, 200, {"Upload-Offset": str(session.length)}
+
+
+@bp.route("/site/<int:site_id>/module/upload/session/<string:upload_id>", methods=["DELETE"])
+def upload_session_delete(site_id, upload_id):
+    """
+    [User] Przerywa wznawialne przesyłanie zdjęcia
+    """
+    uploads.discard(get_upload_session(site_id, upload_id))
+    return '', 204
+
+
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>", methods=["PUT"])
+@retry_on_busy
 @check_user
 def gallery_change(site_id, gallery_id):
     """
@@ -169,11 +508,12 @@ def gallery_change(site_id, gallery_id):
         .first_or_404(mes_404("gallery", gallery_id))
     gallery.name = payload["name"]
     gallery.description = payload["description"]
-    db.session.commit()
+    batch.commit()
     return '', 204
 
 
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>", methods=["DELETE"])
+@retry_on_busy
 @check_user
 def gallery_delete(site_id, gallery_id):
     """
@@ -184,11 +524,26 @@ def gallery_delete(site_id, gallery_id):
         .filter_by(site_id=site_id, id=gallery_id)\
         .first_or_404(mes_404("gallery", gallery_id))
     db.session.delete(gallery)
-    db.session.commit()
+    batch.commit()
+    forget_total(("gallery", site_id))
+    return '', 204
+
+
+@bp.route("/site/<int:site_id>/module/gallery/reorder", methods=["PUT"])
+@retry_on_busy
+@check_user
+def gallery_reorder(site_id):
+    """
+    [User] Ustawia kolejność wszystkich albumów w galerii
+    """
+    if not ordering.reorder(Gallery, [Gallery.site_id == site_id], request.json.get("order")):
+        abort(400, "The order should list every gallery of the site exactly once")
+    batch.commit()
     return '', 204
 
 
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/move_up", methods=["PUT"])
+@retry_on_busy
 @check_user
 def gallery_move_up(site_id, gallery_id):
     """
@@ -198,12 +553,13 @@ def gallery_move_up(site_id, gallery_id):
         Gallery.query\
         .filter_by(site_id=site_id, id=gallery_id)\
         .first_or_404(mes_404("gallery", gallery_id))
-    gallery.sort += 1
-    db.session.commit()
+    ordering.move(Gallery, [Gallery.site_id == site_id], gallery, up=True)
+    batch.commit()
     return '', 204
 
 
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/move_down", methods=["PUT"])
+@retry_on_busy
 @check_user
 def gallery_move_down(site_id, gallery_id):
     """
@@ -213,27 +569,91 @@ def gallery_move_down(site_id, gallery_id):
         Gallery.query\
         .filter_by(site_id=site_id, id=gallery_id)\
         .first_or_404(mes_404("gallery", gallery_id))
-    gallery.sort = max(gallery.sort-1, 1)
-    db.session.commit()
+    ordering.move(Gallery, [Gallery.site_id == site_id], gallery, up=False)
+    batch.commit()
+    return '', 204
+
+
+def bulk_update_photos(site_id, gallery_id, field):
+    photos = {}
+    for p in request.json["photos"]:
+        photos[p["id"]] = p[field]
+
+    found = set(db.session.scalars(
+            select(Photo.id)
+            .join(Gallery)
+            .where(
+                Gallery.site_id == site_id,
+                Photo.gallery_id == gallery_id,
+                Photo.id.in_(photos)
+                )
+            ))
+    if found:
+        photo = Photo.__table__
+        db.session.execute(
+                photo.update()
+                .where(
+                    photo.c.id == bindparam("photo_id"),
+                    photo.c.gallery_id == gallery_id
+                    )
+                .values({field: bindparam("value")}),
+                [{"photo_id": x, "value": photos[x]} for x in found]
+                )
+        batch.commit()
+
+    return {
+            "updated": sorted(found),
+            "skipped": [x for x in photos if x not in found]
+            }
+
+
+@bp.route("/site/<int:site_id>/module/photo/blob/<string:digest>", methods=["GET"])
+@check_user
+def photo_blob_probe(site_id, digest):
+    """
+    [User] Sprawdza czy plik o danym skrócie sha256 jest już zapisany
+    """
+    if not storage.DIGEST_RE.match(digest):
+        abort(400, "The sha256 hash should be 64 lowercase hex characters")
+    return {"sha256": digest, "exists": storage.find(digest, site_id) is not None}, 200
+
+
+@bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/photos/reorder", methods=["PUT"])
+@retry_on_busy
+@check_user
+def gallery_photos_reorder(site_id, gallery_id):
+    """
+    [User] Ustawia kolejność wszystkich zdjęć albumu
+    """
+    Gallery.query\
+        .filter_by(site_id=site_id, id=gallery_id)\
+        .first_or_404(mes_404("gallery", gallery_id))
+    if not ordering.reorder(Photo, [Photo.gallery_id == gallery_id], request.json.get("order")):
+        abort(400, "The order should list every photo of the gallery exactly once")
+    batch.commit()
     return '', 204
 
 
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/photos/update", methods=["PUT"])
+@retry_on_busy
 @check_user
 def gallery_photos_update(site_id, gallery_id):
     """
     [User] Aktualizuje informacje listy zdjęć
     """
-    for p in request.json["photos"]:
-        photo = \
-            Photo.query\
-            .filter_by(gallery_id=gallery_id, id=p["id"])\
-            .first()
-        if photo:
-            photo.description = p["description"]
-
-    db.session.commit()
-    return '', 204
+    return bulk_update_photos(site_id, gallery_id, "description"), 200
+
+
+@bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/photos/sort", methods=["PUT"])
+@retry_on_busy
+@check_user
+def gallery_photos_sort(site_id, gallery_id):
+    """
+    [User] Aktualizuje pozycje listy zdjęć
+    """
+    if any(not isinstance(p["sort"], int) or p["sort"] < 1 for p in request.json["photos"]):
+        abort(400, "The sort value should be an integer greater than 0")
+    return bulk_update_photos(site_id, gallery_id, "sort"), 200
 
 
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/photo/<int:photo_id>", methods=["PUT"])
@@ -253,21 +673,22 @@ def gallery_photo_reupload(site_id, gallery_id, photo_id):
         abort(500, description="Filename must be provided")
     if not allowed_file(filename):
         abort(400, "Only jpg, jpeg, gif and png files are allowed")
-    filename = secure_filename(filename)
-    filename = unique_filename(filename)
-
-    try:
-        os.remove(os.path.join(current_app.config["UPLOAD_FOLDER"], photo.filename))
-    except FileNotFoundError:
-        pass
-    file.save(os.path.join(current_app.config["UPLOAD_FOLDER"], filename))
-
-    photo.filename = filename
-    db.session.commit()
+    extension = filename.rsplit('.', 1)[1].lower()
+
+    old_filename, old_digest = photo.filename, photo.sha256
+    tmp, photo.sha256 = storage.spool(file.stream)
+    photo.filename = storage.blob_filename(photo.sha256, extension)
+    photo.derivatives = None
+    storage.commit_blob(tmp, photo.filename)
+    batch.commit()
+    if photo.filename != old_filename:
+        batch.defer(storage.release, old_filename, old_digest)
+    batch.defer(derivatives.schedule, photo)
     return '', 204
 
 
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/photo/<int:photo_id>", methods=["DELETE"])
+@retry_on_busy
 @check_user
 def gallery_photo_delete(site_id, gallery_id, photo_id):
     """
@@ -278,11 +699,13 @@ def gallery_photo_delete(site_id, gallery_id, photo_id):
         .filter_by(gallery_id=gallery_id, id=photo_id)\
         .first_or_404(mes_404("photo", photo_id))
     db.session.delete(photo)
-    db.session.commit()
+    batch.commit()
+    batch.defer(storage.release, photo.filename, photo.sha256)
     return '', 204
 
 
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/photo/<int:photo_id>/update", methods=["PUT"])
+@retry_on_busy
 @check_user
 def gallery_photo_update(site_id, gallery_id, photo_id):
     """
@@ -294,11 +717,12 @@ def gallery_photo_update(site_id, gallery_id, photo_id):
         .filter_by(gallery_id=gallery_id, id=photo_id)\
         .first_or_404(mes_404("photo", photo_id))
     photo.description = description
-    db.session.commit()
+    batch.commit()
     return '', 204
 
 
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/photo/<int:photo_id>/move_up", methods=["PUT"])
+@retry_on_busy
 @check_user
 def gallery_photo_move_up(site_id, gallery_id, photo_id):
     """
@@ -308,12 +732,13 @@ def gallery_photo_move_up(site_id, gallery_id, photo_id):
         Photo.query\
         .filter_by(gallery_id=gallery_id, id=photo_id)\
         .first_or_404(mes_404("photo", photo_id))
-    photo.sort += 1
-    db.session.commit()
+    ordering.move(Photo, [Photo.gallery_id == gallery_id], photo, up=True)
+    batch.commit()
     return '', 204
 
 
 @bp.route("/site/<int:site_id>/module/gallery/<int:gallery_id>/photo/<int:photo_id>/move_down", methods=["PUT"])
+@retry_on_busy
 @check_user
 def gallery_photo_move_down(site_id, gallery_id, photo_id):
     """
@@ -323,26 +748,28 @@ def gallery_photo_move_down(site_id, gallery_id, photo_id):
         Photo.query\
         .filter_by(gallery_id=gallery_id, id=photo_id)\
         .first_or_404(mes_404("photo", photo_id))
-    photo.sort = max(photo.sort-1, 1)
-    db.session.commit()
+    ordering.move(Photo, [Photo.gallery_id == gallery_id], photo, up=False)
+    batch.commit()
     return '', 204
 
 
 @bp.route("/site/<int:site_id>/module/subject", methods=["GET"])
 @check_user
+@cached_response
 def subjects_get_list(site_id):
     """
     [User] Podaje listę tematyk strony
     """
-    subjects = \
-        Site.query\
-        .get(site_id)\
-        .subjects
-    result = [x.as_dict() for x in subjects]
+    if streaming.requested():
+        fields = [x.name for x in reads.SUBJECT_COLUMNS]
+        return streaming.json_stream(streaming.STREAM, streaming.stream_rows(reads.subjects(site_id), fields))
+    subjects = db.session.execute(reads.subjects(site_id))
+    result = [reads.subject_dict(x) for x in subjects]
     return result, 200
 
 
 @bp.route("/site/<int:site_id>/module/subject", methods=["POST"])
+@retry_on_busy
 @check_user
 def subjects_add(site_id):
     """
@@ -356,28 +783,30 @@ def subjects_add(site_id):
 
     new_subject = Subject(subject=subject)
     site.subjects.append(new_subject)
-    db.session.commit()
+    batch.commit()
 
     return '', 201
 
 
 @bp.route("/site/<int:site_id>/module/subject/<int:subject_id>", methods=["GET"])
 @check_user
+@cached_response
 def subjects_get_one(site_id, subject_id):
     """
     [User] Podaje tematykę o określonym id
     """
-    subject = \
-        Site.query\
-        .get(site_id)\
-        .subjects\
-        .filter(Subject.id == subject_id)\
-        .first_or_404(mes_404("subject", subject_id))
+    subject = db.session.execute(
+            reads.subjects(site_id)
+            .where(Subject.id == subject_id)
+            ).first()
+    if subject is None:
+        abort(404, mes_404("subject", subject_id))
 
-    return subject.as_dict(), 200
+    return reads.subject_dict(subject), 200
 
 
 @bp.route("/site/<int:site_id>/module/subject/<int:subject_id>", methods=["PUT"])
+@retry_on_busy
 @check_user
 def subjects_change(site_id, subject_id):
     """
@@ -391,11 +820,12 @@ def subjects_change(site_id, subject_id):
         .first_or_404(mes_404("subject", subject_id))
 
     subject.subject = request.json["payload"]["subject"]
-    db.session.commit()
+    batch.commit()
     return '', 204
 
 
 @bp.route("/site/<int:site_id>/module/subject/<int:subject_id>", methods=["DELETE"])
+@retry_on_busy
 @check_user
 def subjects_delete(site_id, subject_id):
     """
@@ -410,7 +840,7 @@ def subjects_delete(site_id, subject_id):
         .first_or_404(mes_404("subject", subject_id))
     
     site.subjects.remove(subject)
-    db.session.commit()
+    batch.commit()
     return '', 204
 
 
@@ -420,11 +850,45 @@ def subject_prefix_row_get_list(site_id, row_prefix):
     """
     [User] Podaje listę tematyk strony dla danego prefixu i rekordu
     """
-    subjects = \
-        Site.query\
-        .get(site_id)\
-        .subjects\
-        .filter(Subject.subject.startswith(row_prefix))\
-        .all()
-    subjects = [{"id": x.id} for x in subjects]
+    max_limit = current_app.config["SUBJECT_PREFIX_LIMIT"]
+    limit = request.json.get("limit", max_limit)
+    if not isinstance(limit, int) or not 1 <= limit <= max_limit:
+        abort(400, f"The limit should be a positive number up to {max_limit}")
+    prefix = fold(row_prefix)
+    subjects = db.session.execute(
+            reads.subjects(site_id)
+            .where(
+                Subject.subject_folded >= prefix,
+                Subject.subject_folded < prefix + PREFIX_END
+                )
+            .order_by(Subject.connections_count.desc(), Subject.subject_folded)
+            .limit(limit)
+            )
+    subjects = [reads.subject_dict(x) for x in subjects]
     return subjects, 200
+
+
+@bp.route("/site/<int:site_id>/module/search", methods=["GET"])
+@check_user
+def search_get_list(site_id):
+    """
+    [User] Wyszukuje albumy i zdjęcia strony
+    """
+    query = request.json.get("query", "")
+    if not isinstance(query, str) or not query.strip():
+        abort(400, "The search query is required")
+    paginate = request.json.get("paginate", {})
+    page = paginate.get("page", 1)
+    per_page = paginate.get("per_page", 20)
+    if not isinstance(page, int) or page < 1:
+        abort(400, "The page value should be a positive number")
+    if not isinstance(per_page, int) or per_page < 1:
+        abort(400, "The per page value should be a positive number")
+
+    results, has_next = search(site_id, query, page, per_page)
+    pagination = {
+            "page": page,
+            "per_page": per_page,
+            "has_next": has_next
+            }
+    return {"pagination": pagination, "data": results}, 200